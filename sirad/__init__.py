@@ -10,10 +10,17 @@ doi:10.1145/3335150
 """
 
 import logging
-from importlib import resources
 from sirad import dialect
 
-__version__ = resources.read_text(__name__, "VERSION").strip()
+
+def __getattr__(name):
+    # Read the version on first use, to keep the package import fast.
+    if name == "__version__":
+        from importlib import resources
+        global __version__
+        __version__ = resources.read_text(__name__, "VERSION").strip()
+        return __version__
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 class Log(object):
     """
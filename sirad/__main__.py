@@ -10,13 +10,35 @@ import sirad
 import sys
 import traceback
 
+class VersionAction(argparse.Action):
+    """
+    Print the version, which is only read when requested.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print("SIRAD {}".format(sirad.__version__))
+        parser.exit()
+
+
+def shard(spec):
+    """
+    Parse a --shard argument.
+    """
+    from sirad import shards
+    try:
+        return shards.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
 
     parser = argparse.ArgumentParser(description=sirad.__doc__,
                                     formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("-v", "--version",
-                        action="version",
-                        version="SIRAD {}".format(sirad.__version__))
+                        action=VersionAction,
+                        nargs=0,
+                        help="show program's version number and exit")
     parser.add_argument("-n", type=int, default=1, help="number of threads to use in parallel")
     parser.add_argument("-q", "--quiet",
                         action="store_true",
@@ -24,6 +46,10 @@ def main():
     parser.add_argument("-d", "--debug",
                         action="store_true",
                         help="show all logging messages, including debugging output")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="profile each data set in process and each task in research, writing pstats files and a merged summary to DIR")
+    parser.add_argument("--profile-top", type=int, metavar="N",
+                        help="number of functions in the profile summary [default: PROFILE_TOP option]")
 
     subparsers = parser.add_subparsers()
 
@@ -35,12 +61,47 @@ def main():
 
     process = subparsers.add_parser("process")
     process.set_defaults(cmd="process")
+    process.add_argument("--engine", choices=("row", "batch"),
+                         help="split raw files one row at a time, or in vectorized batches [default: SPLIT_ENGINE option]")
+    process.add_argument("--shard", type=shard, metavar="I/N",
+                         help="only process the data sets assigned to shard I of N, balanced by raw file size")
+    process.add_argument("--sample", type=int, metavar="N",
+                         help="split a sample of N records from each data set into --sample-dir, without updating the process log")
+    process.add_argument("--sample-method", choices=("head", "random"), default="head",
+                         help="sample the first N records, or a uniform random sample [default: head]")
+    process.add_argument("--sample-dir", default="sample",
+                         help="directory for sampled files and summaries [default: sample]")
+
+    census = subparsers.add_parser("census-index")
+    census.set_defaults(cmd="census-index")
 
     research = subparsers.add_parser("research")
     research.set_defaults(cmd="research")
     research.add_argument("--seed", type=int, default=0, help="random seed for reproducible SIRAD ID [default: none]")
+    research.add_argument("--partitions", type=int, default=0,
+                          help="construct the SIRAD ID out-of-core by hash-partitioning PII to disk in this many partitions [default: in-memory]")
+    research.add_argument("--incremental", action="store_true",
+                          help="reuse SIRAD IDs from the persistent key index, loading PII only for new or changed data sets")
+    research.add_argument("--fuzzy", action="store_true",
+                          help="also link DOB/names without a valid SSN to similar DOB/names with one (in-memory SIRAD ID only)")
+    research.add_argument("--transitive", action="store_true",
+                          help="assign one SIRAD ID to each connected component of SSNs and DOB/names (in-memory SIRAD ID only)")
+    research.add_argument("--only", action="append", metavar="DATASET",
+                          help="only censuscode and attach this data set (can be repeated)")
+    research.add_argument("--stage", choices=("addresses", "siradid", "attach"),
+                          help="only run this stage, using the outputs of previous runs for the others")
+    research.add_argument("--force", action="store_true",
+                          help="rerun stages even if their inputs are unchanged since the last run")
+    research.add_argument("--sort", action="store_true",
+                          help="write research files in sirad_id order, with an index of each sirad_id's byte offset")
+    research.add_argument("--shard", type=shard, metavar="I/N",
+                          help="only censuscode and attach the data sets assigned to shard I of N (requires --seed)")
 
     args = parser.parse_args()
+    if getattr(args, "cmd", None) == "research" and args.shard and args.shard[1] > 1:
+        if not args.seed or args.incremental:
+            research.error("--shard requires --seed, so that every shard constructs the same SIRAD ID, "
+                           "and cannot be combined with --incremental")
 
     if "cmd" in args:
 
@@ -53,6 +114,13 @@ def main():
             logging.basicConfig(level=logging.INFO)
 
         from sirad import config
+        if getattr(args, "shard", None):
+            config.set_shard(*args.shard)
+        if args.profile:
+            from sirad import profiling
+            profiling.start(args.profile)
+            if args.profile_top:
+                config.set_option("PROFILE_TOP", args.profile_top)
 
         if args.cmd == "sources":
             config.parse_layouts()
@@ -70,8 +138,18 @@ def main():
             if nwarnings > 0:
                 sys.exit(1)
 
+        elif args.cmd == "process" and args.sample:
+            config.parse_layouts()
+            from sirad.sample import Sample
+            for dataset in config.DATASETS:
+                Sample(dataset, args.sample, args.sample_method, args.sample_dir)
+
         elif args.cmd == "process":
+            if not args.shard:
+                config.merge_process_logs()
             config.parse_layouts(process_log=True)
+            if args.engine:
+                config.set_option("SPLIT_ENGINE", args.engine)
             from sirad.process import Process
             if args.n > 1:
                 pool = multiprocessing.Pool(processes=args.n)
@@ -88,10 +166,18 @@ def main():
                             "".join(traceback.format_tb(e.__traceback__)))
                         )
 
+        elif args.cmd == "census-index":
+            from sirad.census import BuildIndex
+            BuildIndex()
+
         elif args.cmd == "research":
             config.parse_layouts()
             from sirad.research import Research
-            Research(args.n, args.seed)
+            Research(args.n, args.seed, args.partitions, args.incremental, args.fuzzy, args.transitive,
+                     only=args.only, stage=args.stage, force=args.force, sort=args.sort)
+
+        if args.profile:
+            profiling.summarize()
 
     else:
         parser.print_help()
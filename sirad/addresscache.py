@@ -0,0 +1,99 @@
+"""
+Persistent on-disk cache of usaddress parse results.
+
+Addresses recur across records, data sets and versions, so the street
+name, pre-directional and address number tagged by usaddress are stored
+in a SQLite database keyed by the cleaned, upper-cased address string.
+Entries record the run in which they were last used, and the least
+recently used entries are evicted when the cache exceeds its size cap.
+"""
+
+import os
+import sqlite3
+
+from sirad import config
+
+# SQLite limits the number of parameters in a single statement.
+_batch = 500
+
+
+class AddressCache(object):
+    """
+    Look up and store usaddress tags for address strings.
+    """
+
+    def __init__(self, path=None, size=None):
+        if path is None:
+            path = config.get_option("ADDRESS_CACHE")
+        if path is None:
+            path = os.path.join(config.get_option("PII_DIR"), "address_cache.sqlite")
+        # Shards on different nodes keep separate caches, since SQLite
+        # locking is unreliable on shared filesystems.
+        path = config.shard_path(path)
+        if size is None:
+            size = config.get_option("ADDRESS_CACHE_SIZE")
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS addresses (
+                address TEXT PRIMARY KEY,
+                street_name TEXT,
+                predirectional TEXT,
+                number TEXT,
+                used INTEGER)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS addresses_used ON addresses (used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS runs (run INTEGER)")
+        run = self.db.execute("SELECT MAX(run) FROM runs").fetchone()[0]
+        self.run = 1 if run is None else run + 1
+        self.db.execute("INSERT INTO runs VALUES (?)", (self.run,))
+        self.db.commit()
+
+    def get(self, addresses):
+        """
+        Return a dict of (street_name, predirectional, number) tags for the
+        addresses found in the cache, marking them as used in this run.
+        """
+        found = {}
+        for i in range(0, len(addresses), _batch):
+            batch = list(addresses[i:i+_batch])
+            params = ",".join("?" * len(batch))
+            for row in self.db.execute(
+                    "SELECT address, street_name, predirectional, number FROM addresses "
+                    "WHERE address IN ({})".format(params), batch):
+                found[row[0]] = row[1:]
+            self.db.execute("UPDATE addresses SET used = ? WHERE address IN ({})".format(params),
+                            [self.run] + batch)
+        self.db.commit()
+        self.hits += len(found)
+        self.misses += len(addresses) - len(found)
+        return found
+
+    def put(self, tags):
+        """
+        Store a dict of (street_name, predirectional, number) tags by address.
+        """
+        self.db.executemany("INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?, ?)",
+                            ((k,) + tuple(v) + (self.run,) for k, v in tags.items()))
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM addresses").fetchone()[0]
+
+    def close(self):
+        """
+        Evict the least recently used entries above the size cap and
+        close the database.
+        """
+        excess = len(self) - self.size
+        if excess > 0:
+            self.db.execute("DELETE FROM addresses WHERE address IN "
+                            "(SELECT address FROM addresses ORDER BY used LIMIT ?)", (excess,))
+            self.db.commit()
+            self.evicted = excess
+        self.db.close()
@@ -0,0 +1,229 @@
+"""
+Prebuilt look-up index for the census street and street number files.
+
+The index is a directory of sorted NumPy arrays that are memory-mapped
+when loaded, so that it can be shared by worker processes through the
+page cache. It is rebuilt whenever the census files' fingerprint changes.
+
+Each build is written to a new subdirectory, which meta.json then points
+to, so that arrays are never rewritten while another process has them
+mapped. Checking, building and loading the index hold a lock on its
+directory, so that concurrent workers or shards build it only once.
+"""
+
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+from contextlib import contextmanager
+from sirad import config, Log
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Street look-up keys combine a street name code and a 5-digit zip code.
+_zipbase = 100000
+
+_arrays = ("names", "zips", "street_keys", "street_blkgrp",
+           "range_keys", "range_offsets", "range_nums", "range_blkgrp")
+
+_index = None
+
+
+def fingerprint():
+    """
+    Fingerprint the census files by path, size and modification time.
+    """
+    h = hashlib.sha1()
+    for option in ("CENSUS_STREET_FILE", "CENSUS_STREET_NUM_FILE"):
+        path = os.path.abspath(config.get_option(option))
+        stat = os.stat(path)
+        h.update("{}|{}|{}\n".format(path, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+@contextmanager
+def _lock(path):
+    """
+    Hold an exclusive lock on the index directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    fd = os.open(path, os.O_RDONLY) if fcntl is not None else None
+    try:
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def BuildIndex():
+    """
+    Build the census index from the street and street number files.
+    """
+    path = config.get_option("CENSUS_INDEX_DIR")
+    with _lock(path):
+        _build(path)
+
+
+def _build(path):
+    info = Log(__name__, "CensusIndex").info
+
+    info("Loading lookup files")
+    streets = pd.read_csv(config.get_option("CENSUS_STREET_FILE"), low_memory=False)\
+                .drop_duplicates(["street", "zip"])
+    nums = pd.read_csv(config.get_option("CENSUS_STREET_NUM_FILE"), low_memory=False)\
+             .drop_duplicates(["street_num", "street", "zip"])
+    meta = {"fingerprint": fingerprint(), "streets": len(streets), "nums": len(nums)}
+
+    # Addresses are only matched on non-missing keys.
+    streets = streets[streets.street.notnull() & streets.zip.notnull()]
+    nums = nums[nums.street_num.notnull() & nums.street.notnull() & nums.zip.notnull()]
+
+    arrays = {}
+    arrays["names"] = np.unique(np.concatenate([streets.street.astype(str).values,
+                                                nums.street.astype(str).values]).astype(str))
+    arrays["zips"] = np.unique(streets.zip.astype(np.int64).values)
+
+    info("Building look-up for distinct street names")
+    keys = np.searchsorted(arrays["names"], streets.street.astype(str).values) * _zipbase + \
+           streets.zip.astype(np.int64).values
+    order = np.argsort(keys, kind="stable")
+    arrays["street_keys"] = keys[order]
+    arrays["street_blkgrp"] = pd.to_numeric(streets.blkgrp).values.astype(np.float64)[order]
+
+    info("Building range look-up for street nums")
+    keys = np.searchsorted(arrays["names"], nums.street.astype(str).values) * _zipbase + \
+           nums.zip.astype(np.int64).values
+    street_nums = nums.street_num.astype(np.int64).values
+    order = np.lexsort((street_nums, keys))
+    keys = keys[order]
+    arrays["range_keys"], offsets = np.unique(keys, return_index=True)
+    arrays["range_offsets"] = np.append(offsets, len(keys))
+    arrays["range_nums"] = street_nums[order]
+    arrays["range_blkgrp"] = pd.to_numeric(nums.blkgrp).values.astype(np.float64)[order]
+    meta["ranges"] = len(arrays["range_keys"])
+
+    build = tempfile.mkdtemp(prefix="build-", dir=path)
+    for name in _arrays:
+        np.save(os.path.join(build, name + ".npy"), arrays[name])
+    meta["dir"] = os.path.basename(build)
+
+    # Write the metadata last, so that an interrupted build is not used.
+    with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+    # Remove earlier builds. Processes that have them mapped keep reading
+    # the unlinked files until they reload.
+    for name in os.listdir(path):
+        if name.startswith("build-") and name != meta["dir"]:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+        elif name.endswith(".npy"):
+            os.unlink(os.path.join(path, name))
+    info("Done")
+
+
+class CensusIndex(object):
+    """
+    Memory-mapped census index with vectorized look-ups.
+    """
+
+    def __init__(self, path):
+        meta = _read_meta(path)
+        self.fingerprint = meta["fingerprint"]
+        self.nstreets = meta["streets"]
+        self.nnums = meta["nums"]
+        self.nranges = meta["ranges"]
+        path = os.path.join(path, meta.get("dir", ""))
+        for name in _arrays:
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+
+    @staticmethod
+    def _find(sorted_array, values):
+        """
+        Return the position of each value in a sorted array, or -1 if not found.
+        """
+        i = np.searchsorted(sorted_array, values)
+        found = i < len(sorted_array)
+        found[found] = sorted_array[i[found]] == values[found]
+        return np.where(found, i, -1)
+
+    def valid_zips(self, zips):
+        return self._find(self.zips, zips) >= 0
+
+    def encode(self, streets, zips):
+        """
+        Encode street names and zip codes as look-up keys, or -1 for
+        street names that are not in the census files.
+        """
+        codes = self._find(self.names, np.asarray(streets, dtype=str))
+        return np.where(codes >= 0, codes * _zipbase + zips, -1)
+
+    def street(self, keys):
+        """
+        Look up the block group for distinct street names.
+        """
+        i = self._find(self.street_keys, keys)
+        return np.where(i >= 0, self.street_blkgrp[np.maximum(i, 0)], np.nan)
+
+    def street_num(self, keys, street_nums):
+        """
+        Look up the block group for the nearest lower street number on the
+        street, or the lowest street number if the address is below the
+        range. Returns the block groups and whether the number matched exactly.
+        """
+        g = self._find(self.range_keys, keys)
+        found = g >= 0
+        g = g[found]
+        street_nums = street_nums[found]
+        start = self.range_offsets[g]
+        end = self.range_offsets[g + 1]
+        # Binary search within each street's range, in parallel.
+        lo = start.copy()
+        hi = end.copy()
+        while (lo < hi).any():
+            active = lo < hi
+            mid = (lo + hi) // 2
+            right = active & (self.range_nums[np.minimum(mid, len(self.range_nums) - 1)] <= street_nums)
+            lo = np.where(right, mid + 1, lo)
+            hi = np.where(active & ~right, mid, hi)
+        i = np.maximum(lo - 1, start)
+        blkgrp = np.full(len(keys), np.nan)
+        blkgrp[found] = self.range_blkgrp[i]
+        exact = np.zeros(len(keys), dtype=bool)
+        exact[found] = self.range_nums[i] == street_nums
+        return blkgrp, exact
+
+
+def load():
+    """
+    Load the census index, building it first if it is missing or
+    the census files have changed. The index is cached per process.
+    """
+    global _index
+    current = fingerprint()
+    if _index is None or _index.fingerprint != current:
+        path = config.get_option("CENSUS_INDEX_DIR")
+        with _lock(path):
+            meta = _read_meta(path)
+            if meta is None or meta["fingerprint"] != current:
+                Log(__name__, "CensusIndex").info("Census index is missing or out of date")
+                _build(path)
+            _index = CensusIndex(path)
+    return _index
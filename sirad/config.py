@@ -1,11 +1,14 @@
 """
 Configuration options
 """
+import glob
 import logging
 import os
+import pickle
 import sys
 import yaml
 
+from sirad import shards
 from sirad.dataset import Dataset
 
 # Available options with defaults set
@@ -18,6 +21,19 @@ _options = {
     "RESEARCH_DIR": "research",
     "CENSUS_STREET_FILE": "census/streets.csv",
     "CENSUS_STREET_NUM_FILE": "census/street_nums.csv",
+    "CENSUS_INDEX_DIR": "census/index",
+    "ADDRESS_CACHE": None,
+    "ADDRESS_CACHE_SIZE": 10000000,
+    "SIRAD_ID_INDEX": None,
+    "FUZZY_THRESHOLD": 0.9,
+    "FUZZY_MAX_BLOCK": 1000000,
+    "TRANSITIVE_MAX_SSNS": 5,
+    "SPLIT_ENGINE": "row",
+    "LAYOUT_CACHE": None,
+    "PROGRESS_FILE": None,
+    "PROGRESS_INTERVAL": 10,
+    "PROFILE_DIR": None,
+    "PROFILE_TOP": 25,
     "VERSION": 1,
     "PROJECT": "",
     "DATA_SALT": None,
@@ -31,6 +47,9 @@ NULL_VALUES = frozenset(("", "NULL", "null", "NA", "na", "N/A", "#N/A", "NaN", "
 LOADED = False
 DATASETS = []
 FINISHED = []
+SHARD = None
+
+_process_log_header = "DATASET,NROWS,ELAPSED\n"
 
 
 def get_path(name, subdir):
@@ -44,9 +63,36 @@ def get_path(name, subdir):
     return path
 
 
+def set_shard(index, count):
+    """
+    Run as shard index of count. Must be set before the config is loaded.
+    """
+    global SHARD
+    SHARD = (index, count)
+
+
+def shard_path(path):
+    """
+    Return the path of a file that is written separately by each shard.
+    """
+    return path if SHARD is None else shards.suffix(path, *SHARD)
+
+
+def primary_shard():
+    """
+    Return whether this run writes the outputs shared by all shards.
+    """
+    return SHARD is None or SHARD[0] == 1
+
+
+def _shard_process_logs(path):
+    return sorted(glob.glob(shards.suffix(path, "*", "*")))
+
+
 def load_process_log():
     """
-    Load an existing sirad.log to determine finished datasets.
+    Load an existing sirad.log, and the logs of any shards, to determine
+    finished datasets.
     """
     global FINISHED
     global _options
@@ -54,16 +100,69 @@ def load_process_log():
         _options["PROCESS_LOG"] = os.path.join(_options["DATA_DIR"],
                                                "{}_V{}".format(_options["PROJECT"], _options["VERSION"]),
                                                "process_log.csv")
-    if os.path.exists(_options["PROCESS_LOG"]):
-        with open(_options["PROCESS_LOG"]) as f:
-            FINISHED = frozenset([row.partition(",")[0] for row in f])
-    else:
-        d = os.path.dirname(_options["PROCESS_LOG"])
+    finished = []
+    for path in [_options["PROCESS_LOG"]] + _shard_process_logs(_options["PROCESS_LOG"]):
+        if os.path.exists(path):
+            with open(path) as f:
+                finished.extend(row.partition(",")[0] for row in f)
+    FINISHED = frozenset(finished)
+
+
+def log_process(name, nrows, elapsed):
+    """
+    Append a processed dataset to the process log, or to the shard's own
+    log when processing as a shard, creating the log if needed.
+    """
+    path = shard_path(get_option("PROCESS_LOG"))
+    if not os.path.exists(path):
+        d = os.path.dirname(path)
         if not os.path.exists(d):
             logging.info("Creating output directory: " + d)
             os.makedirs(d, exist_ok=True)
-        with open(_options["PROCESS_LOG"], "w") as f:
-            f.write("DATASET,NROWS,ELAPSED\n")
+        # Link the log into place with its header, so that concurrent
+        # processes never append before the header.
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(_process_log_header)
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+    with open(path, "a") as f:
+        print(name, nrows, "{:.3f}".format(elapsed), sep=",", file=f)
+
+
+def merge_process_logs():
+    """
+    Merge the logs of finished shards into the process log. Only call
+    this when no shards are running.
+    """
+    load_config()
+    path = _options.get("PROCESS_LOG")
+    paths = _shard_process_logs(path) if path else []
+    if not paths:
+        return
+    if os.path.exists(path):
+        with open(path) as f:
+            rows = f.readlines()
+    else:
+        rows = [_process_log_header]
+    names = set(row.partition(",")[0] for row in rows)
+    for p in paths:
+        logging.info("Merging process log " + p)
+        with open(p) as f:
+            for row in f:
+                name = row.partition(",")[0]
+                if name not in names:
+                    names.add(name)
+                    rows.append(row)
+    with open(path + ".tmp", "w") as f:
+        f.writelines(rows)
+    os.replace(path + ".tmp", path)
+    for p in paths:
+        os.unlink(p)
 
 
 def load_config():
@@ -106,19 +205,88 @@ def set_options(options):
     _options.update(options)
 
 
+def _layout_cache_key():
+    """
+    The cache depends on the sirad version, and on RAW_DIR, against which
+    Dataset sources are resolved.
+    """
+    from sirad import __version__
+    return (__version__, get_option("RAW_DIR"))
+
+
+def _load_layout_cache():
+    """
+    Load cached Dataset definitions by layout path, if they were cached
+    with the same key.
+    """
+    path = get_option("LAYOUT_CACHE")
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "rb") as f:
+            cache = pickle.load(f)
+    except Exception as e:
+        logging.debug("Ignoring unreadable layout cache {}: {}".format(path, e))
+        return {}
+    if cache.get("key") != _layout_cache_key():
+        return {}
+    return cache["layouts"]
+
+
+def _save_layout_cache(layouts):
+    path = get_option("LAYOUT_CACHE")
+    if not path:
+        return
+    try:
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump({"key": _layout_cache_key(), "layouts": layouts}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.debug("Unable to write layout cache {}: {}".format(path, e))
+
+
 def parse_layouts(process_log=False):
     """
-    Parse YAML layout files in LAYOUTS directory.
+    Parse YAML layout files in LAYOUTS directory. If LAYOUT_CACHE is set,
+    parsed Dataset definitions are cached there by layout path, modification
+    time and size.
+    When processing as a shard, only the shard's data sets are kept, which
+    are assigned before skipping finished data sets so that every shard
+    agrees on the assignment.
     """
     global DATASETS
-    for root, _, filenames in os.walk(get_option("LAYOUTS_DIR")):
-        for filename in filenames:
+    cache = _load_layout_cache()
+    changed = False
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    for root, dirnames, filenames in os.walk(get_option("LAYOUTS_DIR")):
+        # Skip hidden files and directories.
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            if filename.startswith("."):
+                continue
             name = os.path.join(root.partition("/")[2], os.path.splitext(filename)[0])
-            if process_log and name in FINISHED:
+            if process_log and SHARD is None and name in FINISHED:
                 logging.info("Found process log for {}".format(name))
             else:
-                logging.debug("Loading config for {}".format(name))
-                layout = yaml.safe_load(open(os.path.join(root, filename)))
-                DATASETS.append(Dataset(name, layout))
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                version = (name, stat.st_mtime_ns, stat.st_size)
+                if path not in cache or cache[path][0] != version:
+                    logging.debug("Loading config for {}".format(name))
+                    with open(path) as f:
+                        layout = yaml.load(f, Loader=loader)
+                    cache[path] = (version, Dataset(name, layout))
+                    changed = True
+                DATASETS.append(cache[path][1])
+    for path in [p for p in cache if not os.path.exists(p)]:
+        del cache[path]
+        changed = True
+    if changed:
+        _save_layout_cache(cache)
     DATASETS = sorted(DATASETS, key=lambda x: x.name)
+    if process_log and SHARD is not None:
+        DATASETS = shards.select(DATASETS, *SHARD)
+        for name in sorted(d.name for d in DATASETS if d.name in FINISHED):
+            logging.info("Found process log for {}".format(name))
+        DATASETS = [d for d in DATASETS if d.name not in FINISHED]
 
@@ -132,35 +132,41 @@ class Dataset(object):
                 reader = readers.csv_reader((x.replace('\x00', '') for x in f), self.header, delimiter=self.delimiter)
             return reader, f
 
+    def split_row(self, row):
+        """
+        Split a row of raw values into a data row and a pii row.
+        """
+        out_data = []
+        out_pii = []
+        append_data = []
+        append_pii = []
+        ssn_fields = []
+        for value, field in zip(row, self.fields):
+            if field.ssn:
+                value = "".join(c for c in str(value) if c.isdigit())
+                ssn_fields.append((value, field))
+            data_value = extract.data(value, field)
+            pii_value = extract.pii(value, field)
+            if data_value is not None:
+                out_data.append(data_value)
+            if pii_value is not None:
+                out_pii.append(pii_value)
+
+        for value, field in ssn_fields:
+            ssn_invalid = validate_ssn(value)
+            if field.data:
+                append_data.append(ssn_invalid)
+            if field.pii:
+                append_pii.append(ssn_invalid)
+
+        return out_data + append_data, out_pii + append_pii
+
     def split(self):
         """
         Split the raw data. Yields separate data rows and pii rows.
         """
         reader, file_handle = self.get_reader()
         for row in reader:
-            out_data = []
-            out_pii = []
-            append_data = []
-            append_pii = []
-            ssn_fields = []
-            for value, field in zip(row, self.fields):
-                if field.ssn:
-                    value = "".join(c for c in str(value) if c.isdigit())
-                    ssn_fields.append((value, field))
-                data_value = extract.data(value, field)
-                pii_value = extract.pii(value, field)
-                if data_value is not None:
-                    out_data.append(data_value)
-                if pii_value is not None:
-                    out_pii.append(pii_value)
-
-            for value, field in ssn_fields:
-                ssn_invalid = validate_ssn(value)
-                if field.data:
-                    append_data.append(ssn_invalid)
-                if field.pii:
-                    append_pii.append(ssn_invalid)
-
-            yield out_data + append_data, out_pii + append_pii
+            yield self.split_row(row)
 
         file_handle.close()
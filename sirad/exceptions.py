@@ -6,3 +6,6 @@ class UnsupportedFormatException(Exception):
 
 class EnocodingError(Exception):
     pass
+
+class TaskFailedException(Exception):
+    pass
@@ -0,0 +1,176 @@
+"""
+Fuzzy DOB/name linkage for the SIRAD ID.
+
+Records without a valid SSN are normally keyed by their exact DOB, last
+name and first name Soundex, and only take the SSN of records with the same
+exact DOB/name. Fuzzy linkage also fills their SSN from records with a valid
+SSN whose DOB/name is similar. Candidate pairs are only generated within
+blocks of distinct DOB/names that share the last name Soundex and birth year,
+or the first name Soundex and exact DOB, so the number of comparisons grows
+with the block sizes rather than the square of the number of records. Each
+pair is scored by the mean of the last name edit similarity, the DOB digit
+similarity and first name Soundex agreement, and an SSN is only filled if all
+of the matches above the threshold agree on it.
+"""
+
+import numpy as np
+import pandas as pd
+
+from sirad import config, Log
+from sirad.soundex import soundex
+
+# Names are compared on at most this many characters.
+_max_name = 20
+
+
+def _chars(values, width):
+    """
+    Convert strings to a 2-d array of character codes, padded with zeros.
+    """
+    values = np.asarray(values, dtype="U{}".format(width))
+    return values.view(np.uint32).reshape(len(values), width), np.char.str_len(values)
+
+
+def _edit_similarity(a, b):
+    """
+    Levenshtein similarity between pairs of strings, computed over all of the
+    pairs at once: 1 minus the edit distance over the longer length.
+    """
+    width = max(1, min(_max_name, max(map(len, np.concatenate([a, b])))))
+    a, la = _chars(a, width)
+    b, lb = _chars(b, width)
+    n = len(a)
+    rows = np.arange(n)
+    dist = np.where(la == 0, lb, 0)
+    prev = np.tile(np.arange(width + 1, dtype=np.int32), (n, 1))
+    for i in range(1, la.max(initial=0) + 1):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i
+        for j in range(1, width + 1):
+            cur[:, j] = np.minimum(np.minimum(prev[:, j], cur[:, j - 1]) + 1,
+                                   prev[:, j - 1] + (a[:, i - 1] != b[:, j - 1]))
+        dist = np.where(la == i, cur[rows, lb], dist)
+        prev = cur
+    longest = np.maximum(np.maximum(la, lb), 1)
+    return 1.0 - dist / longest
+
+
+def _date_similarity(a, b):
+    """
+    Similarity between pairs of YYYY-MM-DD dates: 1 minus the fraction of
+    differing digits, counting a swapped month and day as one digit.
+    """
+    a = pd.Series(a, dtype=object).str.replace("-", "", regex=False).values
+    b = pd.Series(b, dtype=object).str.replace("-", "", regex=False).values
+    ca, _ = _chars(a, 8)
+    cb, _ = _chars(b, 8)
+    differ = (ca != cb).sum(axis=1)
+    swapped = np.concatenate([cb[:, :4], cb[:, 6:], cb[:, 4:6]], axis=1)
+    differ = np.where((differ > 1) & (ca == swapped).all(axis=1), 1, differ)
+    return 1.0 - differ / 8.0
+
+
+def _pairwise(func, a, b, values):
+    """
+    Apply a pairwise similarity to category codes a and b, once per
+    distinct pair of values.
+    """
+    pairs, inverse = np.unique(np.stack([a, b], axis=1), axis=0, return_inverse=True)
+    if len(pairs) == 0:
+        return np.zeros(0)
+    return func(values[pairs[:, 0]], values[pairs[:, 1]])[inverse.ravel()]
+
+
+def _block_pairs(src, tgt, max_pairs):
+    """
+    Return the indexes of the source and target pairs that share a block,
+    skipping blocks (or -1, no block) with more than max_pairs pairs. Also
+    returns the number of skipped blocks.
+    """
+    order = np.argsort(tgt, kind="stable")
+    sorted_tgt = tgt[order]
+    lo = np.searchsorted(sorted_tgt, src, "left")
+    counts = np.searchsorted(sorted_tgt, src, "right") - lo
+    counts[src < 0] = 0
+    _, inverse, nsrc = np.unique(src, return_inverse=True, return_counts=True)
+    skipped = (nsrc[inverse] * counts) > max_pairs
+    counts[skipped] = 0
+    i = np.repeat(np.arange(len(src)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[np.repeat(lo, counts) + offset]
+    return i, j, len(np.unique(src[skipped]))
+
+
+def _lookup(values, codes):
+    """
+    Map category codes to values, with -1 for missing codes.
+    """
+    return np.where(codes >= 0, values[np.maximum(codes, 0)], -1) if len(values) else np.full(len(codes), -1)
+
+
+def FuzzyFill(dobn, ssn, valid, last_name, dob, first_sdx, last_names, dobs):
+    """
+    Find SSNs for DOB/names that have no record with a valid SSN. Takes the
+    per-record DOB/name key, SSN code and valid flag, and the category codes
+    of the last name, DOB and first name Soundex, along with the last name
+    and DOB categories. Returns an array indexed by DOB/name key of the
+    filled SSN code, or -1.
+    """
+    info = Log(__name__, "FuzzyFill").info
+    threshold = config.get_option("FUZZY_THRESHOLD")
+    max_pairs = config.get_option("FUZZY_MAX_BLOCK")
+    fill = np.full(dobn.max() + 1, -1, dtype=np.int64)
+
+    # Distinct DOB/names, with their components from their first record.
+    keys, first = np.unique(dobn, return_index=True)
+    first = first[keys >= 0]
+    keys = keys[keys >= 0]
+    with_ssn = (valid & (dobn >= 0))
+    has_ssn = np.zeros(dobn.max() + 1, dtype=bool)
+    has_ssn[dobn[with_ssn]] = True
+    sources = first[~has_ssn[keys]]
+    targets = np.unique(np.stack([dobn[with_ssn], ssn[with_ssn]], axis=1), axis=0)
+    info("Comparing", len(sources), "DOB/names without a valid SSN to", len(targets), "DOB/name/SSNs")
+    if len(sources) == 0 or len(targets) == 0:
+        return fill
+    targets_first = np.zeros(dobn.max() + 1, dtype=np.int64)
+    targets_first[keys] = first
+    targets_first = targets_first[targets[:, 0]]
+
+    # Block on last name Soundex and birth year, and on first name Soundex
+    # and exact DOB.
+    last_sdx = pd.factorize(pd.Series(last_names, dtype=object).map(soundex))[0]
+    year = pd.to_numeric(pd.Series(dobs, dtype=object).str.slice(0, 4), errors="coerce")
+    year = year.fillna(-1).astype(np.int64).values
+    idx = np.concatenate([sources, targets_first])
+    blockings = []
+    for codes in ((_lookup(last_sdx, last_name[idx]), _lookup(year, dob[idx])),
+                  (first_sdx[idx], dob[idx])):
+        valid_block = (codes[0] >= 0) & (codes[1] >= 0)
+        block = np.where(valid_block, pd.factorize(codes[0] * (codes[1].max() + 1) + codes[1])[0], -1)
+        blockings.append((block[:len(sources)], block[len(sources):]))
+    src, tgt, nskipped = [], [], 0
+    for src_block, tgt_block in blockings:
+        i, j, skipped = _block_pairs(src_block, tgt_block, max_pairs)
+        src.append(i)
+        tgt.append(j)
+        nskipped += skipped
+    pairs = np.unique(np.stack([np.concatenate(src), np.concatenate(tgt)], axis=1), axis=0)
+    info("Scoring", len(pairs), "candidate pairs, skipped", nskipped, "blocks over", max_pairs, "pairs")
+    if len(pairs) == 0:
+        return fill
+
+    a = sources[pairs[:, 0]]
+    b = targets_first[pairs[:, 1]]
+    names = pd.Series(last_names, dtype=object).str.upper().values
+    score = (_pairwise(_edit_similarity, last_name[a], last_name[b], names) +
+             _pairwise(_date_similarity, dob[a], dob[b], np.asarray(dobs, dtype=object)) +
+             (first_sdx[a] == first_sdx[b])) / 3.0
+    match = score >= threshold
+
+    # Only fill DOB/names whose matches all have the same SSN.
+    matched = np.unique(np.stack([dobn[a[match]], targets[pairs[match, 1], 1]], axis=1), axis=0)
+    single = np.bincount(matched[:, 0], minlength=len(fill))[matched[:, 0]] == 1
+    fill[matched[single, 0]] = matched[single, 1]
+    info("Filled SSNs for", single.sum(), "DOB/names")
+    return fill
@@ -0,0 +1,72 @@
+"""
+Per-data-set SIRAD ID arrays and look-ups.
+
+Research writes each data set's SIRAD IDs to the PII directory as a NumPy
+array indexed by pii_id, with -1 for pii_ids that are not in the data set.
+The arrays are memory-mapped when loaded, so that a look-up only touches
+the pages for the requested pii_ids of a single data set.
+"""
+
+import numpy as np
+import os
+
+from sirad import config, manifest
+
+# Memory-mapped arrays by path, along with their inode and modification time.
+_arrays = {}
+
+
+def _name(dataset):
+    return getattr(dataset, "name", dataset)
+
+
+def path(dataset):
+    """
+    Return the path of a data set's SIRAD ID array.
+    """
+    return "{}.sirad_id.npy".format(config.get_path(_name(dataset), "pii").rpartition(".")[0])
+
+
+def write(ids):
+    """
+    Write each data set's SIRAD IDs from a table of pii_id and sirad_id
+    indexed by data set name. Returns the paths by data set name.
+    """
+    paths = {}
+    for name, group in ids.groupby(level=0, observed=True, sort=False):
+        sirad_id = np.full(group.pii_id.max() + 1, -1, dtype=np.int64)
+        sirad_id[group.pii_id.values] = group.sirad_id.values
+        paths[name] = path(name)
+        # Replace the array, rather than truncating a file that may be mapped.
+        with manifest.BinaryOutput(paths[name], len(sirad_id) - 1, atomic=True) as f:
+            np.save(f, sirad_id)
+    return paths
+
+
+def load(dataset):
+    """
+    Memory-map a data set's SIRAD ID array, which is cached per process
+    until the file is replaced.
+    """
+    p = path(dataset)
+    stat = os.stat(p)
+    version = (stat.st_ino, stat.st_mtime_ns)
+    if p not in _arrays or _arrays[p][0] != version:
+        _arrays[p] = (version, np.load(p, mmap_mode="r"))
+    return _arrays[p][1]
+
+
+def lookup(dataset, pii_ids):
+    """
+    Look up the SIRAD IDs for an array of a data set's pii_ids. Records
+    without a valid SSN or DOB/name have a SIRAD ID of 0. Raises KeyError
+    for pii_ids that are not in the data set.
+    """
+    sirad_id = load(dataset)
+    pii_ids = np.asarray(pii_ids, dtype=np.int64)
+    valid = (pii_ids >= 0) & (pii_ids < len(sirad_id))
+    found = np.full(len(pii_ids), -1, dtype=np.int64)
+    found[valid] = sirad_id[pii_ids[valid]]
+    if (found < 0).any():
+        raise KeyError("pii_ids not in {}: {}".format(_name(dataset), pii_ids[found < 0][:10].tolist()))
+    return found
@@ -0,0 +1,256 @@
+"""
+Persistent key index for constructing the SIRAD ID incrementally.
+
+The index maps salted hashes of SSN and DOB/name keys to SIRAD IDs, and
+DOB/name keys to the single SSN they have been seen with, in a SQLite
+database in the PII directory. It also stores each data set's SIRAD IDs
+(as an array indexed by pii_id) along with a fingerprint of its PII file.
+A run only loads PII for data sets that are new or have changed, assigns
+new random IDs to keys that have not been seen before, and keeps the IDs of
+existing keys stable across runs and versions.
+
+Matches are not revisited for data sets that have not changed: a DOB/name
+that later turns out to have more than one SSN is no longer used to fill
+missing SSNs, but records that were already filled keep their IDs.
+"""
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+
+from sirad import config, manifest, Log
+from sirad.extract import salted_hash
+from sirad.soundex import soundex
+
+
+class KeyIndex(object):
+    """
+    Look up and assign SIRAD IDs for hashed keys.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = config.get_option("SIRAD_ID_INDEX")
+        if path is None:
+            path = os.path.join(config.get_option("PII_DIR"), "sirad_id_index")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.salt = config.get_option("PII_SALT")
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, sirad_id INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fills (dobn TEXT PRIMARY KEY, ssn TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS datasets (name TEXT PRIMARY KEY, fingerprint TEXT, stats TEXT)")
+        self.db.commit()
+
+    def hash(self, prefix, values):
+        """
+        Hash an array of distinct strings into salted keys.
+        """
+        return np.array([salted_hash(prefix + str(x), self.salt) for x in values], dtype=object)
+
+    def _select(self, sql, values):
+        """
+        Run a query joined against a temporary table of distinct values.
+        """
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS query (value TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM query")
+        self.db.executemany("INSERT OR IGNORE INTO query VALUES (?)", ((x,) for x in values))
+        return self.db.execute(sql).fetchall()
+
+    def add_pairs(self, dobn, ssn):
+        """
+        Record the SSN seen with each DOB/name key, marking DOB/names that
+        have been seen with more than one SSN as ambiguous.
+        """
+        pairs = pd.DataFrame({"dobn": dobn, "ssn": ssn}).drop_duplicates()
+        pairs.loc[pairs.dobn.duplicated(keep=False), "ssn"] = None
+        pairs = pairs.drop_duplicates("dobn")
+        existing = dict(self._select("SELECT dobn, ssn FROM fills JOIN query ON dobn = value", pairs.dobn))
+        update = []
+        for d, s in zip(pairs.dobn, pairs.ssn):
+            if d not in existing:
+                update.append((d, s))
+            elif existing[d] is not None and existing[d] != s:
+                update.append((d, None))
+        self.db.executemany("INSERT OR REPLACE INTO fills VALUES (?, ?)", update)
+        self.db.commit()
+
+    def fills(self, dobn):
+        """
+        Return a dict of the single SSN key matched to each DOB/name key.
+        """
+        return dict(self._select("SELECT dobn, ssn FROM fills JOIN query ON dobn = value "
+                                 "WHERE ssn IS NOT NULL", dobn))
+
+    def assign(self, keys):
+        """
+        Return a dict of SIRAD IDs for distinct keys, assigning new IDs at
+        random, above the existing IDs, to keys that have not been seen.
+        """
+        ids = dict(self._select("SELECT key, sirad_id FROM keys JOIN query ON key = value", keys))
+        new = sorted(set(keys) - set(ids))
+        start = self.db.execute("SELECT MAX(sirad_id) FROM keys").fetchone()[0] or 0
+        new_ids = start + 1 + np.random.permutation(len(new))
+        self.db.executemany("INSERT INTO keys VALUES (?, ?)", zip(new, new_ids.tolist()))
+        self.db.commit()
+        ids.update(zip(new, new_ids.tolist()))
+        return ids, len(new)
+
+    def _array_path(self, name):
+        return os.path.join(self.path, name + ".npy")
+
+    def load_dataset(self, name, fingerprint):
+        """
+        Return the stored SIRAD IDs and statistics for a data set, or None
+        if it has changed.
+        """
+        row = self.db.execute("SELECT fingerprint, stats FROM datasets WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] != fingerprint or not os.path.exists(self._array_path(name)):
+            return None
+        return np.load(self._array_path(name)), json.loads(row[1])
+
+    def save_dataset(self, name, fingerprint, sirad_id, stats):
+        np.save(self._array_path(name) + ".tmp.npy", sirad_id)
+        os.replace(self._array_path(name) + ".tmp.npy", self._array_path(name))
+        self.db.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?, ?)",
+                        (name, fingerprint, json.dumps(stats)))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def fingerprint(path):
+    """
+    Fingerprint a PII file by path, size and modification time.
+    """
+    stat = os.stat(path)
+    return "{}|{}|{}".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _hash_column(index, prefix, column):
+    """
+    Hash each distinct value of a categorical column, with None for missing.
+    """
+    hashed = np.append(index.hash(prefix, column.cat.categories), None)
+    return hashed[column.cat.codes.values]
+
+
+def _keys(index, df):
+    """
+    Hash the valid SSN and complete DOB/name keys for a data set's PII.
+    """
+    n = len(df)
+    ssn = np.full(n, None, dtype=object)
+    if "ssn" in df:
+        valid = (df.ssn_invalid.values == 0) & df.ssn.notnull().values
+        ssn[valid] = _hash_column(index, "s", df.ssn)[valid]
+    dobn = np.full(n, None, dtype=object)
+    if "first_name" in df:
+        valid = (df.first_name.notnull() & df.last_name.notnull() & df.dob.notnull()).values
+        first = df.first_name[valid].astype(str)
+        sdx = first.map(dict((name, soundex(name)) for name in first.unique()))
+        values = pd.Categorical(df.dob[valid].astype(str) + "_" + df.last_name[valid].astype(str) + "_" + sdx)
+        dobn[valid] = _hash_column(index, "d", pd.Series(values))
+    return ssn, dobn
+
+
+def IncrementalSiradID():
+    """
+    Construct the SIRAD ID with the same rules as SiradID, loading PII only
+    for data sets that are new or have changed since the last run.
+    """
+    from sirad.research import _load_pii, _peak_rss_mb
+
+    info = Log(__name__, "SiradID").info
+    index = KeyIndex()
+    results = {}
+    changed = []
+
+    for dataset in [d for d in config.DATASETS if d.has_pii]:
+
+        columns = frozenset(dataset.pii_header)
+        id_fields = ["pii_id"]
+        if "ssn" in columns:
+            id_fields += ["ssn", "ssn_invalid"]
+        if "first_name" in columns and "last_name" in columns and "dob" in columns:
+            id_fields += ["first_name", "last_name", "dob"]
+        if len(id_fields) == 1:
+            continue
+
+        path = config.get_path(dataset.name, "pii")
+        cached = index.load_dataset(dataset.name, fingerprint(path))
+        if cached is not None:
+            info("Reusing SIRAD_ID for unchanged", dataset.name)
+            sirad_id, stats = cached
+            pii_id = np.flatnonzero(sirad_id >= 0)
+            results[dataset.name] = (pii_id, sirad_id[pii_id], stats)
+            continue
+
+        info("Loading PII for", dataset.name)
+        df = _load_pii(dataset, id_fields)
+        if len(df) > 0:
+            ssn, dobn = _keys(index, df)
+            changed.append((dataset.name, fingerprint(path), df.pii_id.values, ssn, dobn))
+
+    if changed:
+        info("Matching DOB/names to distinct valid SSN")
+        valid = [pd.notnull(s) & pd.notnull(d) for _, _, _, s, d in changed]
+        index.add_pairs(np.concatenate([d[v] for (_, _, _, _, d), v in zip(changed, valid)]),
+                        np.concatenate([s[v] for (_, _, _, s, _), v in zip(changed, valid)]))
+        fills = index.fills(pd.unique(np.concatenate([d[pd.notnull(d)] for _, _, _, _, d in changed])))
+
+        info("Creating keys for valid SSNs and DOB/names")
+        keys = []
+        matched = []
+        for name, fp, pii_id, ssn, dobn in changed:
+            fill = pd.notnull(dobn)
+            fill[fill] = [x in fills for x in dobn[fill]]
+            matched.append(fill.copy())
+            fill &= pd.isnull(ssn)
+            key = ssn.copy()
+            key[fill] = [fills[x] for x in dobn[fill]]
+            valid_dobn = pd.isnull(key) & pd.notnull(dobn)
+            key[valid_dobn] = dobn[valid_dobn]
+            keys.append(key)
+
+        info("Assigning SIRAD_ID to keys")
+        ids, nnew = index.assign(pd.unique(np.concatenate([k[pd.notnull(k)] for k in keys])))
+        info("Assigned", nnew, "new SIRAD_IDs")
+        for (name, fp, pii_id, ssn, dobn), key, fill in zip(changed, keys, matched):
+            has_key = pd.notnull(key)
+            sirad_id = np.zeros(len(key), dtype=np.int64)
+            sirad_id[has_key] = [ids[k] for k in key[has_key]]
+            dense = np.full(pii_id.max() + 1, -1, dtype=np.int64)
+            dense[pii_id] = sirad_id
+            stats = {"n_all_pii": len(key),
+                     "n_ssn_fills": int(fill.sum()),
+                     "n_ssn_keys": int((has_key & (key != dobn)).sum()),
+                     "n_dobn_keys": int((has_key & (key == dobn)).sum()),
+                     "n_ids": int(has_key.sum())}
+            index.save_dataset(name, fp, dense, stats)
+            order = np.argsort(pii_id)
+            results[name] = (pii_id[order], sirad_id[order], stats)
+
+    index.close()
+
+    names = [d.name for d in config.DATASETS if d.name in results]
+    if len(names) == 0:
+        info("Not enough PII records to construct SIRAD ID")
+        return pd.DataFrame(columns=["dsn", "pii_id", "sirad_id"]).set_index("dsn")
+    pii_ids, sirad_ids, stats = zip(*[results[name] for name in names])
+
+    # Save SIRAD ID statistics to a file in the research output directory.
+    stats = pd.DataFrame(list(stats), index=names)
+    stats = stats.where(stats > 0)
+    stats["peak_mb"] = _peak_rss_mb()
+    with manifest.Output(config.get_path("sirad_id_stats", "research"), len(stats)) as f:
+        stats.to_csv(f, float_format="%g")
+    info("Done")
+
+    dsn = np.concatenate([np.full(len(p), i, dtype=np.int16) for i, p in enumerate(pii_ids)])
+    return pd.DataFrame({"dsn": pd.Categorical.from_codes(dsn, names),
+                         "pii_id": np.concatenate(pii_ids),
+                         "sirad_id": np.concatenate(sirad_ids)}).set_index("dsn")
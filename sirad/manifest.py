@@ -0,0 +1,218 @@
+"""
+Manifests of output files with inline content digests.
+
+Process and research outputs are written through a file object that hashes
+each buffered block on its way to disk, so the SHA-256 digest, byte size
+and row count of every file are known as soon as it is closed, without
+reading it back. Each versioned output directory has a manifest.json that
+records these for the files written to it, along with their modification
+times, so that downstream transfers and the research stage checks can
+skip unchanged files by comparing digests instead of rereading the data.
+"""
+
+import builtins
+import glob
+import hashlib
+import io
+import json
+import os
+import time
+import uuid
+
+from sirad import config, shards
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_blocksize = 1 << 20
+
+
+class _DigestStream(io.RawIOBase):
+    """
+    Raw binary stream that digests and counts the bytes written through it.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.lines = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.size
+
+    def write(self, b):
+        b = bytes(b)
+        self._f.write(b)
+        self.sha256.update(b)
+        self.size += len(b)
+        self.lines += b.count(b"\n")
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super(_DigestStream, self).close()
+
+
+class _Recorded(object):
+    """
+    Mixin for outputs that are recorded in the manifest when they are closed,
+    unless a with block exits with an exception or the file is garbage
+    collected without being closed, so that partial files have no entry.
+
+    An atomic output is written to a temporary file in the same directory,
+    which replaces the file at path when closed, so that processes reading
+    or memory-mapping the old file never see a partial one.
+    """
+
+    _failed = False
+    _tmp = None
+    _digest = None
+
+    def _open(self, path, atomic):
+        self.path = path
+        if not atomic:
+            return _DigestStream(builtins.open(path, "wb"))
+        self._tmp = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        return _DigestStream(builtins.open(self._tmp, "xb"))
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._failed = True
+        return super(_Recorded, self).__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        # Nothing was opened if the file could not be created.
+        if self._digest is None:
+            return
+        if not self.closed:
+            self._failed = True
+        super(_Recorded, self).__del__()
+
+    def close(self):
+        if not self.closed:
+            super(_Recorded, self).close()
+            if self._failed:
+                if self._tmp is not None:
+                    os.unlink(self._tmp)
+                return
+            if self._tmp is not None:
+                os.replace(self._tmp, self.path)
+            record(self.path, self._digest.sha256.hexdigest(), self._digest.size, self._rows())
+
+
+class Output(_Recorded, io.TextIOWrapper):
+    """
+    Text file for writing that records its digest, size and row count in
+    its directory's manifest when closed. The row count defaults to the
+    number of lines after the header, unless rows is set before closing.
+    """
+
+    def __init__(self, path, rows=None, atomic=False):
+        self.rows = rows
+        self._digest = self._open(path, atomic)
+        super(Output, self).__init__(io.BufferedWriter(self._digest, _blocksize))
+
+    def _rows(self):
+        return self.rows if self.rows is not None else max(self._digest.lines - 1, 0)
+
+
+class BinaryOutput(_Recorded, io.BufferedWriter):
+    """
+    Binary file for writing that records its digest and size in its
+    directory's manifest when closed.
+    """
+
+    def __init__(self, path, rows=None, atomic=False):
+        self.rows = rows
+        self._digest = self._open(path, atomic)
+        super(BinaryOutput, self).__init__(self._digest, _blocksize)
+
+    def _rows(self):
+        return self.rows
+
+
+def path(directory):
+    """
+    Return the path of the manifest for an output directory.
+    """
+    return config.shard_path(os.path.join(directory, "manifest.json"))
+
+
+def _read(path):
+    try:
+        with builtins.open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def read(directory):
+    """
+    Return the manifest entries by file name for an output directory,
+    including the entries written by each shard.
+    """
+    main = os.path.join(directory, "manifest.json")
+    manifest = {}
+    for p in [main] + sorted(glob.glob(shards.suffix(main, "*", "*"))):
+        for name, entry in _read(p).items():
+            if name not in manifest or entry["written"] > manifest[name]["written"]:
+                manifest[name] = entry
+    return manifest
+
+
+def record(filename, sha256, size, rows=None):
+    """
+    Record an output file's digest, size and row count in its directory's
+    manifest, holding a lock so that concurrent workers do not overwrite
+    each other's entries.
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    entry = {"sha256": sha256, "size": size, "rows": rows,
+             "mtime_ns": os.stat(filename).st_mtime_ns, "written": time.time()}
+    manifest_path = path(directory)
+    # Lock the directory itself, so that no lock file is left among the outputs.
+    lock = os.open(directory, os.O_RDONLY) if fcntl is not None else None
+    try:
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = _read(manifest_path)
+        manifest[name] = entry
+        tmp = "{}.{}.tmp".format(manifest_path, os.getpid())
+        with builtins.open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, manifest_path)
+    finally:
+        if lock is not None:
+            os.close(lock)
+
+
+def link(source, filename):
+    """
+    Record a hard link to an output file under the source's manifest entry,
+    if it has a current one.
+    """
+    entry = lookup(source)
+    if entry is not None:
+        record(filename, entry["sha256"], entry["size"], entry["rows"])
+
+
+def lookup(filename):
+    """
+    Return the manifest entry for a file if its size and modification time
+    are unchanged since it was written, otherwise None.
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    entry = read(directory).get(name)
+    if entry is None:
+        return None
+    stat = os.stat(filename)
+    if [entry["size"], entry["mtime_ns"]] != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    return entry
@@ -0,0 +1,237 @@
+"""
+Out-of-core construction of the SIRAD ID.
+
+PII is streamed from each data set and hash-partitioned to disk, first by
+DOB/name blocking key (so that every record needed to fill a missing SSN
+lands in the same partition) and then by the resulting SSN or DOB/name key
+(so that every record sharing a key lands in the same partition). Each
+partition is resolved independently, and only the final dsn/pii_id/sirad_id
+table is held in memory.
+"""
+
+import glob
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+from multiprocessing import Pool
+from sirad import config, manifest, Log
+from sirad.soundex import soundex
+
+# Number of PII rows to read at a time.
+_chunksize = 1000000
+
+
+def _path(name):
+    return config.get_path(os.path.join(config.shard_path("sirad_id_partitions"), name), "pii")
+
+
+def _partition_of(values, npartitions):
+    """
+    Deterministically assign string values to partitions (unlike the
+    built-in hash, this is stable across worker processes).
+    """
+    return pd.util.hash_array(values.fillna("").values.astype(object)) % np.uint64(npartitions)
+
+
+def _append(df, prefix, columns):
+    """
+    Append the rows of a DataFrame to partition files, using the
+    "partition" column to select the file.
+    """
+    for partition, group in df.groupby("partition"):
+        group[columns].to_csv(_path(prefix.format(partition)), sep="|", header=False, index=False, mode="a")
+
+
+def _count(dsn, mask):
+    return dsn[mask].value_counts()
+
+
+def _scatter(datasets, npartitions):
+    """
+    Stream the ID fields of each data set's PII file and partition rows by
+    DOB/name key, or by SSN for rows without a complete DOB/name.
+    Returns the number of rows per data set and whether any data set has
+    name/DOB fields.
+    """
+    info = Log(__name__, "SiradID").info
+    counts = {}
+    have_name_dob = False
+
+    for dsn, dataset in enumerate(datasets):
+
+        columns = frozenset(dataset.pii_header)
+        id_fields = ["pii_id"]
+        if "ssn" in columns:
+            id_fields += ["ssn", "ssn_invalid"]
+        if "first_name" in columns and "last_name" in columns and "dob" in columns:
+            id_fields += ["first_name", "last_name", "dob"]
+            have_name_dob = True
+        if len(id_fields) == 1:
+            continue
+
+        info("Partitioning PII for", dataset.name)
+        for chunk in pd.read_csv(config.get_path(dataset.name, "pii"),
+                                 sep="|",
+                                 usecols=id_fields,
+                                 dtype=str,
+                                 chunksize=_chunksize):
+            chunk["dsn"] = dsn
+            if "ssn" not in chunk.columns:
+                chunk["ssn"] = np.nan
+                chunk["ssn_invalid"] = "1"
+            chunk["dobn"] = None
+            if "first_name" in chunk.columns:
+                valid = chunk.first_name.notnull() & chunk.last_name.notnull() & chunk.dob.notnull()
+                names = chunk.loc[valid, "first_name"]
+                sdx = names.map(dict((name, soundex(name)) for name in names.unique()))
+                chunk.loc[valid, "dobn"] = chunk.dob[valid] + "_" + chunk.last_name[valid] + "_" + sdx
+            chunk["partition"] = _partition_of(chunk.dobn.fillna(chunk.ssn), npartitions)
+            _append(chunk, "a{:04d}", ["dsn", "pii_id", "ssn", "ssn_invalid", "dobn"])
+            counts[dsn] = counts.get(dsn, 0) + len(chunk)
+
+    return counts, have_name_dob
+
+
+def _resolve(partition, npartitions):
+    """
+    Fill missing SSNs with DOB/name matches within a partition, assign each
+    record an SSN or DOB/name key, and repartition the keyed records by key.
+    """
+    stats = {}
+    path = _path("a{:04d}".format(partition))
+    if not os.path.exists(path):
+        return stats
+
+    df = pd.read_csv(path, sep="|", names=["dsn", "pii_id", "ssn", "ssn_invalid", "dobn"],
+                     dtype={"dsn": int, "pii_id": int, "ssn": str, "ssn_invalid": int, "dobn": str})
+
+    # Keep distinct name/DOB/SSN, then drop name/DOBs that have more than one SSN.
+    valid = (df.ssn_invalid == 0) & df.dobn.notnull()
+    dob_names = df.loc[valid, ["dobn", "ssn"]]\
+                  .drop_duplicates()\
+                  .drop_duplicates("dobn", keep=False)\
+                  .set_index("dobn").ssn
+    fill = df.dobn.map(dob_names)
+    merged = fill.notnull()
+    df.loc[merged, "ssn"] = fill[merged]
+    df.loc[merged, "ssn_invalid"] = 0
+    stats["n_ssn_fills"] = _count(df.dsn, merged)
+
+    df["key"] = None
+    valid_ssn = df.ssn_invalid == 0
+    df.loc[valid_ssn, "key"] = "s" + df.loc[valid_ssn, "ssn"]
+    stats["n_ssn_keys"] = _count(df.dsn, valid_ssn)
+    valid_dobn = (~valid_ssn) & df.dobn.notnull()
+    df.loc[valid_dobn, "key"] = "d" + df.loc[valid_dobn, "dobn"]
+    stats["n_dobn_keys"] = _count(df.dsn, valid_dobn)
+
+    keyed = df.key.notnull()
+    stats["n_ids"] = _count(df.dsn, keyed)
+    df.loc[~keyed, ["dsn", "pii_id"]].to_csv(_path("z{:04d}".format(partition)), sep="|", header=False, index=False)
+    df = df[keyed].copy()
+    df["partition"] = _partition_of(df.key, npartitions)
+    _append(df, "b{{:04d}}.{:04d}".format(partition), ["dsn", "pii_id", "key"])
+    os.unlink(path)
+    return stats
+
+
+def _rank(partition):
+    """
+    Number the distinct keys within a partition. Returns the number of
+    distinct keys, and writes each record's local key number to disk.
+    """
+    paths = sorted(glob.glob(_path("b{:04d}.*".format(partition))))
+    if not paths:
+        return 0
+    df = pd.concat([pd.read_csv(path, sep="|", names=["dsn", "pii_id", "key"],
+                                dtype={"dsn": int, "pii_id": int, "key": str}) for path in paths],
+                   ignore_index=True)
+    df["key"], keys = pd.factorize(df.key)
+    df.to_csv(_path("c{:04d}".format(partition)), sep="|", header=False, index=False)
+    for path in paths:
+        os.unlink(path)
+    return len(keys)
+
+
+def PartitionedSiradID(nthreads=1, npartitions=16):
+    """
+    Construct the SIRAD ID with the same rules as the in-memory SiradID,
+    without holding all PII in memory at once.
+    """
+    from sirad.research import _peak_rss_mb
+
+    info = Log(__name__, "SiradID").info
+    datasets = [d for d in config.DATASETS if d.has_pii]
+    names = [d.name for d in datasets]
+    partitions = range(npartitions)
+
+    root = os.path.dirname(_path("a0000"))
+    if os.path.exists(root):
+        shutil.rmtree(root)
+
+    try:
+        counts, have_name_dob = _scatter(datasets, npartitions)
+
+        if len(counts) == 0:
+            info("Not enough PII records to construct SIRAD ID")
+            return pd.DataFrame(columns=["dsn", "pii_id", "sirad_id"]).set_index("dsn")
+
+        pool = Pool(processes=nthreads) if nthreads > 1 else None
+        map_ = pool.starmap if pool else lambda f, args: [f(*a) for a in args]
+
+        info("Resolving SSN and DOB/name keys in", npartitions, "partitions")
+        try:
+            results = map_(_resolve, [(p, npartitions) for p in partitions])
+
+            info("Numbering distinct keys in", npartitions, "partitions")
+            nkeys = map_(_rank, [(p,) for p in partitions])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        info("Generating SIRAD_ID as randomized dense rank over keys")
+        offsets = np.concatenate([[0], np.cumsum(nkeys)])
+        permutation = np.random.permutation(offsets[-1]) + 1
+        dsn, pii_id, sirad_id = [], [], []
+        for p in partitions:
+            path = _path("c{:04d}".format(p))
+            if os.path.exists(path):
+                df = pd.read_csv(path, sep="|", names=["dsn", "pii_id", "key"], dtype=np.int64)
+                dsn.append(df.dsn.values)
+                pii_id.append(df.pii_id.values)
+                sirad_id.append(permutation[offsets[p] + df.key.values])
+            path = _path("z{:04d}".format(p))
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                df = pd.read_csv(path, sep="|", names=["dsn", "pii_id"], dtype=np.int64)
+                dsn.append(df.dsn.values)
+                pii_id.append(df.pii_id.values)
+                sirad_id.append(np.zeros(len(df), dtype=np.int64))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    dsn = np.concatenate(dsn)
+    pii_id = np.concatenate(pii_id)
+    sirad_id = np.concatenate(sirad_id)
+    order = np.lexsort((pii_id, dsn))
+
+    # Combine per-partition statistics, labeled by data set name.
+    stats = pd.DataFrame(index=[names[i] for i in sorted(counts)])
+    stats["n_all_pii"] = pd.Series(counts).rename(lambda i: names[i])
+    columns = ["n_ssn_fills"] if have_name_dob else []
+    columns += ["n_ssn_keys", "n_dobn_keys"] if have_name_dob else ["n_ssn_keys"]
+    for column in columns + ["n_ids"]:
+        counts = [r[column] for r in results if column in r]
+        counts = pd.concat(counts).groupby(level=0).sum() if counts else pd.Series(dtype=int)
+        stats[column] = counts[counts > 0].rename(lambda i: names[i])
+    stats["peak_mb"] = _peak_rss_mb()
+    if config.primary_shard():
+        with manifest.Output(config.get_path("sirad_id_stats", "research"), len(stats)) as f:
+            stats.to_csv(f, float_format="%g")
+    info("Done")
+
+    return pd.DataFrame({"dsn": pd.Categorical.from_codes(dsn[order].astype(np.int16), names),
+                         "pii_id": pii_id[order],
+                         "sirad_id": sirad_id[order]}).set_index("dsn")
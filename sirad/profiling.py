@@ -0,0 +1,78 @@
+"""
+Profiling of process and research tasks.
+
+If PROFILE_DIR is set, each data set's Process call and each research task
+runs under cProfile in whichever process runs it, including pool and
+scheduler workers, and writes its statistics to a pstats file named for the
+task. The statistics of all tasks are merged into a summary of the top
+functions by cumulative and internal time.
+"""
+
+import cProfile
+import glob
+import io
+import os
+import pstats
+import re
+
+from contextlib import contextmanager
+from sirad import config, Log
+
+
+def _path(directory, name):
+    return os.path.join(directory, re.sub(r"[^\w.-]", "_", name) + ".pstats")
+
+
+def start(directory):
+    """
+    Profile tasks into directory, removing the statistics of earlier runs.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.pstats")):
+        os.unlink(path)
+    config.load_config()
+    config.set_option("PROFILE_DIR", directory)
+
+
+@contextmanager
+def task(name):
+    """
+    Profile the enclosed code as the named task, if profiling is enabled.
+    """
+    directory = config.get_option("PROFILE_DIR")
+    if not directory:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(_path(directory, name))
+
+
+def summarize(directory=None, top=None):
+    """
+    Merge the statistics of all profiled tasks, and write a summary of the
+    time in each task and the top functions to summary.txt. Returns the
+    path of the summary, or None if no tasks were profiled.
+    """
+    directory = directory or config.get_option("PROFILE_DIR")
+    top = top or config.get_option("PROFILE_TOP")
+    paths = sorted(glob.glob(os.path.join(directory, "*.pstats")))
+    if not paths:
+        return None
+    out = io.StringIO()
+    print("Task times:", file=out)
+    for path in paths:
+        print("{:10.3f}s  {}".format(pstats.Stats(path).total_tt, os.path.basename(path)[:-7]), file=out)
+    stats = pstats.Stats(*paths, stream=out)
+    for sort, label in (("cumulative", "cumulative"), ("tottime", "internal")):
+        print("\nTop {} functions by {} time across {} tasks:".format(top, label, len(paths)), file=out)
+        stats.sort_stats(sort).print_stats(top)
+    summary = os.path.join(directory, "summary.txt")
+    with open(summary, "w") as f:
+        f.write(out.getvalue())
+    Log(__name__, "Profile").info("Wrote summary of", len(paths), "profiled tasks to", summary)
+    return summary
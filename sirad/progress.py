@@ -0,0 +1,142 @@
+"""
+Progress and ETA reporting for long-running tasks.
+
+Tasks count rows (or other units) as they go, along with the bytes read
+from their input file where available. At most once per PROGRESS_INTERVAL
+seconds, a task logs a status line and, if PROGRESS_FILE is set, records its
+status in a JSON file shared by all tasks and worker processes, which
+external monitoring can poll.
+"""
+
+import datetime
+import json
+import os
+import time
+
+from sirad import config, Log
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _timestamp(t):
+    return datetime.datetime.fromtimestamp(t).isoformat(timespec="seconds")
+
+
+def read_status(path=None):
+    """
+    Return the status of all tasks recorded in the progress file.
+    """
+    path = path or config.get_option("PROGRESS_FILE")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {"tasks": {}}
+
+
+def _write_status(path, name, status):
+    """
+    Update the status of one task in the progress file, holding a lock
+    so that concurrent workers do not overwrite each other's updates.
+    """
+    with open(path + ".lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            tasks = read_status(path)["tasks"]
+            tasks[name] = status
+            with open(path + ".tmp", "w") as f:
+                json.dump({"updated": status["updated"], "tasks": tasks}, f, indent=1, sort_keys=True)
+            os.replace(path + ".tmp", path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class Progress(object):
+    """
+    Track the progress of a named task toward a total count, or toward the
+    size of its input file in bytes.
+    """
+
+    def __init__(self, name, total=None, total_bytes=None, unit="rows"):
+        self.name = name
+        self.total = total
+        self.total_bytes = total_bytes
+        self.unit = unit
+        self.count = 0
+        self.position = None
+        self.start = self.last = time.time()
+        self.interval = config.get_option("PROGRESS_INTERVAL")
+        self.path = config.get_option("PROGRESS_FILE")
+        self.info = Log(__name__, name).info
+        self._write("running")
+
+    def update(self, n, position=None):
+        """
+        Add n to the count, and record the current position in the input
+        file if known. Reports progress if the interval has elapsed.
+        """
+        self.count += n
+        if position is not None:
+            self.position = position
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.info(self.line())
+            self._write("running")
+
+    def fraction(self):
+        if self.total_bytes and self.position is not None:
+            return min(self.position / self.total_bytes, 1.0)
+        if self.total:
+            return min(self.count / self.total, 1.0)
+        return None
+
+    def status(self, state="running"):
+        now = time.time()
+        elapsed = now - self.start
+        fraction = self.fraction()
+        status = {"state": state,
+                  "pid": os.getpid(),
+                  "started": _timestamp(self.start),
+                  "updated": _timestamp(now),
+                  "elapsed": round(elapsed, 1),
+                  "unit": self.unit,
+                  "count": self.count,
+                  "total": self.total,
+                  "bytes": self.position,
+                  "total_bytes": self.total_bytes,
+                  "rate": round(self.count / elapsed, 1) if elapsed > 0 else None,
+                  "fraction": None if fraction is None else round(fraction, 4),
+                  "eta": None}
+        if state == "running" and fraction:
+            status["eta"] = round(elapsed * (1 - fraction) / fraction, 1)
+        return status
+
+    def line(self):
+        """
+        Format the current status as a single line.
+        """
+        status = self.status()
+        line = "{:,} {}".format(self.count, self.unit)
+        if status["fraction"] is not None:
+            line += " ({:.1%})".format(status["fraction"])
+        if status["rate"] is not None:
+            line += ", {:,.0f} {}/s".format(status["rate"], self.unit)
+        if status["eta"] is not None:
+            line += ", ETA {}".format(datetime.timedelta(seconds=round(status["eta"])))
+        return line
+
+    def done(self):
+        self._write("done")
+
+    def failed(self):
+        self._write("failed")
+
+    def _write(self, state):
+        if self.path:
+            _write_status(self.path, self.name, self.status(state))
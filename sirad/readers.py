@@ -6,7 +6,6 @@ Code borrowed/inspired from: https://github.com/wireservice/agate
 import csv
 from collections import namedtuple
 from datetime import datetime
-from openpyxl import load_workbook
 
 # Character mapping to remove control and protected characters (newlines and |)
 # for the output dialect, and to transliterate accented characters.
@@ -236,6 +235,7 @@ def xlsx_extract(cell):
         return str(cell.value).translate(char_mapping)
 
 def xlsx_reader(filename, header, **kwargs):
+    from openpyxl import load_workbook
     wb = load_workbook(filename=filename, read_only=True, keep_links=False)
     if header:
         mapping = dict((c.value.strip().upper(), i) for i, c in enumerate(next(wb.active.rows)))
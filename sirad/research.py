@@ -5,14 +5,51 @@ Create a research release.
 import numpy as np
 import os
 import pandas as pd
+import shutil
+import tempfile
 import usaddress
 
-from sirad import config, Log
+from pandas.api.types import union_categoricals
+from sirad import census, config, ids, manifest, scheduler, shards, sortindex, stages, unionfind, Log
+from sirad.addresscache import AddressCache
+from sirad.progress import Progress
 from sirad.soundex import soundex
-from multiprocessing import Process, Queue
+from multiprocessing import Pool
 
 _address_prefixes = ("home", "employer", "mailing", "employer1", "employer2", "employer3")
 
+# Compact dtypes for loading the ID fields from PII files.
+_pii_dtypes = {
+    "pii_id": "int64",
+    "ssn": "category",
+    "ssn_invalid": "int8",
+    "first_name": "category",
+    "last_name": "category",
+    "dob": "category"
+}
+
+# Number of PII rows to read at a time.
+_chunksize = 1000000
+
+# Number of distinct addresses per chunk when parsing in parallel.
+_parse_chunksize = 10000
+
+# Components of a distinct address for censuscoding.
+_address_key = ["zip5", "street", "street_num", "city"]
+
+# Number of data rows to attach at a time.
+_attach_chunksize = 100000
+
+# Stages at which an address is matched to a census block group (or dropped).
+_stages = ("with invalid zip code",
+           "with invalid street name",
+           "merged on distinct street name",
+           "with invalid street num",
+           "merged on distinct street name/num",
+           "merged on nearest street name/num",
+           "unmerged")
+_INVALID_ZIP, _INVALID_STREET, _STREET, _INVALID_NUM, _EXACT, _RANGE, _UNMERGED = range(len(_stages))
+
 
 def _split_address(x):
     """
@@ -25,209 +62,392 @@ def _split_address(x):
         return usaddress.tag("")[0]
 
 
-def _str_format(x):
+def _address_tags(x):
     """
-    Reformat NaN and floating point numbers for CSV output.
+    Return the street name, pre-directional and address number tags
+    for a full street address.
     """
-    if isinstance(x, float): return "{:.0f}".format(x)
-    return str(x)
+    tags = _split_address(x)
+    return tags.get("StreetName"), tags.get("StreetNamePreDirectional"), tags.get("AddressNumber")
 
 
-def Censuscode(dataset, prefix, addresses):
+def _street(tags):
     """
-    Determine the census blockgroup for an address based on
-    zip code, street name, and street number.
+    Combine address tags into a street name (including any pre-directional)
+    and an integer street number.
     """
-    info = Log(__name__, "Censuscoding", prefix, dataset.name).info
-    filename = "{}.censuscode.{}.csv".format(config.get_path(dataset.name, "pii").rpartition(".")[0], prefix)
-    logname = "{}.censuscode.{}.log".format(config.get_path(dataset.name, "research").rpartition(".")[0], prefix)
+    name, predirectional, number = tags
+    street = np.nan if name is None else name
+    if predirectional is not None:
+        street = np.nan if name is None else predirectional + " " + name
+    return street, (number if number is not None and number.isdigit() else np.nan)
+
+
+def _parse_chunk(values):
+    return [_address_tags(x) for x in values]
+
+
+def _parse_addresses(values, parsed, cache=None, pool=None, name="Addresses"):
+    """
+    Parse the distinct full street addresses in values, skipping any that
+    are already in the dict parsed, which is updated in place, or in the
+    persistent address cache. If a process pool is provided, large sets of
+    addresses are parsed in chunks across the pool. Returns a DataFrame of
+    street and street_num indexed by address.
+    """
+    values_new = [x for x in values if x not in parsed]
+    if values_new and cache is not None:
+        for x, tags in cache.get(values_new).items():
+            parsed[x] = _street(tags)
+        values_new = [x for x in values_new if x not in parsed]
+    tags = []
+    if values_new:
+        chunks = [values_new[i:i+_parse_chunksize] for i in range(0, len(values_new), _parse_chunksize)]
+        progress = Progress(name, total=len(values_new), unit="addresses")
+        for chunk in (pool.imap if pool is not None and len(chunks) > 1 else map)(_parse_chunk, chunks):
+            tags.extend(chunk)
+            progress.update(len(chunk))
+        progress.done()
+    tags = dict(zip(values_new, tags))
+    if cache is not None:
+        cache.put(tags)
+    parsed.update((x, _street(t)) for x, t in tags.items())
+    return pd.DataFrame([parsed[x] for x in values], index=values, columns=["street", "street_num"])
+
+
+def _address_columns(dataset, prefix):
+    """
+    Identify which address PII fields are present in the data set.
+    """
+    columns = frozenset(dataset.pii_header)
+    return dict((name, "{}_{}".format(prefix, name) in columns)
+                for name in ("zip5", "zip9", "city", "address", "street", "street_num"))
+
+
+def _can_censuscode(contains):
+    """
+    Census coding requires a zip code and street name at a minimum.
+    """
+    return (contains["zip5"] or contains["zip9"]) and (contains["address"] or contains["street"])
+
+
+def _load_addresses(dataset, prefix, parsed, cache=None, pool=None):
+    """
+    Load the address PII fields for an address prefix, restructured into
+    zip5, city, street and street_num columns. Returns None if there are
+    not enough address fields.
+    """
+    info = Log(__name__, "Addresses", prefix, dataset.name).info
+    address_fields = ["pii_id"]
+    contains = _address_columns(dataset, prefix)
+    if _can_censuscode(contains):
+        address_fields += sorted("{}_{}".format(prefix, name) for name in contains if contains[name])
+
+    if len(address_fields) == 1:
+        if sum(contains.values()) == 0:
+            info("No address PII columns")
+        else:
+            info("Not enough address PII columns ({})".format(str(contains)))
+        return None
+
+    # If address PII fields are present, load them from the PII file.
+    df = pd.read_csv(config.get_path(dataset.name, "pii"),
+                     sep="|",
+                     usecols=address_fields,
+                     low_memory=False)
+    if len(df) == 0:
+        info("No PII records")
+        return None
 
     zip5 = "{}_zip5".format(prefix)
     city = "{}_city".format(prefix)
     street = "{}_street".format(prefix)
     street_num = "{}_street_num".format(prefix)
 
-    # Clean city
-    addresses[city] = addresses[city].str.upper().str.extract("([A-Z ]+)", expand=False)
+    # Pad zip codes with leading 0s and use zip9 if zip5 is not available.
+    if contains["zip9"] and not contains["zip5"]:
+        df[zip5] = df["{}_zip9".format(prefix)].astype(str).str.pad(9, "left", "0").str.slice(0, 5)
+    else:
+        df[zip5] = df[zip5].astype(str).str.pad(5, "left", "0")
+
+    if contains["address"]:
+        address = df["{}_address".format(prefix)].str.upper().str.extract("([0-9A-Z ]+)", expand=False).fillna("")
+        values = address.unique()
+        info("Parsing", len(values), "distinct addresses")
+        address = _parse_addresses(values, parsed, cache, pool,
+                                   "Addresses:{}:{}".format(dataset.name, prefix)).loc[address]
+        df[street] = address.street.values
+        df[street_num] = address.street_num.values
+
+    if zip5 in df.columns and street in df.columns and street_num in df.columns:
+        if not contains["city"]:
+            df[city] = ""
+        return df[["pii_id", zip5, city, street, street_num]]
+    else:
+        info("Unable to restructure address PII columns (zip: {}, street: {}, street_num: {})".format(
+            zip5 in df.columns,
+            street in df.columns,
+            street_num in df.columns))
+        return None
 
-    N = [len(addresses)]
-    geo_level = ("blkgrp", "{}_blkgrp".format(prefix))
 
-    with open(logname, "w") as log:
+def _normalize(df, prefix):
+    """
+    Clean the address components for a prefix into the distinct address
+    used for censuscoding: integer zip code, upper-case city and street
+    name, and integer street number.
+    """
+    zip5 = df["{}_zip5".format(prefix)]
+    street_num = df["{}_street_num".format(prefix)]
+    if zip5.dtype == "O":
+        zip5 = zip5.str.extract("(\\d+)", expand=False)
+    if street_num.dtype == "O":
+        street_num = street_num.str.extract("(\\d+)", expand=False)
+    return pd.DataFrame({
+        "pii_id": df.pii_id.values,
+        "has_zip": df["{}_zip5".format(prefix)].notnull().values,
+        "zip5": pd.to_numeric(zip5).values,
+        "city": df["{}_city".format(prefix)].str.upper().str.extract("([A-Z ]+)", expand=False).values,
+        "street": df["{}_street".format(prefix)].str.upper().str.extract("([0-9A-Z ]+)", expand=False).values,
+        "street_num": pd.to_numeric(street_num).values
+    })
+
+
+def Censuscode(addresses):
+    """
+    Determine the census blockgroup for distinct addresses based on
+    zip code, street name, and street number. Returns the block group
+    and the stage at which each address was matched (or dropped).
+    """
+    index = census.load()
+    n = len(addresses)
+    blkgrp = np.full(n, np.nan)
+    stage = np.full(n, _INVALID_ZIP, dtype=np.int8)
+
+    # Filter addresses with valid integer zip codes.
+    zips = addresses.zip5.values
+    valid = ~np.isnan(zips)
+    valid[valid] = index.valid_zips(zips[valid].astype(np.int64))
+    stage[valid] = _INVALID_STREET
+
+    # Filter addresses with valid street names.
+    valid &= addresses.street.notnull().values
+    keys = np.full(n, -1, dtype=np.int64)
+    keys[valid] = index.encode(addresses.street.values[valid], zips[valid].astype(np.int64))
+
+    # Merge 1 on distinct street name.
+    blkgrp[valid] = index.street(keys[valid])
+    merged = valid & ~np.isnan(blkgrp)
+    stage[valid] = np.where(merged[valid], _STREET, _INVALID_NUM)
+
+    # Merge 2 on distinct street name/num, and merge 3 with street
+    # number range search, for addresses with valid integer street nums.
+    street_nums = addresses.street_num.values
+    remaining = valid & ~merged & ~np.isnan(street_nums)
+    b, exact = index.street_num(keys[remaining], street_nums[remaining].astype(np.int64))
+    blkgrp[remaining] = b
+    stage[remaining] = np.where(exact, _EXACT, np.where(np.isnan(b), _UNMERGED, _RANGE))
+
+    return blkgrp, stage
+
+
+def _censuscode_paths(dataset, prefix):
+    """
+    Return the paths of a data set's census codes and match statistics
+    for an address prefix.
+    """
+    return ("{}.censuscode.{}.csv".format(config.get_path(dataset.name, "pii").rpartition(".")[0], prefix),
+            "{}.censuscode.{}.log".format(config.get_path(dataset.name, "research").rpartition(".")[0], prefix))
 
-        info("Loading lookup files")
-        streets = pd.read_csv(config.get_option("CENSUS_STREET_FILE"), low_memory=False)\
-                    .rename(columns={geo_level[0]: geo_level[1]})\
-                    .drop_duplicates(["street", "zip"])
-        print(len(streets), "distinct street names", file=log)
-        nums = pd.read_csv(config.get_option("CENSUS_STREET_NUM_FILE"), low_memory=False)\
-                 .rename(columns={geo_level[0]: geo_level[1]})\
-                 .drop_duplicates(["street_num", "street", "zip"])
-        print(len(nums), "distinct street name/numbers", file=log)
-
-        info("Building range look-up for street nums")
-        num_lookup = {}
-        for index, group in nums.groupby(["street", "zip"]):
-            group = group.sort_values("street_num")
-            num_lookup[index] = (group["street_num"].values, group[geo_level[1]].values)
-        print(len(num_lookup), "look-ups for street number ranges", file=log)
-
-        info("Filtering records with non-missing zip codes")
-        addresses = addresses[addresses[zip5].notnull()]
-        N.append(len(addresses))
-        print(N[-1], "records with non-missing zip codes", file=log)
-
-        info("Filtering records with valid integer zip codes")
-        if addresses[zip5].dtype == "O":
-            addresses[zip5] = addresses[zip5].str.extract("(\d+)", expand=False)
-            addresses = addresses[addresses[zip5].notnull()]
-        addresses[zip5] = addresses[zip5].astype(int)
-        addresses = addresses[addresses[zip5].isin(streets.zip.unique())]
-        N.append(len(addresses))
-        print(N[-1], "records with valid integer zip codes", file=log)
-
-        info("Filtering records with valid street names")
-        addresses[street] = addresses[street].str.upper().str.extract("([0-9A-Z ]+)", expand=False)
-        addresses = addresses[addresses[street].notnull()]
-        N.append(len(addresses))
-        print(N[-1], "records with valid street names", file=log)
-
-        info("Merge 1 on distinct street name")
-        addresses = addresses.merge(streets,
-                                    how="left",
-                                    left_on=[street, zip5],
-                                    right_on=["street", "zip"],
-                                    validate="many_to_one")
-        assert len(addresses) == N[-1]
-        merged = addresses[geo_level[1]].notnull()
-        addresses.loc[merged, ["pii_id", city, zip5, geo_level[1]]].to_csv(filename, float_format="%.0f", index=False)
-        print("merged", merged.sum(), "records on distinct street name", file=log)
-
-        # Remove merged addresses.
-        addresses = addresses[~merged]
-        del addresses[geo_level[1]]
-        N.append(len(addresses))
-        print(N[-1], "records remaining", file=log)
-
-        # Keep records with valid integer street nums.
-        if addresses[street_num].dtype == "O":
-            addresses[street_num] = addresses[street_num].str.extract("(\d+)", expand=False)
-        addresses = addresses[addresses[street_num].notnull()]
-        addresses[street_num] = addresses[street_num].astype(int)
-        N.append(len(addresses))
-        print(N[-1], "records with valid integer street nums", file=log)
-
-        info("Merge 2 on distinct street name/num")
-        addresses = addresses.merge(nums,
-                                    how="left",
-                                    left_on=[street_num, street, zip5],
-                                    right_on=["street_num", "street", "zip"],
-                                    validate="many_to_one")
-        assert len(addresses) == N[-1]
-        merged = addresses[geo_level[1]].notnull()
-        addresses.loc[merged, ["pii_id", city, zip5, geo_level[1]]].to_csv(filename, float_format="%.0f", index=False, mode="a", header=False)
-        print("merged", merged.sum(), "records on distinct street name/num", file=log)
-
-        # Remove merged addresses.
-        addresses = addresses[~merged]
-        del addresses[geo_level[1]]
-        N.append(len(addresses))
-        print(N[-1], "records remaining", file=log)
-
-        info("Merge 3 with street number range search")
-        merged = []
-        for _, row in addresses.iterrows():
-            l = num_lookup.get((row[street], row[zip5]))
-            if l is not None:
-                i = np.searchsorted(l[0], row[street_num], side="right")
-                merged.append((row["pii_id"], row[city], row[zip5], l[1][max(0, i-1)]))
-        print("merged", len(merged), "records on nearest street name/num", file=log)
-        with open(filename, "a") as f:
-            for row in merged:
-                print(*row, sep=",", file=f)
-        N.append(N[-1] - len(merged))
-        print(N[-1], "records remain unmerged", file=log)
-        print("overall match rate: {:.1f}%".format(100.0 * (N[0] - (N[0] - N[2]) - N[-1]) / N[0]), file=log)
 
+def _write_censuscode(dataset, prefix, df, addresses):
+    """
+    Scatter the censuscoded distinct addresses back to a data set's PII
+    records, and write the census codes and match statistics.
+    """
+    info = Log(__name__, "Censuscoding", prefix, dataset.name).info
+    filename, logname = _censuscode_paths(dataset, prefix)
+    index = census.load()
+
+    stage = addresses.stage.values[df.address.values]
+    out = pd.DataFrame({
+        "pii_id": df.pii_id.values,
+        "{}_city".format(prefix): addresses.city.values[df.address.values],
+        "{}_zip5".format(prefix): addresses.zip5.values[df.address.values],
+        "{}_blkgrp".format(prefix): addresses.blkgrp.values[df.address.values]
+    })
+    # Write records in the order they were merged.
+    out = out[np.isin(stage, (_STREET, _EXACT, _RANGE))]
+    out = out.iloc[np.argsort(stage[np.isin(stage, (_STREET, _EXACT, _RANGE))], kind="stable")]
+    with manifest.Output(filename, len(out)) as f:
+        out.to_csv(f, float_format="%.0f", index=False)
+
+    counts = np.bincount(stage, minlength=len(_stages))
+    N = [len(df), df.has_zip.sum()]
+    N.append(N[0] - counts[_INVALID_ZIP])
+    N.append(N[2] - counts[_INVALID_STREET])
+    with open(logname, "w") as log:
+        print(index.nstreets, "distinct street names", file=log)
+        print(index.nnums, "distinct street name/numbers", file=log)
+        print(index.nranges, "look-ups for street number ranges", file=log)
+        print(N[1], "records with non-missing zip codes", file=log)
+        print(N[2], "records with valid integer zip codes", file=log)
+        print(N[3], "records with valid street names", file=log)
+        print("merged", counts[_STREET], "records on distinct street name", file=log)
+        print(N[3] - counts[_STREET], "records remaining", file=log)
+        print(N[3] - counts[_STREET] - counts[_INVALID_NUM], "records with valid integer street nums", file=log)
+        print("merged", counts[_EXACT], "records on distinct street name/num", file=log)
+        print(counts[_RANGE] + counts[_UNMERGED], "records remaining", file=log)
+        print("merged", counts[_RANGE], "records on nearest street name/num", file=log)
+        print(counts[_UNMERGED], "records remain unmerged", file=log)
+        print("overall match rate: {:.1f}%".format(100.0 * (N[2] - counts[_UNMERGED]) / N[0]), file=log)
     info("Done")
 
 
-def Addresses(dataset):
+def Addresses(datasets, nthreads=1):
     """
-    Identify and clean address PII fields and perform censuscoding
-    if sufficient address components are available.
+    Identify and clean address PII fields across all data sets and
+    address prefixes, then perform censuscoding once per distinct address
+    if sufficient address components are available. Address parsing uses
+    nthreads processes.
     """
-    columns = frozenset(dataset.pii_header)
-    assert "pii_id" in columns
-    output = []
-
-    # Loop over address type.
-    for prefix in _address_prefixes:
+    info = Log(__name__, "Addresses").info
+    parsed = {}
+    frames = []
+    distinct = []
+    cache = AddressCache() if config.get_option("ADDRESS_CACHE_SIZE") else None
+    pool = Pool(processes=nthreads) if nthreads > 1 else None
+
+    for dataset in datasets:
+        assert "pii_id" in dataset.pii_header
+        # Loop over address type.
+        for prefix in _address_prefixes:
+            df = _load_addresses(dataset, prefix, parsed, cache, pool)
+            if df is not None:
+                df = _normalize(df, prefix)
+                # Number the distinct addresses within the data set.
+                df["address"] = df.groupby(_address_key, dropna=False, sort=False).ngroup().values
+                distinct.append(df.drop_duplicates(_address_key)[_address_key + ["address"]])
+                frames.append((dataset, prefix, df[["pii_id", "has_zip", "address"]]))
+
+    if cache is not None:
+        cache.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if len(frames) == 0:
+        return
+
+    info("Collecting distinct addresses")
+    addresses = pd.concat([d[_address_key] for d in distinct], ignore_index=True)\
+                  .drop_duplicates()\
+                  .reset_index(drop=True)
+    addresses["id"] = addresses.index
+    nrecords = sum(len(df) for _, _, df in frames)
+    info("Censuscoding", len(addresses), "distinct addresses for", nrecords, "records")
+    addresses["blkgrp"], addresses["stage"] = Censuscode(addresses)
+
+    with open(config.shard_path(config.get_path("censuscode", "research").rpartition(".")[0] + ".log"), "w") as log:
+        print(len(parsed), "distinct full street addresses", file=log)
+        if cache is not None:
+            print(cache.hits, "address cache hits", file=log)
+            print(cache.misses, "address cache misses parsed with usaddress", file=log)
+            print(cache.evicted, "address cache entries evicted", file=log)
+        print(len(addresses), "distinct addresses censuscoded for", nrecords, "records", file=log)
+        for code, stage in enumerate(_stages):
+            print((addresses.stage == code).sum(), "distinct addresses", stage, file=log)
+
+    # Scatter the census codes back to each data set and prefix.
+    for (dataset, prefix, df), d in zip(frames, distinct):
+        d = d.merge(addresses[_address_key + ["id"]], on=_address_key, how="left", validate="one_to_one")
+        lookup = np.empty(len(d), dtype=np.int64)
+        lookup[d.address.values] = d.id.values
+        df = df.assign(address=lookup[df.address.values])
+        _write_censuscode(dataset, prefix, df, addresses)
+
+
+def _peak_rss_mb():
+    """
+    Return the peak resident memory of the current process in MB.
+    """
+    try:
+        import resource
+    except ImportError:
+        return np.nan
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
 
-        info = Log(__name__, "Addresses", prefix, dataset.name).info
 
-        address_fields = ["pii_id"]
+def _concat_categorical(parts):
+    """
+    Concatenate Series that may be categorical, unioning their categories
+    so that the result stays categorical.
+    """
+    if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+        return pd.Series(union_categoricals(parts, ignore_order=True))
+    return pd.concat(parts, ignore_index=True)
 
-        # Identify which address PII fields are present in the data set.
-        contains = dict((name, "{}_{}".format(prefix, name) in columns)
-                         for name in ("zip5", "zip9", "city", "address", "street", "street_num"))
 
-        # Census coding requires a zip code and street name at a minimum
-        if (contains["zip5"] or contains["zip9"]) and (contains["address"] or contains["street"]):
-            address_fields += sorted("{}_{}".format(prefix, name) for name in contains if contains[name])
+def _load_pii(dataset, id_fields):
+    """
+    Load the ID fields from a dataset's PII file in chunks, using compact
+    dtypes and categorical string columns.
+    """
+    chunks = pd.read_csv(config.get_path(dataset.name, "pii"),
+                         sep="|",
+                         usecols=id_fields,
+                         dtype=dict((f, _pii_dtypes[f]) for f in id_fields),
+                         chunksize=_chunksize)
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=id_fields)
+    return pd.DataFrame(dict((f, _concat_categorical([c[f] for c in chunks]).values) for f in id_fields))
+
+
+def _codes(column, n):
+    """
+    Return the integer category codes for a column, or -1 for every row
+    if the column is missing.
+    """
+    if column is None:
+        return np.full(n, -1, dtype=np.int64)
+    return column.cat.codes.values.astype(np.int64)
 
-        # If address PII fields are present, load them from the PII file.
-        if len(address_fields) > 1:
-            df = pd.read_csv(config.get_path(dataset.name, "pii"),
-                             sep="|",
-                             usecols=address_fields,
-                             low_memory=False)
 
-            if len(df) > 0:
-                zip5 = "{}_zip5".format(prefix)
-                city = "{}_city".format(prefix)
-                street = "{}_street".format(prefix)
-                street_num = "{}_street_num".format(prefix)
-
-                # Pad zip codes with leading 0s and use zip9 if zip5 is not available.
-                if contains["zip9"] and not contains["zip5"]:
-                    df[zip5] = df["{}_zip9".format(prefix)].astype(str).str.pad(9, "left", "0").str.slice(0, 5)
-                else:
-                    df[zip5] = df[zip5].astype(str).str.pad(5, "left", "0")
-
-                if contains["address"]:
-                    address = pd.DataFrame(df["{}_address".format(prefix)].str.upper().str.extract("([0-9A-Z ]+)", expand=False).fillna("").apply(_split_address).tolist())
-                    if "StreetNamePreDirectional" in address.columns:
-                        df[street] = np.where(address.StreetNamePreDirectional.notnull(), address.StreetNamePreDirectional + " " + address.StreetName, address.StreetName)
-                    else:
-                        df[street] = address.StreetName
-                    df[street_num] = np.where(address.AddressNumber.str.isdigit(), address.AddressNumber, np.nan)
-
-                if zip5 in df.columns and street in df.columns and street_num in df.columns:
-                    if not contains["city"]:
-                        df[city] = ""
-                    Censuscode(dataset, prefix, df[["pii_id", zip5, city, street, street_num]])
-                else:
-                    info("Unable to restructure address PII columns (zip: {}, street: {}, street_num: {})".format(
-                        zip5 in df.columns,
-                        street in df.columns,
-                        street_num in df.columns))
-            else:
-                info("No PII records")
-        else:
-            if sum(contains.values()) == 0:
-                info("No address PII columns")
-            else:
-                info("Not enough address PII columns ({})".format(str(contains)))
+def _combine_codes(*codes):
+    """
+    Combine several integer code arrays into a single surrogate key, numbered
+    in order of first appearance, with -1 where any component is missing.
+    """
+    valid = np.ones(len(codes[0]), dtype=bool)
+    for c in codes:
+        valid &= (c >= 0)
+    combined = np.full(len(codes[0]), -1, dtype=np.int64)
+    key = np.zeros(valid.sum(), dtype=np.int64)
+    for c in codes:
+        key, _ = pd.factorize(key * (c.max() + 1) + c[valid])
+    combined[valid] = key
+    return combined
+
+
+def _count(dsn, mask, names):
+    """
+    Count rows per data set for a boolean mask, omitting data sets with no rows.
+    """
+    counts = pd.Series(np.bincount(dsn[mask], minlength=len(names)), index=names)
+    return counts[counts > 0]
 
 
-def SiradID():
+def SiradID(fuzzy=False, transitive=False):
     """
     Stack PII from all data sets to construct a global anonymous ID
-    called the SIRAD ID.
+    called the SIRAD ID. With fuzzy linkage, DOB/names without a valid SSN
+    also take the SSN of similar DOB/names (see sirad.fuzzy). With
+    transitive linkage, SSNs and DOB/names that appear on the same record
+    are joined, and each connected component gets one SIRAD ID.
     """
     info = Log(__name__, "SiradID").info
-    datasets = set()
+    datasets = []
     pii = []
     have_name_dob = False
 
@@ -249,181 +469,483 @@ def SiradID():
         # Either the SSN or name/DOB fields must be available to construct
         # a SIRAD ID for the dataset.
         if len(id_fields) > 1:
-            df = pd.read_csv(config.get_path(dataset.name, "pii"),
-                             sep="|",
-                             usecols=id_fields,
-                             low_memory=False)
+            df = _load_pii(dataset, id_fields)
             if len(df) > 0:
                 if "first_name" in id_fields:
-                    # Convert first name to Soundex value.
-                    df["first_sdx"] = np.nan
-                    valid_name = df.first_name.notnull()
-                    df.loc[valid_name, "first_sdx"] = df.loc[valid_name, "first_name"].apply(soundex)
-                df["dsn"] = dataset.name
-                datasets.add(dataset.name)
+                    # Convert first name to Soundex value, once per distinct name.
+                    sdx = pd.Categorical(df.first_name.cat.categories.map(soundex))
+                    codes = df.first_name.cat.codes.values
+                    df["first_sdx"] = pd.Categorical.from_codes(np.where(codes >= 0, sdx.codes[codes], -1),
+                                                                sdx.categories)
+                datasets.append(dataset.name)
                 pii.append(df)
 
     if len(pii) == 0:
         info("Not enough PII records to construct SIRAD ID")
-
-    else:
-        # Keep track of statistics while constructing the SIRAD ID.
-        stats = pd.DataFrame(index=datasets)
-
-        info("Concatenating PII")
-        pii = pd.concat(pii, ignore_index=True, sort=False)
-        stats["n_all_pii"] = pii["dsn"].value_counts()
-
-        if have_name_dob:
-
-            info("Matching DOB/names to distinct valid SSN")
-            valid = ((pii.ssn_invalid == 0) &
-                     (pii.dob.notnull() & pii.last_name.notnull() & pii.first_sdx.notnull()))
-            # Keep first record for distinct name/DOB/SSN,
-            # then drop records that have more than one SSN per name/DOB
-            dob_names = pii.loc[valid]\
-                           .drop_duplicates(["dob", "last_name", "first_sdx", "ssn"])\
-                           .drop_duplicates(["dob", "last_name", "first_sdx"], keep=False)
-
-            info("Filling missing SSNs with DOB/name match")
-            pii = pii.merge(dob_names,
-                            on=["dob", "last_name", "first_sdx"],
-                            how="left",
-                            suffixes=("", "_dob_names"))
-            merged = pii.ssn_dob_names.notnull()
-            pii.loc[merged, "ssn"] = pii.loc[merged, "ssn_dob_names"]
-            pii.loc[merged, "ssn_invalid"] = 0
-            stats["n_ssn_fills"] = pii.loc[merged, "dsn"].value_counts()
-
-        info("Creating keys for valid SSNs")
-        pii["key"] = np.nan
-        valid_ssn = pii.ssn_invalid == 0
-        pii.loc[valid_ssn, "key"] = pii.loc[valid_ssn, "ssn"]
-        stats["n_ssn_keys"] = pii.loc[valid_ssn, "dsn"].value_counts()
-
-        if have_name_dob:
-
-            info("Creating keys for valid DOB/names")
-            valid_dobn = (~valid_ssn) & pii.dob.notnull() & pii.last_name.notnull() & pii.first_sdx.notnull()
-            pii.loc[valid_dobn, "key"] = pii.loc[valid_dobn].apply(lambda x: "{}_{}_{}".format(x.dob, x.last_name, x.first_sdx), axis=1)
-            stats["n_dobn_keys"] = pii.loc[valid_dobn, "dsn"].value_counts()
-
-        info("Generating SIRAD_ID as randomized dense rank over keys")
-        key = pii.key[pii.key.notnull()].unique()
-        np.random.shuffle(key)
-        sirad_id = pd.DataFrame({"key": key, "sirad_id": np.arange(1, len(key)+1)})
-        pii = pii.merge(sirad_id, on="key", how="left")
-        stats["n_ids"] = pii.loc[pii.sirad_id.notnull(), "dsn"].value_counts()
-
-        pii["sirad_id"] = pii.sirad_id.fillna(0).astype(int)
-        pii = pii[["dsn", "pii_id", "sirad_id"]].set_index("dsn")
-
-        # Save SIRAD ID statistics to a file in the research output directory.
-        stats.to_csv(config.get_path("sirad_id_stats", "research"), float_format="%g")
-        info("Done")
+        return pd.DataFrame(columns=["dsn", "pii_id", "sirad_id"]).set_index("dsn")
+
+    # Keep track of statistics while constructing the SIRAD ID.
+    stats = pd.DataFrame(index=datasets)
+    pii_mb = [df.memory_usage(deep=True).sum() / 1048576.0 for df in pii]
+
+    info("Concatenating PII")
+    dsn = np.concatenate([np.full(len(df), i, dtype=np.int16) for i, df in enumerate(pii)])
+    n = len(dsn)
+    stats["n_all_pii"] = _count(dsn, np.ones(n, dtype=bool), datasets)
+    pii_id = np.concatenate([df.pii_id.values for df in pii])
+    ssn_invalid = np.concatenate([df.ssn_invalid.values if "ssn_invalid" in df else np.ones(len(df), dtype=np.int8)
+                                  for df in pii])
+    columns = {}
+    for f in ("ssn", "last_name", "dob", "first_sdx"):
+        parts = [df[f] if f in df else pd.Series(pd.Categorical.from_codes(np.full(len(df), -1), []))
+                 for df in pii]
+        if any(f in df for df in pii):
+            columns[f] = _concat_categorical(parts)
+        else:
+            columns[f] = None
+    del pii
+
+    info("Encoding integer surrogate keys")
+    ssn = _codes(columns["ssn"], n)
+    if have_name_dob:
+        dobn = _combine_codes(_codes(columns["dob"], n),
+                              _codes(columns["last_name"], n),
+                              _codes(columns["first_sdx"], n))
+        if fuzzy:
+            names = dict((f, (_codes(columns[f], n), columns[f].cat.categories.values))
+                         for f in ("last_name", "dob", "first_sdx"))
+    del columns
+
+    if have_name_dob:
+
+        info("Matching DOB/names to distinct valid SSN")
+        valid = (ssn_invalid == 0) & (dobn >= 0)
+        # Keep distinct name/DOB/SSN, then drop name/DOBs that have more
+        # than one SSN.
+        pairs = np.unique(dobn[valid] * (ssn.max() + 2) + (ssn[valid] + 1))
+        pair_dobn = pairs // (ssn.max() + 2)
+        pair_ssn = pairs % (ssn.max() + 2) - 1
+        single = np.bincount(pair_dobn, minlength=dobn.max() + 1)[pair_dobn] == 1
+        fill = np.full(dobn.max() + 1, -1, dtype=np.int64)
+        fill[pair_dobn[single]] = pair_ssn[single]
+
+        info("Filling missing SSNs with DOB/name match")
+        merged = np.zeros(n, dtype=bool)
+        merged[dobn >= 0] = fill[dobn[dobn >= 0]] >= 0
+        ssn[merged] = fill[dobn[merged]]
+        ssn_invalid[merged] = 0
+        stats["n_ssn_fills"] = _count(dsn, merged, datasets)
+
+    if have_name_dob and fuzzy:
+
+        info("Filling missing SSNs with similar DOB/name match")
+        from sirad.fuzzy import FuzzyFill
+        fill = FuzzyFill(dobn, ssn, ssn_invalid == 0,
+                         names["last_name"][0], names["dob"][0], names["first_sdx"][0],
+                         names["last_name"][1], names["dob"][1])
+        del names
+        merged = np.zeros(n, dtype=bool)
+        merged[dobn >= 0] = fill[dobn[dobn >= 0]] >= 0
+        ssn[merged] = fill[dobn[merged]]
+        ssn_invalid[merged] = 0
+        stats["n_fuzzy_fills"] = _count(dsn, merged, datasets)
+
+    info("Creating keys for valid SSNs")
+    key = np.full(n, -1, dtype=np.int64)
+    valid_ssn = ssn_invalid == 0
+    key[valid_ssn] = ssn[valid_ssn]
+    stats["n_ssn_keys"] = _count(dsn, valid_ssn, datasets)
+
+    if have_name_dob:
+
+        info("Creating keys for valid DOB/names")
+        valid_dobn = (~valid_ssn) & (dobn >= 0)
+        key[valid_dobn] = ssn.max() + 1 + dobn[valid_dobn]
+        stats["n_dobn_keys"] = _count(dsn, valid_dobn, datasets)
+
+    if have_name_dob and transitive:
+
+        info("Joining SSN and DOB/name keys into connected components")
+        # Keys are nodes, and records with both a valid SSN and a DOB/name
+        # are edges.
+        edges = valid_ssn & (dobn >= 0)
+        root = unionfind.components(ssn.max() + 2 + dobn.max(), ssn[edges], ssn.max() + 1 + dobn[edges])
+        # Guard against giant components, e.g. from a common DOB/name shared
+        # by many people, by keeping the exact keys of their records.
+        ssns = np.unique(ssn[valid_ssn])
+        nssns = np.bincount(root[ssns], minlength=len(root))
+        giant = nssns > config.get_option("TRANSITIVE_MAX_SSNS")
+        info("Keeping exact keys for", giant.sum(), "components with more than",
+             config.get_option("TRANSITIVE_MAX_SSNS"), "SSNs")
+        has_key = key >= 0
+        linked = np.zeros(n, dtype=bool)
+        linked[has_key] = ~giant[root[key[has_key]]] & (root[key[has_key]] != key[has_key])
+        key[linked] = root[key[linked]]
+        stats["n_transitive_links"] = _count(dsn, linked, datasets)
+
+    info("Generating SIRAD_ID as randomized dense rank over keys")
+    has_key = key >= 0
+    unique_key = pd.unique(key[has_key])
+    np.random.shuffle(unique_key)
+    lookup = np.zeros(key.max() + 1 if has_key.any() else 0, dtype=np.int64)
+    lookup[unique_key] = np.arange(1, len(unique_key) + 1)
+    sirad_id = np.zeros(n, dtype=np.int64)
+    sirad_id[has_key] = lookup[key[has_key]]
+    stats["n_ids"] = _count(dsn, has_key, datasets)
+
+    pii = pd.DataFrame({"dsn": pd.Categorical.from_codes(dsn, datasets),
+                        "pii_id": pii_id,
+                        "sirad_id": sirad_id}).set_index("dsn")
+
+    # Save SIRAD ID statistics to a file in the research output directory.
+    stats["pii_mb"] = pii_mb
+    stats["peak_mb"] = _peak_rss_mb()
+    info("Peak memory {:.1f} MB".format(stats["peak_mb"].iloc[0]))
+    if config.primary_shard():
+        with manifest.Output(config.get_path("sirad_id_stats", "research"), len(stats)) as f:
+            stats.to_csv(f, float_format="%g")
+    info("Done")
 
     return pii
 
 
-def ResearchWorker(tasks, results):
+def _count_lines(path):
+    n = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            n += block.count(b"\n")
+    return n
+
+
+def _dense(path, n, dtype, fill):
     """
-    Helper function for concurrently running Addresses and SiradID.
+    Create an on-disk array indexed from 1 to n, initialized to fill.
     """
-    while not tasks.empty():
-        task = tasks.get()
-        if task[0] == "SiradID":
-            ids = SiradID()
-            results.put(ids)
-        elif task[0] == "Addresses":
-            Addresses(task[1])
+    array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n + 1,))
+    array[:] = fill
+    return array
 
 
-def Research(nthreads=1, seed=0):
+def _format_ints(values):
     """
-    Concurrently generate the SIRAD ID and perform censuscoding using PII,
-    then attach the results to the deidentified data files to generate the
-    final anonymoized research release.
+    Format integer-valued floats for output, with NaN as an empty string.
+    """
+    formatted = np.full(len(values), "", dtype=object)
+    valid = ~np.isnan(values)
+    formatted[valid] = values[valid].astype(np.int64).astype(str)
+    return formatted
+
+
+def _load_censuscode(path, tmpdir, n):
+    """
+    Load a censuscode file into dense arrays indexed by pii_id up to n, one
+    chunk at a time. Returns the column names and a function that formats the columns
+    for an array of pii_ids.
+    """
+    columns = None
+    cities = {}
+    city = _dense(os.path.join(tmpdir, "city.npy"), n, np.int32, -1)
+    zip5 = _dense(os.path.join(tmpdir, "zip5.npy"), n, np.float64, np.nan)
+    blkgrp = _dense(os.path.join(tmpdir, "blkgrp.npy"), n, np.float64, np.nan)
+    for chunk in pd.read_csv(path, chunksize=_chunksize, low_memory=False):
+        columns = list(chunk.columns[1:])
+        values = pd.Categorical(chunk.iloc[:, 1].astype(object))
+        codes = np.array([cities.setdefault(x, len(cities)) for x in values.categories] + [-1], dtype=np.int32)
+        pii_id = chunk.pii_id.values
+        city[pii_id] = codes[values.codes]
+        zip5[pii_id] = chunk.iloc[:, 2].values.astype(np.float64)
+        blkgrp[pii_id] = chunk.iloc[:, 3].values.astype(np.float64)
+    if columns is None:
+        columns = list(pd.read_csv(path, nrows=0).columns[1:])
+    names = np.array([str(x) for x in cities] + [""], dtype=object)
+    return columns, lambda pii_id: [names[city[pii_id]], _format_ints(zip5[pii_id]), _format_ints(blkgrp[pii_id])]
+
+
+def _attach_chunks(f, pii_ids, formatters, n, name):
+    """
+    Stream a data file after its header in record_id order, one chunk at a
+    time, prepending the attached columns to each row. Yields the pii_ids
+    and rows of each chunk.
+    """
+    start = 1
+    progress = Progress("Attach:" + name, total=n)
+    while True:
+        rows = [row for _, row in zip(range(_attach_chunksize), f)]
+        if not rows:
+            break
+        record_id = np.arange(start, start + len(rows))
+        assert (np.array([int(row.partition("|")[0]) for row in rows]) == record_id).all()
+        pii_id = pii_ids[record_id]
+        values = [v for formatter in formatters for v in formatter(pii_id)]
+        prepend = pd.Series(values[0]).str.cat(values[1:], sep="|") if len(values) > 1 else values[0]
+        yield pii_id, [p + "|" + row for p, row in zip(prepend, rows)]
+        start += len(rows)
+        progress.update(len(rows))
+    progress.done()
+
+
+def Attach(dataset, sirad_id=False, sort=False):
+    """
+    Attach the SIRAD ID (from the data set's array written by sirad.ids) and/or
+    censuscoded addresses to a data set's deidentified data file to produce
+    its research file. The attachments are loaded into on-disk arrays
+    indexed by pii_id, and the data file is streamed in record_id order one
+    chunk at a time. If sort is set and the SIRAD ID is attached, the rows
+    are sorted by sirad_id and indexed with sirad.sortindex.
     """
     info = Log(__name__, "Research").info
 
-    if seed:
-        np.random.seed(seed)
+    # Setup paths
+    data_path = config.get_path(dataset.name, "data")
+    res_path = config.get_path(dataset.name, "research")
+    prefixes = [prefix for prefix in _address_prefixes if os.path.exists(_censuscode_paths(dataset, prefix)[0])]
+    sort = sort and sirad_id
+    if not sort and os.path.exists(sortindex.path(res_path)):
+        os.unlink(sortindex.path(res_path))
+
+    # Use the data file as-is via a hard link if there is nothing to attach.
+    if not sirad_id and not prefixes:
+        info("Hard-linking", dataset.name)
+        if os.path.exists(res_path):
+            os.unlink(res_path)
+        os.link(data_path, res_path)
+        manifest.link(data_path, res_path)
+        return
+
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(config.get_path(dataset.name, "pii")))
+    try:
+        # Map each record_id to its pii_id.
+        link_path = config.get_path(dataset.name, "link")
+        n = _count_lines(link_path) - 1
+        pii_ids = _dense(os.path.join(tmpdir, "pii_id.npy"), n, np.int64, 0)
+        for chunk in pd.read_csv(link_path, sep="|", chunksize=_chunksize):
+            pii_ids[chunk.record_id.values] = chunk.pii_id.values
+        # pii_ids are not necessarily dense, so size the pii_id-indexed
+        # attachments by the largest one.
+        max_pii_id = int(pii_ids.max()) if n else 0
+
+        header = []
+        formatters = []
+        if sirad_id:
+            info("Attaching SIRAD_ID to", dataset.name)
+            sirad_id = ids.load(dataset)
+            assert len(sirad_id) > max_pii_id
+            assert (sirad_id[pii_ids[1:]] >= 0).all()
+            header.append("sirad_id")
+            formatters.append(lambda pii_id: [sirad_id[pii_id].astype(str)])
+        for prefix in prefixes:
+            info("Attaching censuscoded", prefix, "addresses to", dataset.name)
+            path = _censuscode_paths(dataset, prefix)[0]
+            subdir = os.path.join(tmpdir, prefix)
+            os.mkdir(subdir)
+            columns, formatter = _load_censuscode(path, subdir, max_pii_id)
+            header += columns
+            formatters.append(formatter)
+
+        # Stream the data file, prepending the attached columns to each row.
+        with open(data_path, "r") as f1, manifest.Output(res_path, n) as f2:
+            f2.write("|".join(header))
+            f2.write("|")
+            f2.write(next(f1))
+            chunks = _attach_chunks(f1, pii_ids, formatters, n, dataset.name)
+            if sort:
+                info("Sorting", dataset.name, "by SIRAD_ID")
+                rows = sortindex.sort(((sirad_id[pii_id], rows) for pii_id, rows in chunks), tmpdir)
+                sortindex.write(f2, rows, sortindex.path(res_path))
+            else:
+                for _, rows in chunks:
+                    f2.writelines(rows)
+    finally:
+        shutil.rmtree(tmpdir)
 
-    # Concurrently run Addresses and SiradID if multiple threads are available.
-    if nthreads > 1:
-        # Define tasks
-        tasks = Queue()
-        for dataset in config.DATASETS:
-           if dataset.has_pii:
-               tasks.put(("Addresses", dataset))
-        tasks.put(("SiradID",))
-        # Run tasks
-        results = Queue()
-        pool = []
-        for n in range(nthreads):
-            p = Process(target=ResearchWorker, args=(tasks, results))
-            pool.append(p)
-            p.start()
-        for p in pool:
-            p.join()
-        ids = results.get() # Only the SiradID process returns a result
-    else:
-        for dataset in config.DATASETS:
-           if dataset.has_pii:
-               Addresses(dataset)
-        ids = SiradID()
-
-    if len(ids) > 0:
-        info("Writing SIRAD_ID table")
-        ids.to_csv(config.get_path("sirad_id", "pii"), float_format="%g")
-        id_dsns = frozenset(ids.index)
+
+def _siradid(nthreads, partitions, incremental=False, fuzzy=False, transitive=False):
+    """
+    Construct the SIRAD ID in memory, out-of-core if a number of
+    partitions is specified, or incrementally from the persistent key index.
+    """
+    if incremental:
+        from sirad.keyindex import IncrementalSiradID
+        return IncrementalSiradID()
+    elif partitions:
+        from sirad.partition import PartitionedSiradID
+        return PartitionedSiradID(nthreads, partitions)
     else:
-        id_dsns = []
+        return SiradID(fuzzy, transitive)
 
-    # Attach SIRAD ID and/or addresses to each data set to produce the
-    # final set of research files.
 
-    for dataset in config.DATASETS:
+def _addresses_task(datasets, nthreads):
+    """
+    Censuscode the addresses of data sets whose PII or census files have
+    changed since they were last censuscoded, parsing addresses with the
+    processes the scheduler gives the task, up to nthreads.
+    """
+    census_files = [config.get_option("CENSUS_STREET_FILE"), config.get_option("CENSUS_STREET_NUM_FILE")]
+    stale = []
+    for dataset in datasets:
+        stage = stages.Stage("addresses." + dataset.name, [config.get_path(dataset.name, "pii")] + census_files)
+        if not stage.up_to_date():
+            stale.append((dataset, stage))
+            # Remove census codes for prefixes that may no longer be present.
+            for path in (p for prefix in _address_prefixes for p in _censuscode_paths(dataset, prefix)):
+                if os.path.exists(path):
+                    os.unlink(path)
+    if stale:
+        Addresses([dataset for dataset, _ in stale], scheduler.slots(nthreads))
+    for dataset, stage in stale:
+        stage.save(p for prefix in _address_prefixes for p in _censuscode_paths(dataset, prefix) if os.path.exists(p))
+
+
+def _siradid_stage(seed, partitions, incremental, fuzzy, transitive):
+    """
+    Return the stage record for constructing the SIRAD ID from the PII
+    files of all data sets with these options.
+    """
+    params = {"seed": seed, "partitions": partitions, "incremental": incremental,
+              "fuzzy": fuzzy, "transitive": transitive,
+              "options": dict((k, config.get_option(k))
+                              for k in ("FUZZY_THRESHOLD", "FUZZY_MAX_BLOCK", "TRANSITIVE_MAX_SSNS"))}
+    return stages.Stage("siradid", [config.get_path(d.name, "pii") for d in config.DATASETS if d.has_pii], params)
 
-        # Setup paths
-        data_path = config.get_path(dataset.name, "data")
-        res_path = config.get_path(dataset.name, "research")
 
-        # Identify SIRAD ID and/or address links.
-        link = None
-        if dataset.name in id_dsns:
-            info("Attaching SIRAD_ID to", dataset.name)
-            link = pd.read_csv(config.get_path(dataset.name, "link"), sep="|", low_memory=False)\
-                     .sort_values("record_id")\
-                     .merge(ids.loc[[dataset.name]], on="pii_id", how="left")
-            assert link.sirad_id.notnull().all()
-        for prefix in _address_prefixes:
-            filename = "{}.censuscode.{}.csv".format(config.get_path(dataset.name, "pii").rpartition(".")[0], prefix)
-            if os.path.exists(filename):
-                info("Attaching censuscoded", prefix, "addresses to", dataset.name)
-                if link is None:
-                    link = pd.read_csv(config.get_path(dataset.name, "link"), sep="|", low_memory=False)\
-                             .sort_values("record_id")
-                link = link.merge(pd.read_csv(filename, low_memory=False), on="pii_id", how="left")
-
-        # Write out a new research file with attached data if available,
-        # otherwise use the data file as-is via a hard link.
-        if link is not None:
-            link = link.fillna("")
-            with open(data_path, "r") as f1, open(res_path, "w") as f2:
-                f2.write("|".join(link.columns[2:]))
-                f2.write("|")
-                f2.write(next(f1))
-                for link_row, data_row in zip(link.itertuples(), f1):
-                    assert int(data_row.partition("|")[0]) == link_row.record_id
-                    f2.write("|".join(map(_str_format, link_row[3:])))
-                    f2.write("|")
-                    f2.write(data_row)
+def _siradid_task(stage, rebuild, nthreads, partitions, seed, incremental, fuzzy, transitive):
+    """
+    Construct the SIRAD ID, write the SIRAD ID table, and return the paths
+    of the pii_id-indexed SIRAD IDs of every data set with PII. Returns the
+    paths from the stage record if it does not need to be rebuilt.
+    """
+    if not rebuild:
+        return stage.result
+    if seed:
+        np.random.seed(seed)
+    table = _siradid(scheduler.slots(nthreads), partitions, incremental, fuzzy, transitive)
+    outputs = []
+    if config.primary_shard():
+        outputs.append(config.get_path("sirad_id_stats", "research"))
+    if len(table) == 0:
+        paths = {}
+    else:
+        if config.primary_shard():
+            Log(__name__, "Research").info("Writing SIRAD_ID table")
+            with manifest.Output(config.get_path("sirad_id", "pii"), len(table)) as f:
+                table.to_csv(f, float_format="%g")
+            outputs.append(config.get_path("sirad_id", "pii"))
+        # Every data set's SIRAD IDs change with the table, so all of them
+        # are written, and their research files are stale until reattached.
+        paths = ids.write(table)
+    stage.save(outputs + list(paths.values()), paths)
+    return paths
+
+
+def _attach_task(dataset, sirad_ids, sort=False):
+    """
+    Attach to a data set, unless its data, link, SIRAD ID and census code
+    files are unchanged since it was last attached.
+    """
+    inputs = [config.get_path(dataset.name, "data")]
+    if dataset.has_pii:
+        inputs.append(config.get_path(dataset.name, "link"))
+    if dataset.name in sirad_ids:
+        inputs.append(sirad_ids[dataset.name])
+    inputs += [p for p in (_censuscode_paths(dataset, prefix)[0] for prefix in _address_prefixes) if os.path.exists(p)]
+    sort = sort and dataset.name in sirad_ids
+    stage = stages.Stage("attach." + dataset.name, inputs, {"sirad_id": dataset.name in sirad_ids, "sort": sort})
+    if not stage.up_to_date():
+        Attach(dataset, dataset.name in sirad_ids, sort)
+        outputs = [config.get_path(dataset.name, "research")]
+        if sort:
+            outputs.append(sortindex.path(outputs[0]))
+        stage.save(outputs)
+
+
+def Research(nthreads=1, seed=0, partitions=0, incremental=False, fuzzy=False, transitive=False,
+             only=None, stage=None, force=False, sort=False):
+    """
+    Generate the SIRAD ID and perform censuscoding using PII, then attach
+    the results to the deidentified data files to generate the final
+    anonymoized research release. With multiple threads, these run as a
+    task graph in which each data set is attached as soon as its inputs
+    are ready.
+
+    Stages whose inputs are unchanged since the last run are skipped, unless
+    forced. Censuscoding and attaching can be limited to the data sets named
+    in only, and a single stage ("addresses", "siradid" or "attach") can be
+    run on its own from the outputs of previous runs.
+
+    If sort is set, research files with a SIRAD ID are written in sirad_id
+    order, with an index of the byte offset of each sirad_id.
+    """
+    info = Log(__name__, "Research").info
+    if (fuzzy or transitive) and (partitions or incremental):
+        raise ValueError("fuzzy and transitive linkage are only supported for the in-memory SIRAD ID")
+
+    # As one shard of several, every shard constructs the same SIRAD ID
+    # from all data sets, but only censuscodes and attaches its own.
+    selected = config.DATASETS
+    if config.SHARD is not None:
+        if config.SHARD[1] > 1 and (incremental or not seed):
+            raise ValueError("sharded research requires a seed, and cannot be incremental")
+        selected = shards.select(selected, *config.SHARD)
+        info("Shard {} of {}:".format(*config.SHARD), ", ".join(d.name for d in selected))
+    datasets = selected
+    if only:
+        unknown = set(only) - set(d.name for d in config.DATASETS)
+        if unknown:
+            raise ValueError("unknown data sets: {}".format(", ".join(sorted(unknown))))
+        datasets = [d for d in datasets if d.name in only]
+    if stage not in (None, "addresses", "siradid", "attach"):
+        raise ValueError("unknown stage '{}'".format(stage))
+    run = (stage,) if stage else ("addresses", "siradid", "attach")
+
+    # The SIRAD ID is always constructed from all data sets.
+    pii = [d for d in datasets if d.has_pii]
+    pii_size = sum(os.path.getsize(config.get_path(d.name, "pii")) for d in config.DATASETS if d.has_pii)
+    tasks = []
+    if "addresses" in run:
+        if force:
+            for dataset in pii:
+                stages.remove("addresses." + dataset.name)
+        # One task for all data sets, so that each distinct address is only
+        # parsed and censuscoded once; only attaching to data sets with
+        # addresses waits for it.
+        tasks.append(scheduler.Task("Addresses", _addresses_task, (pii, nthreads),
+                                    cost=sum(os.path.getsize(config.get_path(d.name, "pii")) for d in pii),
+                                    slots=nthreads))
+    attach = datasets if "attach" in run else []
+    if "siradid" in run:
+        if force:
+            stages.remove("siradid")
+        siradid = _siradid_stage(seed, partitions, incremental, fuzzy, transitive)
+        rebuild = not siradid.up_to_date()
+        tasks.append(scheduler.Task("SiradID", _siradid_task, (siradid, rebuild, nthreads, partitions, seed,
+                                                                     incremental, fuzzy, transitive),
+                                    cost=pii_size, slots=min(nthreads, partitions) if partitions else 1))
+        # A rebuilt SIRAD ID changes the IDs of every data set with PII,
+        # so all of them are reattached, not just those named in only.
+        if rebuild and attach and only:
+            attach = [d for d in selected if d.name in only or d.has_pii]
+            info("Reattaching all data sets with PII to the rebuilt SIRAD ID")
+
+    # Attach SIRAD ID and/or addresses to each data set to produce the
+    # final set of research files, largest data sets first, using the
+    # SIRAD IDs from the last run if they are not constructed in this one.
+    for dataset in attach:
+        if force:
+            stages.remove("attach." + dataset.name)
+        deps = []
+        if "addresses" in run and dataset.has_pii and \
+           any(_can_censuscode(_address_columns(dataset, p)) for p in _address_prefixes):
+            deps.append("Addresses")
+        if not dataset.has_pii:
+            sirad_ids = {}
+        elif "siradid" in run:
+            sirad_ids = scheduler.Result("SiradID")
+        elif os.path.exists(ids.path(dataset)):
+            sirad_ids = {dataset.name: ids.path(dataset)}
         else:
-            info("Hard-linking", dataset.name)
-            if os.path.exists(res_path):
-                os.unlink(res_path)
-            os.link(data_path, res_path)
+            sirad_ids = {}
+        tasks.append(scheduler.Task("Attach:" + dataset.name, _attach_task, (dataset, sirad_ids, sort), deps,
+                                    cost=os.path.getsize(config.get_path(dataset.name, "data"))))
 
+    scheduler.run(tasks, nthreads)
     info("Done")
-
@@ -0,0 +1,165 @@
+"""
+Provides a method to process a sample of a dataset, for iterating on its
+layout without processing the full raw file.
+
+The first N records, or a uniform random sample of N records, are copied
+from the raw file to a scratch directory and split there into data, pii and
+link files, without appending to the process log. Random samples of
+fixed-width files seek directly to each sampled record by its byte offset;
+CSV files are sampled by line (so quoted values must not contain newlines),
+and Excel files by row. A summary of the null, invalid date and invalid SSN
+rates of each field is written alongside.
+"""
+
+import copy
+import csv
+import logging
+import os
+import random
+
+from itertools import islice
+from sirad import config
+from sirad import extract
+from sirad import stream
+from sirad.dataset import validate_ssn
+
+# Sampling is reproducible across runs.
+_seed = 0
+
+
+def _reservoir(items, n, rng):
+    """
+    Uniform random sample of n items from an iterator, in their original order.
+    """
+    sample = []
+    for i, item in enumerate(items):
+        if i < n:
+            sample.append((i, item))
+        else:
+            j = rng.randint(0, i)
+            if j < n:
+                sample[j] = (i, item)
+    return [item for _, item in sorted(sample, key=lambda x: x[0])]
+
+
+def _fixed_records(f, n, rng):
+    """
+    Randomly sample n records from a fixed-width file by seeking to their byte
+    offsets. Returns None if the records are not all the same length.
+    """
+    first = f.readline()
+    length = len(first)
+    newline = length - len(first.rstrip(b"\r\n"))
+    size = os.fstat(f.fileno()).st_size
+    if length == 0 or size % length not in (0, length - newline):
+        return None
+    nrecords = -(-size // length)
+    records = []
+    for i in sorted(rng.sample(range(nrecords), min(n, nrecords))):
+        f.seek(i * length)
+        records.append(f.read(length))
+    return records
+
+
+def _sample_raw(dataset, n, method, path):
+    """
+    Copy a sample of the raw lines of a CSV or fixed-width file to path.
+    """
+    rng = random.Random(_seed)
+    with open(dataset.source, "rb") as f:
+        header = [f.readline()] if dataset.type == "csv" and dataset.header else []
+        records = None
+        if method == "random" and dataset.type == "fixed":
+            records = _fixed_records(f, n, rng)
+            f.seek(0)
+            if records is None:
+                logging.info("Records in {} are not fixed length, sampling by line".format(dataset.name))
+        if records is None:
+            lines = (line for line in f if line.strip())
+            records = list(islice(lines, n)) if method == "head" else _reservoir(lines, n, rng)
+    if records and not records[-1].endswith(b"\n"):
+        records[-1] += b"\n"
+    with open(path, "wb") as f:
+        f.writelines(header + records)
+
+
+def _sample_rows(dataset, n, method, path):
+    """
+    Sample the raw rows of a data set, writing CSV and fixed-width samples to
+    path and switching the data set to read from the sample.
+    """
+    if dataset.type == "xlsx":
+        reader, f = dataset.get_reader()
+        rows = list(islice(reader, n)) if method == "head" else _reservoir(reader, n, random.Random(_seed))
+        f.close()
+        return dataset, rows
+    _sample_raw(dataset, n, method, path)
+    dataset = copy.copy(dataset)
+    dataset.source = path
+    reader, f = dataset.get_reader()
+    rows = list(reader)
+    f.close()
+    return dataset, rows
+
+
+def summarize(dataset, rows):
+    """
+    Count the null values of each field in rows of raw values, and the
+    non-null values that are invalid dates or SSNs. Returns a row for each
+    field of its name, the number of values, and each count and rate.
+    """
+    summary = []
+    for i, field in enumerate(dataset.fields):
+        values = [row[i] for row in rows if i < len(row)]
+        present = [v for v in values if v not in config.NULL_VALUES]
+        counts = [len(values) - len(present), "", ""]
+        if field.type == "date":
+            counts[1] = sum(1 for v in present if isinstance(v, str) and
+                            extract.date(v, field.format, dataset.name, field.name) == "")
+        if field.ssn:
+            counts[2] = sum(1 for v in present if validate_ssn("".join(c for c in str(v) if c.isdigit())) == "1")
+        row = [field.name, len(values)]
+        for count in counts:
+            row += [count, "{:.3f}".format(count / len(values)) if count != "" and values else ""]
+        summary.append(row)
+    return summary
+
+
+def Sample(dataset, n, method="head", outdir="sample"):
+    """
+    Process a sample of n records from a data set into outdir, and summarize
+    the sampled values. Returns the paths of the summary and the data, pii
+    and link files.
+    """
+    logging.info("Sampling {} records from {}".format(n, dataset.name))
+    prefix = os.path.join(outdir, dataset.name)
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    sampled, rows = _sample_rows(dataset, n, method, prefix + ".raw" + os.path.splitext(dataset.source)[1])
+
+    sink = stream.FileSink(prefix + ".data.txt", prefix + ".pii.txt", prefix + ".link.txt")
+    if dataset.type == "xlsx":
+        # Split the sampled rows directly, rather than the whole workbook.
+        split = [dataset.split_row(row) for row in rows]
+        sink.open(dataset)
+        try:
+            sink.write(stream.Batch(dataset, list(range(1, len(rows) + 1)),
+                                    [d for d, _ in split], [p for _, p in split]))
+        except BaseException:
+            sink.abort()
+            raise
+        sink.close()
+    else:
+        stream.Split(sampled, sink)
+
+    summary = prefix + ".summary.csv"
+    with open(summary, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["field", "n", "null", "null_rate", "invalid_date", "invalid_date_rate",
+                         "invalid_ssn", "invalid_ssn_rate"])
+        for row in summarize(dataset, rows):
+            writer.writerow(row)
+            # Log the counts, with "-" for checks that do not apply to the field.
+            logging.info("{}/{}: {} values, {} null, {} invalid date, {} invalid SSN".format(
+                dataset.name, row[0], row[1], *("-" if c == "" else c for c in row[2:8:2])))
+
+    return summary, sink.data_path, sink.pii_path, sink.link_path
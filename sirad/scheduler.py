@@ -0,0 +1,172 @@
+"""
+Run a graph of dependent tasks across worker processes.
+
+Each task starts as soon as all of the tasks it depends on have finished,
+with the most costly ready tasks started first. Workers are ordinary
+(non-daemonic) processes, so that tasks can run their own process pools.
+A failed task is reported by name, and the tasks that depend on it are
+skipped while independent tasks run to completion.
+
+A task that starts its own process pool should request the most processes
+it can use with the task's slots, and size its pool with slots(), the
+number of worker slots it was given when it started, so that the pools and
+the scheduler's workers together use at most nthreads processes. Ready
+tasks with a pool are given their slots first, and the other ready tasks
+start in the slots that are left over.
+"""
+
+import traceback
+
+from multiprocessing import Process, Queue
+from queue import Empty
+from sirad import profiling, Log
+from sirad.exceptions import TaskFailedException
+from sirad.progress import Progress
+
+
+# Number of processes that the task running in this worker may use.
+_slots = None
+
+
+def slots(default=1):
+    """
+    Return the number of processes that the running task may use for its
+    own pool, or default if it is not running in a scheduler worker.
+    """
+    return default if _slots is None else _slots
+
+
+class Result(object):
+    """
+    Placeholder in a task's arguments for the result of another task.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Task(object):
+    """
+    A named call of func with args, which runs after the tasks named in deps
+    and any tasks whose results appear in args. A task that runs its own
+    process pool requests up to slots processes for it.
+    """
+
+    def __init__(self, name, func, args=(), deps=(), cost=0, slots=1):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.deps = frozenset(deps) | frozenset(a.name for a in self.args if isinstance(a, Result))
+        self.cost = cost
+        self.slots = max(slots, 1)
+
+    def call(self, results):
+        with profiling.task(self.name):
+            return self.func(*[results[a.name] if isinstance(a, Result) else a for a in self.args])
+
+
+def _worker(task, results, queue, nslots):
+    global _slots
+    _slots = nslots
+    try:
+        queue.put((task.name, True, task.call(results)))
+    except BaseException:
+        queue.put((task.name, False, traceback.format_exc()))
+
+
+def run(tasks, nthreads=1):
+    """
+    Run tasks in dependency order using up to nthreads worker processes,
+    or in the current process if nthreads is 1. Returns the results by task
+    name, or raises TaskFailedException if any task failed.
+    """
+    log = Log(__name__, "Scheduler")
+    tasks = dict((task.name, task) for task in tasks)
+    for task in tasks.values():
+        for dep in task.deps:
+            if dep not in tasks:
+                raise ValueError("task '{}' depends on unknown task '{}'".format(task.name, dep))
+
+    pending = set(tasks)
+    running = {}
+    used = {}
+    results = {}
+    errors = {}
+    queue = Queue()
+    progress = Progress("Scheduler", total=len(tasks), unit="tasks")
+
+    def finish(name, ok, result):
+        if ok:
+            results[name] = result
+            log.info("Finished", name)
+        else:
+            errors[name] = result
+            log.error("Task", name, "failed:\n" + result)
+        progress.update(1)
+
+    while pending or running:
+
+        # Skip tasks that depend on a failed task.
+        for name in sorted(pending):
+            failed = sorted(dep for dep in tasks[name].deps if dep in errors)
+            if failed:
+                pending.remove(name)
+                finish(name, False, "skipped because {} failed\n".format(", ".join(failed)))
+
+        # Tasks with a pool start first, then the most costly.
+        ready = sorted((name for name in pending if tasks[name].deps.issubset(results)),
+                       key=lambda name: (tasks[name].slots == 1, -tasks[name].cost, name))
+        if not ready and not running:
+            if pending:
+                raise ValueError("tasks have circular dependencies: {}".format(", ".join(sorted(pending))))
+            break
+
+        if nthreads <= 1:
+            name = ready[0]
+            pending.remove(name)
+            log.info("Starting", name)
+            try:
+                finish(name, True, tasks[name].call(results))
+            except Exception:
+                finish(name, False, traceback.format_exc())
+            continue
+
+        # Share the free slots among the ready tasks with a pool, up to
+        # their requests, and start the other ready tasks in those left over.
+        free = nthreads - sum(used.values())
+        pools = [name for name in ready if tasks[name].slots > 1][:max(free, 0)]
+        start = {}
+        for i, name in enumerate(pools):
+            start[name] = min(tasks[name].slots, free // (len(pools) - i))
+            free -= start[name]
+        for name in [name for name in ready if tasks[name].slots == 1][:max(free, 0)]:
+            start[name] = 1
+        for name in ready:
+            if name not in start:
+                continue
+            pending.remove(name)
+            log.info("Starting", name)
+            deps = dict((dep, results[dep]) for dep in tasks[name].deps)
+            used[name] = start[name]
+            running[name] = Process(target=_worker, args=(tasks[name], deps, queue, start[name]))
+            running[name].start()
+
+        # Wait for a task to finish, watching for workers that die without
+        # reporting a result.
+        try:
+            name, ok, result = queue.get(timeout=1)
+        except Empty:
+            for name, p in list(running.items()):
+                if p.exitcode not in (None, 0):
+                    running.pop(name).join()
+                    used.pop(name)
+                    finish(name, False, "worker exited with code {}\n".format(p.exitcode))
+            continue
+        running.pop(name).join()
+        used.pop(name)
+        finish(name, ok, result)
+
+    progress.done()
+    if errors:
+        raise TaskFailedException("failed tasks: {}".format(", ".join(sorted(errors))))
+    return results
@@ -0,0 +1,64 @@
+"""
+Deterministic sharding of data sets across nodes on a shared filesystem.
+
+Data sets are assigned to shards greedily, largest raw file first, to the
+shard with the smallest total size so far. Every node derives the same
+assignment from the same layouts and raw files, so a run can be spread
+across nodes by starting shard i of N on each node.
+"""
+
+import os
+
+
+def parse(spec):
+    """
+    Parse a shard specification "i/N" into a tuple (i, N), with shards
+    numbered from 1 to N.
+    """
+    index, sep, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        sep = ""
+    if not sep or not 1 <= index <= count:
+        raise ValueError("shard must be i/N with 1 <= i <= N: '{}'".format(spec))
+    return index, count
+
+
+def _size(dataset):
+    try:
+        return os.path.getsize(dataset.source)
+    except OSError:
+        return 0
+
+
+def assign(datasets, count):
+    """
+    Assign data sets to count shards, balanced by raw file size. Returns a
+    list of the data sets in each shard.
+    """
+    shards = [[] for _ in range(count)]
+    totals = [0] * count
+    for dataset in sorted(datasets, key=lambda d: (-_size(d), d.name)):
+        i = min(range(count), key=lambda i: (totals[i], i))
+        shards[i].append(dataset)
+        totals[i] += _size(dataset)
+    return shards
+
+
+def select(datasets, index, count):
+    """
+    Return the data sets assigned to shard index of count, in their
+    original order.
+    """
+    names = set(d.name for d in assign(datasets, count)[index - 1])
+    return [d for d in datasets if d.name in names]
+
+
+def suffix(path, index, count):
+    """
+    Add the shard to a file path before its extension, e.g.
+    process_log.csv becomes process_log.shard-2-of-4.csv.
+    """
+    root, ext = os.path.splitext(path)
+    return "{}.shard-{}-of-{}{}".format(root, index, count, ext)
@@ -0,0 +1,132 @@
+"""
+Research files sorted and indexed by SIRAD ID.
+
+Research can write each research file with its rows ordered by sirad_id,
+along with a sidecar NumPy array of each distinct sirad_id and the byte
+offset of its first row. The rows for a set of SIRAD IDs can then be read
+by seeking directly to them, without scanning the file:
+
+    from sirad import sortindex
+    sortindex.read("research/P_V1/benefits.txt", [101, 102])
+
+Rows are sorted in memory in runs, which are spilled to temporary files and
+merged if the file has more than one run. Rows with the same sirad_id keep
+their record_id order.
+"""
+
+import heapq
+import io
+import numpy as np
+import os
+import pandas as pd
+
+from operator import itemgetter
+from sirad import manifest
+
+# Number of rows to sort in memory before spilling a run to disk.
+_runsize = 1000000
+
+
+def path(research_path):
+    """
+    Return the path of the sirad_id index for a research file.
+    """
+    return "{}.sirad_id_index.npy".format(research_path.rpartition(".")[0])
+
+
+def _key(line):
+    return int(line[:line.index("|")])
+
+
+def _spill(keys, lines, tmpdir, n):
+    """
+    Write a sorted run to a temporary file, returning its path.
+    """
+    run = os.path.join(tmpdir, "run{:06d}.txt".format(n))
+    with open(run, "w", newline="\n") as f:
+        f.writelines(lines[i] for i in np.argsort(keys, kind="stable"))
+    return run
+
+
+def _read_run(path):
+    with open(path, newline="\n") as f:
+        for line in f:
+            yield _key(line), line
+
+
+def sort(chunks, tmpdir, runsize=None):
+    """
+    Sort chunks of (sirad_ids, lines) by sirad_id, where each line begins
+    with its sirad_id. Yields the sorted (sirad_id, line) pairs.
+    """
+    runsize = runsize or _runsize
+    keys, lines, runs = [], [], []
+    for chunk_keys, chunk_lines in chunks:
+        keys.append(np.asarray(chunk_keys, dtype=np.int64))
+        lines.extend(chunk_lines)
+        if len(lines) >= runsize:
+            runs.append(_spill(np.concatenate(keys), lines, tmpdir, len(runs)))
+            keys, lines = [], []
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    last = zip(keys[order].tolist(), (lines[i] for i in order))
+    if not runs:
+        yield from last
+        return
+    # Earlier runs come first among equal sirad_ids, so the merge is stable.
+    yield from heapq.merge(*[_read_run(run) for run in runs], last, key=itemgetter(0))
+
+
+def write(f, rows, index_path):
+    """
+    Write sorted (sirad_id, line) pairs to an open text file, after its
+    header, and write the byte offset of each sirad_id's first row to
+    index_path.
+    """
+    f.flush()
+    buffer = f.buffer
+    offset = buffer.tell()
+    encoding = f.encoding
+    sirad_ids, offsets = [], []
+    last = None
+    for sirad_id, line in rows:
+        if sirad_id != last:
+            sirad_ids.append(sirad_id)
+            offsets.append(offset)
+            last = sirad_id
+        b = line.encode(encoding)
+        buffer.write(b)
+        offset += len(b)
+    with manifest.BinaryOutput(index_path, len(sirad_ids)) as out:
+        np.save(out, np.array([sirad_ids, offsets], dtype=np.int64).T.reshape(-1, 2))
+
+
+def fetch(research_path, sirad_ids):
+    """
+    Return the header and rows of a sorted research file for a list of
+    SIRAD IDs, as text in the research file format. SIRAD IDs that are not
+    in the file are ignored.
+    """
+    index = np.load(path(research_path), mmap_mode="r")
+    size = os.path.getsize(research_path)
+    sirad_ids = np.unique(np.asarray(sirad_ids, dtype=np.int64))
+    i = np.searchsorted(index[:, 0], sirad_ids)
+    found = i < len(index)
+    found[found] = index[i[found], 0] == sirad_ids[found]
+    i = i[found]
+    starts = index[i, 1]
+    ends = np.where(i + 1 < len(index), index[np.minimum(i + 1, len(index) - 1), 1], size)
+    with open(research_path, "rb") as f:
+        blocks = [f.readline()]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            f.seek(start)
+            blocks.append(f.read(end - start))
+    return b"".join(blocks).decode()
+
+
+def read(research_path, sirad_ids, **kwargs):
+    """
+    Read the rows of a sorted research file for a list of SIRAD IDs into
+    a DataFrame.
+    """
+    return pd.read_csv(io.StringIO(fetch(research_path, sirad_ids)), sep="|", **kwargs)
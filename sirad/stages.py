@@ -0,0 +1,102 @@
+"""
+Records of research stages for skipping up-to-date outputs.
+
+Each stage (censuscoding a data set's addresses, constructing the SIRAD ID,
+or attaching a data set's research file) records a fingerprint of its input
+files and options, along with its outputs and result, in a JSON file in the
+PII directory. A stage is up to date if its options and the SHA-256 digests
+of its inputs are unchanged and its outputs still exist. Digests are taken
+from the output manifests where current, and otherwise only recomputed for
+inputs whose size or modification time has changed since the last record.
+"""
+
+import hashlib
+import json
+import os
+
+from sirad import config, manifest, Log
+
+_blocksize = 1 << 20
+
+
+def _digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint(paths, previous=None):
+    """
+    Return the size, modification time and digest of each file by path,
+    reusing the digests in a previous fingerprint or in the file's manifest
+    for unchanged files.
+    """
+    previous = previous or {}
+    result = {}
+    for path in paths:
+        stat = os.stat(path)
+        old = previous.get(path)
+        if old is not None and old[:2] == [stat.st_size, stat.st_mtime_ns]:
+            result[path] = old
+            continue
+        entry = manifest.lookup(path)
+        result[path] = [stat.st_size, stat.st_mtime_ns, _digest(path) if entry is None else entry["sha256"]]
+    return result
+
+
+def _path(name):
+    return config.shard_path(config.get_path(os.path.join("stages", name), "pii").rpartition(".")[0] + ".json")
+
+
+def remove(name):
+    """
+    Remove the record for a stage, so that it runs again.
+    """
+    if os.path.exists(_path(name)):
+        os.unlink(_path(name))
+
+
+class Stage(object):
+    """
+    Compare a stage's input files and options against its last record.
+    """
+
+    def __init__(self, name, inputs, params=None):
+        self.name = name
+        self.path = _path(name)
+        try:
+            with open(self.path) as f:
+                self.record = json.load(f)
+        except (IOError, ValueError):
+            self.record = {}
+        self.inputs = fingerprint(inputs, self.record.get("inputs"))
+        # Normalize the options as they are stored, e.g. tuples as lists.
+        self.params = json.loads(json.dumps(params or {}))
+
+    def up_to_date(self):
+        record = self.record
+        if not record or record["params"] != self.params:
+            return False
+        if set(record["inputs"]) != set(self.inputs):
+            return False
+        if any(record["inputs"][p][2] != self.inputs[p][2] for p in self.inputs):
+            return False
+        if not all(os.path.exists(p) for p in record["outputs"]):
+            return False
+        Log(__name__, self.name).info("Skipping, inputs are unchanged")
+        return True
+
+    @property
+    def result(self):
+        return self.record.get("result")
+
+    def save(self, outputs, result=None):
+        """
+        Record the stage's outputs and result after it has run.
+        """
+        self.record = {"inputs": self.inputs, "params": self.params, "outputs": sorted(outputs), "result": result}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.record, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
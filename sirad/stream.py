@@ -0,0 +1,254 @@
+"""
+Streaming API for splitting a data set in-process.
+
+Split rows are grouped into batches of (record_id, data row, pii row), which
+are passed to a sink. Sinks receive data rows as they are split, and shuffle
+the PII rows into pii_ids when the split is finished, so that pipelines can
+consume the split without writing and re-reading the data, PII and link files.
+"""
+
+import contextlib
+import csv
+import os
+import random
+import sys
+
+from sirad import config, manifest
+from sirad.progress import Progress
+
+# Number of rows per batch.
+_batchsize = 10000
+
+
+class Batch(object):
+    """
+    A batch of split rows, with record_ids numbered from 1 across the data set,
+    and the number of bytes read from the raw file so far (if known).
+    """
+
+    def __init__(self, dataset, record_id, data, pii, position=None):
+        self.dataset = dataset
+        self.record_id = record_id
+        self.data = data
+        self.pii = pii
+        self.position = position
+
+    def __len__(self):
+        return len(self.record_id)
+
+    def __iter__(self):
+        return zip(self.record_id, self.data, self.pii)
+
+    def data_columns(self):
+        """
+        Return the data rows as a dict of columns by name.
+        """
+        return dict(zip(self.dataset.data_header[1:], map(list, zip(*self.data)))) if self.data else \
+               dict((name, []) for name in self.dataset.data_header[1:])
+
+    def pii_columns(self):
+        """
+        Return the PII rows as a dict of columns by name.
+        """
+        return dict(zip(self.dataset.pii_header[1:], map(list, zip(*self.pii)))) if self.pii else \
+               dict((name, []) for name in self.dataset.pii_header[1:])
+
+
+def batches(dataset, size=_batchsize, engine=None):
+    """
+    Split the raw data for a data set. Yields batches of split rows.
+    The "row" engine splits one row at a time, and the "batch" engine
+    splits CSV and fixed-width files in vectorized chunks.
+    """
+    if engine is None:
+        engine = config.get_option("SPLIT_ENGINE")
+    if engine == "batch" and dataset.type in ("csv", "fixed"):
+        from sirad.batchsplit import split_batches
+        start = 1
+        for data, pii, position in split_batches(dataset, size):
+            yield Batch(dataset, list(range(start, start + len(data))), data, pii, position)
+            start += len(data)
+        return
+    elif engine not in ("row", "batch"):
+        raise ValueError("unknown split engine '{}'".format(engine))
+    reader, f = dataset.get_reader()
+    record_id, data, pii = [], [], []
+    for n, row in enumerate(reader, start=1):
+        drow, prow = dataset.split_row(row)
+        record_id.append(n)
+        data.append(drow)
+        pii.append(prow)
+        if len(record_id) == size:
+            yield Batch(dataset, record_id, data, pii, _tell(f))
+            record_id, data, pii = [], [], []
+    if record_id:
+        yield Batch(dataset, record_id, data, pii, _tell(f))
+    f.close()
+
+
+def _tell(f):
+    """
+    Return the number of bytes read from a file, which for a text file is
+    the position of its underlying buffer.
+    """
+    try:
+        return getattr(f, "buffer", f).tell()
+    except (OSError, ValueError):
+        return None
+
+
+class Sink(object):
+    """
+    Base class for sinks, which receive data rows (with record_id) in
+    batches, and shuffled PII rows (with pii_id) and link rows on close.
+    """
+
+    def open(self, dataset):
+        self.dataset = dataset
+        self.nrows = 0
+        self._pii = []
+
+    def write(self, batch):
+        rows = []
+        for record_id, drow, prow in batch:
+            rows.append([record_id] + drow)
+            if self.dataset.has_pii:
+                self._pii.append([record_id] + prow)
+        self.nrows += len(rows)
+        self.write_data(rows)
+
+    def close(self):
+        if self.dataset.has_pii:
+            random.shuffle(self._pii)
+            link = []
+            for pii_id, row in enumerate(self._pii, start=1):
+                link.append((row[0], pii_id))
+                row[0] = pii_id
+            self.write_pii(self._pii, link)
+        self._pii = []
+
+    def abort(self):
+        """
+        Discard the split after a failure, in place of close. Called while
+        handling the exception.
+        """
+        self._pii = []
+
+    def write_data(self, rows):
+        pass
+
+    def write_pii(self, rows, link):
+        pass
+
+
+class FileSink(Sink):
+    """
+    Write the data, PII and link files in the sirad dialect, by default
+    to the configured paths for the data set.
+    """
+
+    def __init__(self, data_path=None, pii_path=None, link_path=None):
+        self.paths = (data_path, pii_path, link_path)
+
+    def open(self, dataset):
+        super(FileSink, self).open(dataset)
+        data_path, pii_path, link_path = self.paths
+        self.data_path = data_path or config.get_path(dataset.name, "data")
+        self.pii_path = (pii_path or config.get_path(dataset.name, "pii")) if dataset.has_pii else None
+        self.link_path = (link_path or config.get_path(dataset.name, "link")) if dataset.has_pii else None
+        # Open all of the files up front, closing those already open if
+        # one fails.
+        with contextlib.ExitStack() as stack:
+            self._file = stack.enter_context(manifest.Output(self.data_path))
+            if dataset.has_pii:
+                self._pii_file = stack.enter_context(manifest.Output(self.pii_path))
+                self._link_file = stack.enter_context(manifest.Output(self.link_path))
+            self._writer = csv.writer(self._file, dialect="sirad")
+            self._writer.writerow(dataset.data_header)
+            self._files = stack.pop_all()
+
+    def write_data(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        # A failure while writing the PII leaves none of the files recorded.
+        with self._files:
+            self._file.rows = self.nrows
+            super(FileSink, self).close()
+
+    def abort(self):
+        # Close the files as failed, so that they have no manifest entries.
+        self._files.__exit__(*sys.exc_info())
+        super(FileSink, self).abort()
+
+    def write_pii(self, rows, link):
+        self._pii_file.rows = len(rows)
+        self._link_file.rows = len(link)
+        pwriter = csv.writer(self._pii_file, dialect="sirad")
+        pwriter.writerow(self.dataset.pii_header)
+        lwriter = csv.writer(self._link_file, dialect="sirad")
+        lwriter.writerow(self.dataset.link_header)
+        for row, link_row in zip(rows, link):
+            lwriter.writerow(link_row)
+            pwriter.writerow(row)
+
+
+class MemorySink(Sink):
+    """
+    Collect the data, PII and link rows in lists.
+    """
+
+    def open(self, dataset):
+        super(MemorySink, self).open(dataset)
+        self.data = []
+        self.pii = []
+        self.link = []
+
+    def write_data(self, rows):
+        self.data.extend(rows)
+
+    def write_pii(self, rows, link):
+        self.pii = rows
+        self.link = link
+
+
+class CallbackSink(Sink):
+    """
+    Pass each batch of data rows, and then the PII and link rows, to
+    user-supplied functions.
+    """
+
+    def __init__(self, data=None, pii=None):
+        self.data = data
+        self.pii = pii
+
+    def write_data(self, rows):
+        if self.data is not None:
+            self.data(rows)
+
+    def write_pii(self, rows, link):
+        if self.pii is not None:
+            self.pii(rows, link)
+
+
+def Split(dataset, sink, size=_batchsize, engine=None):
+    """
+    Split a data set into a sink in batches. Returns the sink. If the split
+    fails, the sink is aborted and the task's progress is marked failed.
+    """
+    progress = Progress(dataset.name, total_bytes=os.path.getsize(dataset.source))
+    try:
+        sink.open(dataset)
+        try:
+            for batch in batches(dataset, size, engine):
+                sink.write(batch)
+                progress.update(len(batch), batch.position)
+        except BaseException:
+            sink.abort()
+            raise
+        sink.close()
+    except BaseException:
+        progress.failed()
+        raise
+    progress.done()
+    return sink
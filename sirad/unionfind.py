@@ -0,0 +1,41 @@
+"""
+Array-based union-find for integer-encoded nodes.
+
+All edges are merged at once in rounds: each edge hooks the larger of its
+two roots onto the smaller, and pointer jumping then compresses every node
+to its root, until no edge joins two different roots. Roots only ever point
+to smaller nodes, so every round is a handful of vectorized NumPy operations
+and the number of rounds grows with the logarithm of the component size.
+"""
+
+import numpy as np
+
+
+def _compress(parent):
+    """
+    Point every node directly at its root.
+    """
+    while True:
+        grandparent = parent[parent]
+        if (grandparent == parent).all():
+            return parent
+        parent = grandparent
+
+
+def components(n, u, v):
+    """
+    Find the connected components of n nodes joined by the edges (u, v).
+    Returns the root of each node's component, which is its smallest node.
+    """
+    parent = np.arange(n, dtype=np.int64)
+    u = np.asarray(u, dtype=np.int64)
+    v = np.asarray(v, dtype=np.int64)
+    while True:
+        ru = parent[u]
+        rv = parent[v]
+        join = ru != rv
+        if not join.any():
+            return parent
+        u, v, ru, rv = u[join], v[join], ru[join], rv[join]
+        np.minimum.at(parent, np.maximum(ru, rv), np.minimum(ru, rv))
+        parent = _compress(parent)
@@ -6,7 +6,6 @@ and against the column names in the raw file.
 import logging
 
 from sirad import config
-from openpyxl import load_workbook
 
 def Validate(dataset):
 
@@ -19,6 +18,7 @@ def Validate(dataset):
         with open(dataset.source, "r", encoding=dataset.encoding, newline="") as f:
             firstline = [c.strip().strip('"').upper() for c in next(f).split(dataset.delimiter)]
     elif dataset.type == "xlsx":
+        from openpyxl import load_workbook
         wb = load_workbook(filename=dataset.source, read_only=True, keep_links=False)
         firstline = [c.value.strip().upper() for c in next(wb.active.rows)]
         wb.close()
@@ -0,0 +1,62 @@
+import unittest
+import os
+import shutil
+
+from sirad import config
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestLayoutCache(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        self.layouts_dir = os.path.join(self.output_dir, "layouts")
+        shutil.copytree(os.path.join(project_dir, "data", "layouts"), self.layouts_dir)
+        # Data set names are relative to the layouts directory.
+        self.cwd = os.getcwd()
+        os.chdir(self.output_dir)
+        config.set_option("LAYOUTS_DIR", "layouts")
+        config.set_option("RAW_DIR", os.path.join(project_dir, "data", "raw"))
+
+    def tearDown(self):
+        config.DATASETS = []
+        config.set_option("LAYOUT_CACHE", None)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.output_dir)
+
+    def parse(self):
+        config.DATASETS = []
+        config.parse_layouts()
+        return dict((d.name, d) for d in config.DATASETS)
+
+    def test_cache(self):
+        # Layouts are not cached by default, and hidden files are skipped.
+        with open(os.path.join(self.layouts_dir, ".tax.yaml.swp"), "wb") as f:
+            f.write(b"\x00")
+        self.assertEqual(sorted(self.parse()), ["benefits", "credit_score", "credit_score_xlsx", "tax", "tax_fixed"])
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["layouts"])
+
+        cache = os.path.join(self.output_dir, "layouts.pickle")
+        config.set_option("LAYOUT_CACHE", cache)
+        first = self.parse()
+        self.assertTrue(os.path.exists(cache))
+
+        # Cached layouts are not reloaded.
+        with self.assertNoLogs(level="DEBUG"):
+            second = self.parse()
+        self.assertEqual(sorted(first), sorted(second))
+        self.assertEqual(second["tax"].pii_header, first["tax"].pii_header)
+
+        # Only a modified layout is reloaded.
+        path = os.path.join(self.layouts_dir, "tax.yaml")
+        with open(path, "a") as f:
+            f.write("- extra\n")
+        with self.assertLogs(level="DEBUG") as logs:
+            third = self.parse()
+        self.assertEqual(logs.output, ["DEBUG:root:Loading config for tax"])
+        self.assertEqual(third["tax"].data_header[-1], "extra")
+
+        # A different RAW_DIR invalidates the cache.
+        config.set_option("RAW_DIR", self.output_dir)
+        self.assertEqual(self.parse()["tax"].source, os.path.join(self.output_dir, "tax.txt"))
@@ -0,0 +1,35 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sirad import fuzzy
+from sirad.research import _combine_codes
+
+
+class TestFuzzyFill(unittest.TestCase):
+
+    def test_fill(self):
+        rows = [("Smith", "1980-01-02", "J500", "A"),
+                ("Smyth", "1980-01-02", "J500", None),   # last name typo
+                ("Smith", "1980-02-01", "J500", None),   # month and day swapped
+                ("Jones", "1980-01-02", "J500", None),   # different person
+                ("Brown", "1970-05-05", "M600", "B"),
+                ("Brown", "1970-05-05", "M600", "C"),
+                ("Browne", "1970-05-05", "M600", None),  # matches two SSNs
+                ("Smith", "1980-01-02", "J500", None)]   # exact match
+        last_name, dob, first_sdx, ssn = (pd.Categorical(column) for column in zip(*rows))
+        codes = [np.asarray(c.codes, dtype=np.int64) for c in (dob, last_name, first_sdx)]
+        dobn = _combine_codes(*codes)
+        ssn_codes = np.asarray(ssn.codes, dtype=np.int64)
+        fill = fuzzy.FuzzyFill(dobn, ssn_codes, ssn_codes >= 0, codes[1], codes[0], codes[2],
+                               last_name.categories.values, dob.categories.values)
+        filled = [ssn.categories[fill[k]] if fill[k] >= 0 else None for k in dobn]
+        self.assertEqual(filled, [None, "A", "A", None, None, None, None, None])
+
+    def test_similarity(self):
+        a = np.array(["SMITH", "SMITH", "", "JOHNSON"], dtype=object)
+        b = np.array(["SMYTH", "SMITH", "AB", "JOHNSTON"], dtype=object)
+        self.assertEqual(list(fuzzy._edit_similarity(a, b)), [0.8, 1.0, 0.0, 0.875])
+        self.assertEqual(list(fuzzy._date_similarity(np.array(["1980-01-02", "1980-01-02"]),
+                                                     np.array(["1980-02-01", "1981-01-02"]))), [0.875, 0.875])
@@ -0,0 +1,53 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Time budget in seconds for `sirad sources`, which is well above its
+# typical run time on the test layouts but below the cost of importing the
+# heavy dependencies.
+budget = 1.0
+
+script = """
+import json, runpy, sys, time
+sys.argv = ["sirad", "sources"]
+start = time.perf_counter()
+try:
+    runpy.run_module("sirad", run_name="__main__", alter_sys=True)
+except SystemExit as e:
+    assert not e.code
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed,
+                  "heavy": [m for m in ("openpyxl", "pandas", "numpy", "usaddress") if m in sys.modules],
+                  "version": "__version__" in vars(sys.modules["sirad"])}))
+"""
+
+
+class TestImports(unittest.TestCase):
+
+    def test_startup(self):
+        with tempfile.TemporaryDirectory() as config_dir:
+            os.symlink(os.path.join(project_dir, "data", "layouts"), os.path.join(config_dir, "layouts"))
+            with open(os.path.join(config_dir, "sirad_config.py"), "w") as f:
+                print('LAYOUTS_DIR = "layouts"', file=f)
+            env = dict(os.environ, PYTHONPATH=os.path.dirname(project_dir))
+            output = subprocess.run([sys.executable, "-c", script], cwd=config_dir, env=env,
+                                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        lines = output.splitlines()
+        self.assertEqual(lines[:-1], [os.path.join("raw", name) for name in
+                                      ("benefits.txt", "credit_scores.txt", "credit_scores.xlsx",
+                                       "tax.txt", "tax_fixed.txt")])
+        result = json.loads(lines[-1])
+        self.assertEqual(result["heavy"], [])
+        # The version is only read for the layout cache, which is not set.
+        self.assertFalse(result["version"])
+        self.assertLess(result["elapsed"], budget)
+
+    def test_version(self):
+        import sirad
+        with open(os.path.join(os.path.dirname(sirad.__file__), "VERSION")) as f:
+            self.assertEqual(sirad.__version__, f.read().strip())
@@ -0,0 +1,100 @@
+import unittest
+import gc
+import hashlib
+import os
+import shutil
+import sys
+
+import yaml
+
+from sirad import config
+from sirad import manifest
+from sirad import process
+from sirad import stages
+from sirad.dataset import Dataset
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        os.makedirs(self.output_dir)
+        config.set_option("DATA_DIR", os.path.join(self.output_dir, "data"))
+        config.set_option("PII_DIR", os.path.join(self.output_dir, "pii"))
+        config.set_option("LINK_DIR", os.path.join(self.output_dir, "link"))
+        config.set_option("DATA_SALT", "testcode")
+        config.set_option("PII_SALT", "testcode")
+        config.set_option("RAW_DIR", os.path.join(project_dir, "data", "raw"))
+        config.set_option("PROJECT", "Test")
+        config.set_option("PROCESS_LOG", os.path.join(self.output_dir, "process_log.csv"))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_output(self):
+        path = os.path.join(self.output_dir, "out.txt")
+        with manifest.Output(path) as f:
+            f.write("a|b\n")
+            f.writelines("{}|{}\n".format(i, i * i) for i in range(1000))
+        entry = manifest.read(self.output_dir)["out.txt"]
+        self.assertEqual(entry["sha256"], sha256(path))
+        self.assertEqual(entry["size"], os.path.getsize(path))
+        self.assertEqual(entry["rows"], 1000)
+        self.assertEqual(manifest.lookup(path), entry)
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["manifest.json", "out.txt"])
+        # A file changed since it was written has no current entry.
+        with open(path, "a") as f:
+            f.write("x\n")
+        self.assertIsNone(manifest.lookup(path))
+
+    def test_failed(self):
+        # Partial outputs from a failed write have no entry.
+        path = os.path.join(self.output_dir, "out.txt")
+        with self.assertRaises(RuntimeError):
+            with manifest.Output(path, 10) as f:
+                f.write("12345678")
+                raise RuntimeError()
+        f = manifest.BinaryOutput(path + ".npy")
+        f.write(b"123")
+        del f
+        self.assertEqual(manifest.read(self.output_dir), {})
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["out.txt", "out.txt.npy"])
+        # An output that cannot be created is not recorded either, and is
+        # collected without errors.
+        errors = []
+        sys.unraisablehook, hook = errors.append, sys.unraisablehook
+        try:
+            with self.assertRaises(FileNotFoundError):
+                manifest.Output(os.path.join(self.output_dir, "missing", "out.txt"))
+            gc.collect()
+        finally:
+            sys.unraisablehook = hook
+        self.assertEqual(errors, [])
+        self.assertEqual(manifest.read(self.output_dir), {})
+
+    def test_process(self):
+        with open(os.path.join(project_dir, "data", "layouts", "tax.yaml")) as f:
+            dataset = Dataset("tax", yaml.safe_load(f))
+        for path in process.Process(dataset):
+            entry = manifest.lookup(path)
+            self.assertEqual(entry["sha256"], sha256(path), path)
+            self.assertEqual(entry["rows"], 49, path)
+
+    def test_fingerprint(self):
+        # Stage fingerprints take the digest from the manifest, without
+        # reading the file.
+        path = os.path.join(self.output_dir, "out.txt")
+        with manifest.Output(path) as f:
+            f.write("a\n1\n")
+        manifest.record(path, "0" * 64, os.path.getsize(path))
+        self.assertEqual(stages.fingerprint([path])[path][2], "0" * 64)
+        with open(path, "a") as f:
+            f.write("2\n")
+        self.assertEqual(stages.fingerprint([path])[path][2], sha256(path))
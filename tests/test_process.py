@@ -1,6 +1,7 @@
 import unittest
 import csv
 import os
+import random
 import shutil
 
 import yaml
@@ -183,3 +184,96 @@ class TestSplitCreditXLSX(ThisTester):
 
             to_check = (pv['last_name'], pv['first_name'], dv['credit_score'])
             self.assertIn(to_check, raw_values)
+
+
+class TestBatchEngine(ThisTester):
+
+    def split(self, dataset, engine):
+        random.seed(0)
+        config.set_option("SPLIT_ENGINE", engine)
+        try:
+            paths = process.Process(dataset)
+        finally:
+            config.set_option("SPLIT_ENGINE", "row")
+        contents = []
+        for path in paths:
+            with open(path, "rb") as f:
+                contents.append(f.read())
+        return contents
+
+    def test_fixtures(self):
+        for name in ("benefits", "credit_score", "tax", "tax_fixed"):
+            dataset = Dataset(name, self.load_layout(name + ".yaml"))
+            self.assertEqual(self.split(dataset, "row"), self.split(dataset, "batch"), name)
+
+    def test_irregular_rows(self):
+        # Short rows, blank lines and non-ASCII digits in a file without a header.
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "raw.txt"), "w") as f:
+            f.write("a|000-12-3456|01/02/2000\nb|١٢٣456789\n\nNULL|123 45 6789|bad\n")
+        config.set_option("RAW_DIR", self.output_dir)
+        layout = {"source": "raw.txt", "delimiter": "|", "header": False,
+                  "fields": ["name", {"ssn": {"pii": "ssn", "ssn": True}},
+                             {"dob": {"type": "date", "format": "%m/%d/%Y"}}]}
+        self.assertEqual(self.split(Dataset("raw", dict(layout)), "row"),
+                         self.split(Dataset("raw", dict(layout)), "batch"))
+
+
+class TestSample(ThisTester):
+
+    def setUp(self):
+        super(TestSample, self).setUp()
+        self.sample_dir = os.path.join(self.output_dir, "sample")
+
+    def count(self, path):
+        with open(path) as f:
+            return sum(1 for _ in f) - 1
+
+    def test_methods(self):
+        from sirad.sample import Sample
+        for name, n in (("tax", 49), ("tax_fixed", 9), ("credit_score_xlsx", 29)):
+            dataset = Dataset(name, self.load_layout(name + ".yaml"))
+            for method in ("head", "random"):
+                summary, df, pf, lf = Sample(dataset, 5, method, self.sample_dir)
+                self.assertEqual(self.count(df), 5, (name, method))
+                self.assertEqual(self.count(pf), 5, (name, method))
+            # A sample larger than the data set is the whole data set.
+            summary, df, pf, lf = Sample(dataset, 1000, "random", self.sample_dir)
+            self.assertEqual(self.count(df), n, name)
+        self.assertFalse(os.path.exists(config.get_option("PROCESS_LOG")))
+
+    def test_random_fixed(self):
+        # Random samples of fixed-width records are read by seeking.
+        from sirad.sample import Sample
+        dataset = Dataset("tax_fixed", self.load_layout("tax_fixed.yaml"))
+        with open(dataset.source, "rb") as f:
+            lines = [line for line in f if line.strip()]
+        Sample(dataset, 4, "random", self.sample_dir)
+        with open(os.path.join(self.sample_dir, "tax_fixed.raw.txt"), "rb") as f:
+            sampled = f.readlines()
+        self.assertEqual(len(sampled), 4)
+        self.assertEqual([line for line in lines if line in sampled], sampled)
+
+    def test_summary(self):
+        from sirad.sample import Sample
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "raw.txt"), "w") as f:
+            f.write("name|ssn|dob\na|000-12-3456|01/02/2000\nNULL|123 45 6789|bad\nc|123456789|\nd||12/31/1999\n")
+        config.set_option("RAW_DIR", self.output_dir)
+        layout = {"source": "raw.txt", "delimiter": "|",
+                  "fields": ["name", {"ssn": {"pii": "ssn", "ssn": True}},
+                             {"dob": {"type": "date", "format": "%m/%d/%Y"}}]}
+        with self.assertLogs(level="INFO") as logs:
+            summary = Sample(Dataset("raw", layout), 10, "head", self.sample_dir)[0]
+        self.assertEqual([line.partition("raw/")[2] for line in logs.output if "raw/" in line],
+                         ["name: 4 values, 1 null, - invalid date, - invalid SSN",
+                          "ssn: 4 values, 1 null, - invalid date, 1 invalid SSN",
+                          "dob: 4 values, 1 null, 1 invalid date, - invalid SSN"])
+        with open(summary) as f:
+            rows = dict((row["field"], row) for row in csv.DictReader(f))
+        self.assertEqual(rows["name"]["null"], "1")
+        self.assertEqual(rows["name"]["invalid_ssn"], "")
+        self.assertEqual(rows["ssn"]["null_rate"], "0.250")
+        self.assertEqual(rows["ssn"]["invalid_ssn"], "1")
+        self.assertEqual(rows["dob"]["null"], "1")
+        self.assertEqual(rows["dob"]["invalid_date_rate"], "0.250")
@@ -0,0 +1,53 @@
+import unittest
+import os
+import shutil
+
+import yaml
+
+from sirad import config
+from sirad import progress
+from sirad import stream
+from sirad.dataset import Dataset
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        os.makedirs(self.output_dir)
+        self.path = os.path.join(self.output_dir, "progress.json")
+        config.set_option("PROGRESS_FILE", self.path)
+        config.set_option("PROGRESS_INTERVAL", 0)
+        config.set_option("DATA_SALT", "testcode")
+        config.set_option("PII_SALT", "testcode")
+        config.set_option("RAW_DIR", os.path.join(project_dir, "data", "raw"))
+        with open(os.path.join(project_dir, "data", "layouts", "tax.yaml")) as f:
+            self.dataset = Dataset("tax", yaml.safe_load(f))
+
+    def tearDown(self):
+        config.set_option("PROGRESS_FILE", None)
+        config.set_option("PROGRESS_INTERVAL", 10)
+        shutil.rmtree(self.output_dir)
+
+    def test_split(self):
+        for engine in ("row", "batch"):
+            stream.Split(self.dataset, stream.MemorySink(), size=20, engine=engine)
+            status = progress.read_status(self.path)["tasks"]["tax"]
+            self.assertEqual(status["state"], "done")
+            self.assertEqual(status["count"], 49)
+            self.assertEqual(status["bytes"], os.path.getsize(self.dataset.source))
+            self.assertEqual(status["fraction"], 1.0)
+
+    def test_eta(self):
+        p = progress.Progress("task", total=200)
+        p.update(50)
+        status = progress.read_status(self.path)["tasks"]["task"]
+        self.assertEqual(status["state"], "running")
+        self.assertEqual(status["fraction"], 0.25)
+        self.assertIsNotNone(status["eta"])
+        self.assertTrue(p.line().startswith("50 rows (25.0%)"))
+        # Tasks are recorded side by side.
+        progress.Progress("other", total_bytes=10).done()
+        self.assertEqual(sorted(progress.read_status(self.path)["tasks"]), ["other", "task"])
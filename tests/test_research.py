@@ -0,0 +1,500 @@
+import unittest
+import csv
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from sirad import census
+from sirad import config
+from sirad import ids
+from sirad import manifest
+from sirad import process
+from sirad import research
+from sirad import sortindex
+from sirad.addresscache import AddressCache
+from sirad.dataset import Dataset
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+def get_file_path(dir, name):
+    return os.path.join(project_dir, "data", dir, name)
+
+
+class ResearchTester(unittest.TestCase):
+
+    layouts = ("benefits", "credit_score", "tax")
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        config.set_option("DATA_DIR", os.path.join(self.output_dir, "data"))
+        config.set_option("PII_DIR", os.path.join(self.output_dir, "pii"))
+        config.set_option("LINK_DIR", os.path.join(self.output_dir, "link"))
+        config.set_option("RESEARCH_DIR", os.path.join(self.output_dir, "research"))
+        config.set_option("DATA_SALT", "testcode")
+        config.set_option("PII_SALT", "testcode")
+        config.set_option("RAW_DIR", os.path.join(project_dir, "data", "raw"))
+        config.set_option("CENSUS_STREET_FILE", get_file_path("census", "streets.csv"))
+        config.set_option("CENSUS_STREET_NUM_FILE", get_file_path("census", "street_nums.csv"))
+        config.set_option("CENSUS_INDEX_DIR", os.path.join(self.output_dir, "census_index"))
+        config.set_option("PROJECT", "Test")
+        config.set_option("PROCESS_LOG", os.path.join(self.output_dir, "data", "sirad.log"))
+        config.DATASETS = []
+        for name in self.layouts:
+            with open(get_file_path("layouts", name + ".yaml")) as f:
+                config.DATASETS.append(Dataset(name, yaml.safe_load(f)))
+        for dataset in config.DATASETS:
+            process.Process(dataset)
+
+    def processed_reader(self, path):
+        with open(path) as f:
+            return list(csv.DictReader(f, delimiter="|"))
+
+    def tearDown(self):
+        config.DATASETS = []
+        shutil.rmtree(self.output_dir)
+
+
+class TestSiradID(ResearchTester):
+
+    def test_sirad_id(self):
+        ids = research.SiradID()
+        self.assertEqual(len(ids), 60 + 29 + 49)
+        self.assertEqual(sorted(set(ids.index)), sorted(self.layouts))
+
+        # IDs are a dense rank starting at 1.
+        distinct = sorted(set(ids.sirad_id) - set([0]))
+        self.assertEqual(distinct, list(range(1, len(distinct) + 1)))
+
+        # Records with the same valid SSN share a SIRAD ID.
+        benefits = ids.loc["benefits"].set_index("pii_id").sirad_id
+        by_ssn = {}
+        for row in self.processed_reader(config.get_path("benefits", "pii")):
+            if row["ssn_invalid"] == "0":
+                by_ssn.setdefault(row["ssn"], set()).add(benefits[int(row["pii_id"])])
+        self.assertTrue(len(by_ssn) > 0)
+        for sirad_ids in by_ssn.values():
+            self.assertEqual(len(sirad_ids), 1)
+
+        with open(config.get_path("sirad_id_stats", "research")) as f:
+            stats = list(csv.DictReader(f))
+        self.assertEqual(len(stats), 3)
+        self.assertIn("peak_mb", stats[0])
+
+    def test_fuzzy_sirad_id(self):
+        # A record without an SSN and a misspelled last name.
+        benefits = min((row for row in self.processed_reader(config.get_path("benefits", "pii"))
+                        if row["ssn_invalid"] == "0"),
+                       key=lambda row: (row["last_name"], row["first_name"], row["dob"]))
+        with open(config.get_path("credit_score", "pii"), "a") as f:
+            print(30, benefits["first_name"], benefits["last_name"] + "s", benefits["dob"], sep="|", file=f)
+
+        ids = research.SiradID().reset_index()
+        fuzzy = research.SiradID(fuzzy=True).reset_index()
+        self.assertEqual(len(ids), len(fuzzy))
+        for table, filled in ((ids, False), (fuzzy, True)):
+            table = table.set_index(["dsn", "pii_id"]).sirad_id
+            self.assertEqual(table["credit_score", 30] == table["benefits", int(benefits["pii_id"])], filled)
+        with open(config.get_path("sirad_id_stats", "research")) as f:
+            stats = {row[""]: row["n_fuzzy_fills"] for row in csv.DictReader(f)}
+        self.assertEqual(stats, {"benefits": "", "credit_score": "1", "tax": ""})
+        with self.assertRaises(ValueError):
+            research.Research(partitions=2, fuzzy=True)
+
+    def test_partitioned_sirad_id(self):
+        from sirad.partition import PartitionedSiradID
+        ids = research.SiradID().reset_index()
+        partitioned = PartitionedSiradID(npartitions=3).reset_index()
+        self.assertEqual(len(ids), len(partitioned))
+        self.assertNotIn("sirad_id_partitions", os.listdir(os.path.dirname(config.get_path("tax", "pii"))))
+
+        # Both methods group the same records under an ID.
+        merged = ids.merge(partitioned, on=["dsn", "pii_id"], validate="one_to_one")
+        pairs = merged[["sirad_id_x", "sirad_id_y"]].drop_duplicates()
+        self.assertTrue(pairs.sirad_id_x.is_unique)
+        self.assertTrue(pairs.sirad_id_y.is_unique)
+        self.assertTrue(((merged.sirad_id_x == 0) == (merged.sirad_id_y == 0)).all())
+
+        # The partitions are removed when a worker fails.
+        from sirad import partition
+        rank = partition._rank
+        partition._rank = _fail
+        try:
+            with self.assertRaises(RuntimeError):
+                PartitionedSiradID(nthreads=2, npartitions=3)
+        finally:
+            partition._rank = rank
+        self.assertNotIn("sirad_id_partitions", os.listdir(os.path.dirname(config.get_path("tax", "pii"))))
+
+    def test_incremental_sirad_id(self):
+        from sirad.keyindex import IncrementalSiradID
+        ids = research.SiradID().reset_index()
+        incremental = IncrementalSiradID().reset_index()
+
+        # Both methods group the same records under an ID.
+        merged = ids.merge(incremental, on=["dsn", "pii_id"], validate="one_to_one")
+        pairs = merged[["sirad_id_x", "sirad_id_y"]].drop_duplicates()
+        self.assertTrue(pairs.sirad_id_x.is_unique)
+        self.assertTrue(pairs.sirad_id_y.is_unique)
+
+        # Only the reprocessed data set is reloaded, and IDs are stable.
+        process.Process(config.DATASETS[2])
+        with self.assertLogs(level="INFO") as logs:
+            rerun = IncrementalSiradID().reset_index()
+        self.assertEqual(sum("Reusing SIRAD_ID" in line for line in logs.output), 2)
+        self.assertEqual(sum("Loading PII" in line for line in logs.output), 1)
+        for name in self.layouts:
+            self.assertEqual(sorted(incremental[incremental.dsn == name].sirad_id),
+                             sorted(rerun[rerun.dsn == name].sirad_id))
+
+
+class TestTransitiveSiradID(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        config.set_option("PII_DIR", os.path.join(self.output_dir, "pii"))
+        config.set_option("RESEARCH_DIR", os.path.join(self.output_dir, "research"))
+        config.set_option("PROJECT", "Test")
+        layout = {"source": "people.txt",
+                  "fields": [{"first": {"pii": "first_name"}},
+                             {"last": {"pii": "last_name"}},
+                             {"ssn": {"pii": "ssn", "ssn": True, "hash": True}},
+                             {"dob": {"pii": "dob", "type": "date", "format": "%Y-%m-%d"}}]}
+        config.DATASETS = [Dataset("people", layout)]
+        # The same DOB/name appears with two SSNs, and without one.
+        rows = [(1, "Ann", "Lee", "a", "1980-01-01", 0),
+                (2, "Ann", "Lee", "b", "1980-01-01", 0),
+                (3, "Ann", "Lee", "", "1980-01-01", 1),
+                (4, "Bob", "Ray", "c", "1970-01-01", 0)]
+        header = config.DATASETS[0].pii_header
+        with open(config.get_path("people", "pii"), "w") as f:
+            writer = csv.writer(f, delimiter="|")
+            writer.writerow(header)
+            for row in rows:
+                row = dict(zip(("pii_id", "first_name", "last_name", "ssn", "dob", "ssn_invalid"), row))
+                writer.writerow([row[h] for h in header])
+
+    def tearDown(self):
+        config.DATASETS = []
+        config.set_option("TRANSITIVE_MAX_SSNS", 5)
+        shutil.rmtree(self.output_dir)
+
+    def groups(self, ids):
+        return sorted(sorted(g) for g in ids.groupby("sirad_id").pii_id.apply(list))
+
+    def test_transitive(self):
+        self.assertEqual(self.groups(research.SiradID()), [[1], [2], [3], [4]])
+        self.assertEqual(self.groups(research.SiradID(transitive=True)), [[1, 2, 3], [4]])
+        with open(config.get_path("sirad_id_stats", "research")) as f:
+            self.assertEqual(list(csv.DictReader(f))[0]["n_transitive_links"], "2")
+        # Components with too many SSNs keep their exact keys.
+        config.set_option("TRANSITIVE_MAX_SSNS", 1)
+        self.assertEqual(self.groups(research.SiradID(transitive=True)), [[1], [2], [3], [4]])
+
+
+class TestCensusIndex(ResearchTester):
+
+    layouts = ()
+
+    def test_lookup(self):
+        index = census.load()
+        self.assertEqual(index.nstreets, 7)
+        self.assertEqual(index.nranges, 4)
+        self.assertTrue(index.valid_zips(np.array([2903, 2906])).all())
+        self.assertFalse(index.valid_zips(np.array([2910])).any())
+        keys = index.encode(np.array(["ELM", "MAIN", "MAIN", "MAIN", "NOWHERE"]), np.array([2906, 2903, 2903, 2903, 2903]))
+        self.assertEqual(list(index.street(keys[:1])), [440070011001])
+        # Exact match, nearest lower number, and below the start of the range.
+        blkgrp, exact = index.street_num(keys[1:], np.array([101, 125, 0, 1]))
+        self.assertEqual(list(blkgrp[:3]), [440070009009, 440070001001, 440070001001])
+        self.assertTrue(np.isnan(blkgrp[3]))
+        self.assertEqual(list(exact), [True, False, False, False])
+
+    def test_range_search(self):
+        # Ranges alternate between the even and odd sides of each street,
+        # leaving parity gaps between the starts of the ranges.
+        nums = pd.DataFrame([(n, street, 2903, 440070000000 + 100 * i + n % 2 * 10 + n // 100)
+                             for i, street in enumerate(["MAIN", "ELM"])
+                             for n in (2, 3, 100, 101, 198, 203, 400, 1001)][::-1],
+                            columns=["street_num", "street", "zip", "blkgrp"])
+        os.makedirs(self.output_dir)
+        path = os.path.join(self.output_dir, "street_nums.csv")
+        nums.to_csv(path, index=False)
+        config.set_option("CENSUS_STREET_NUM_FILE", path)
+        index = census.load()
+
+        # Bounds, just outside them, and between ranges of each parity.
+        queries = pd.DataFrame([(street, n + d) for street in ["MAIN", "ELM"]
+                                for n in nums.street_num.unique() for d in (-2, -1, 0, 1, 2)] +
+                               [("MAIN", 0), ("ELM", 5000)], columns=["street", "street_num"])
+        blkgrp, exact = index.street_num(index.encode(queries.street.values, np.full(len(queries), 2903)),
+                                         queries.street_num.values.astype(np.int64))
+
+        # The previous look-up, one row at a time.
+        lookup = {street: (group.street_num.values, group.blkgrp.values)
+                  for street, group in nums.sort_values("street_num").groupby("street")}
+        for row, b, e in zip(queries.itertuples(), blkgrp, exact):
+            l = lookup[row.street]
+            i = np.searchsorted(l[0], row.street_num, side="right")
+            self.assertEqual(b, l[1][max(0, i - 1)], row)
+            self.assertEqual(e, row.street_num in l[0], row)
+
+    def test_rebuild(self):
+        index = census.load()
+        names = np.array(index.names)
+        # Rebuilding does not rewrite the arrays that are already mapped.
+        census.BuildIndex()
+        self.assertEqual(list(index.names), list(names))
+        path = config.get_option("CENSUS_INDEX_DIR")
+        self.assertEqual(len([name for name in os.listdir(path) if name.startswith("build-")]), 1)
+        # Concurrent workers wait for one another to build a missing index.
+        os.unlink(os.path.join(path, "meta.json"))
+        census._index = None
+        with multiprocessing.Pool(3) as pool:
+            self.assertEqual(pool.map(_census_streets, range(3)), [7, 7, 7])
+        self.assertEqual(len([name for name in os.listdir(path) if name.startswith("build-")]), 1)
+
+
+def _fail(*args):
+    raise RuntimeError()
+
+
+def _census_streets(_):
+    return census.load().nstreets
+
+
+class TestAddressCache(ResearchTester):
+
+    layouts = ()
+
+    def test_eviction(self):
+        path = os.path.join(self.output_dir, "address_cache.sqlite")
+        cache = AddressCache(path, size=2)
+        cache.put({"1 MAIN ST": ("MAIN", None, "1"), "2 ELM ST": ("ELM", None, "2")})
+        cache.close()
+        cache = AddressCache(path, size=2)
+        self.assertEqual(cache.get(["2 ELM ST", "3 OAK ST"]), {"2 ELM ST": ("ELM", None, "2")})
+        cache.put({"3 OAK ST": ("OAK", None, "3")})
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses, cache.evicted), (1, 1, 1))
+        # The least recently used address was evicted.
+        cache = AddressCache(path, size=2)
+        self.assertEqual(sorted(cache.get(["1 MAIN ST", "2 ELM ST", "3 OAK ST"])), ["2 ELM ST", "3 OAK ST"])
+        cache.close()
+
+
+class TestResearch(ResearchTester):
+
+    def test_research(self):
+        research.Research(seed=1)
+        rows = self.processed_reader(config.get_path("benefits", "research"))
+        self.assertEqual(len(rows), 60)
+        self.assertEqual(list(rows[0].keys())[:5],
+                         ["sirad_id", "home_city", "home_zip5", "home_blkgrp", "record_id"])
+        self.assertEqual([row["record_id"] for row in rows], [str(i) for i in range(1, 61)])
+        self.assertTrue(sum(1 for row in rows if row["home_blkgrp"]) > 40)
+        with open(config.get_path("censuscode", "research").rpartition(".")[0] + ".log") as f:
+            self.assertIn("distinct addresses censuscoded for 60 records", f.read())
+        rows = self.processed_reader(config.get_path("tax", "research"))
+        self.assertEqual(len(rows), 49)
+        self.assertTrue(all(row["sirad_id"] for row in rows))
+        # SIRAD IDs can be looked up by pii_id for a single data set.
+        with open(config.get_path("sirad_id", "pii")) as f:
+            tax = dict((int(row["pii_id"]), int(row["sirad_id"])) for row in csv.DictReader(f) if row["dsn"] == "tax")
+        self.assertEqual(list(ids.lookup("tax", [3, 1, 2])), [tax[3], tax[1], tax[2]])
+        self.assertEqual(list(ids.lookup(config.DATASETS[2], sorted(tax))), [tax[i] for i in sorted(tax)])
+        with self.assertRaises(KeyError):
+            ids.lookup("tax", [50])
+
+        # Rewriting the arrays replaces them, so mapped arrays stay intact.
+        mapped = ids.load("tax")
+        before = list(mapped[1:])
+        table = pd.DataFrame({"pii_id": sorted(tax), "sirad_id": [tax[i] + 1000 for i in sorted(tax)]},
+                             index=pd.Index(["tax"] * len(tax), name="dsn"))
+        ids.write(table)
+        self.assertEqual(list(mapped[1:]), before)
+        self.assertEqual(list(ids.lookup("tax", [1, 2])), [tax[1] + 1000, tax[2] + 1000])
+        directory = os.path.dirname(ids.path("tax"))
+        self.assertFalse([name for name in os.listdir(directory) if name.endswith(".tmp")])
+        self.assertEqual(manifest.lookup(ids.path("tax"))["rows"], len(tax))
+
+    def test_attach_sparse(self):
+        # Attach census codes without a SIRAD ID, with pii_ids that are
+        # sparse and out of record_id order in the link file.
+        research.Research(seed=1)
+        dataset = config.DATASETS[0]
+        link_path = config.get_path(dataset.name, "link")
+        census_path = research._censuscode_paths(dataset, "home")[0]
+        link = pd.read_csv(link_path, sep="|").sample(frac=1, random_state=0)
+        link["pii_id"] = link.pii_id * 7 + 1000
+        link.to_csv(link_path, sep="|", index=False)
+        codes = pd.read_csv(census_path, dtype=str)
+        codes["pii_id"] = codes.pii_id.astype(int) * 7 + 1000
+        codes.to_csv(census_path, index=False)
+
+        research.Attach(dataset, sirad_id=False)
+        data = pd.read_csv(config.get_path(dataset.name, "data"), sep="|", dtype=str, keep_default_na=False)
+        expected = data.assign(record_id=data.record_id.astype(int))\
+                       .merge(link, on="record_id", how="left")\
+                       .merge(codes, on="pii_id", how="left")\
+                       .fillna("")
+        expected = expected[list(codes.columns[1:]) + list(data.columns)].astype(str)
+        rows = self.processed_reader(config.get_path(dataset.name, "research"))
+        self.assertEqual(list(rows[0].keys()), list(expected.columns))
+        self.assertEqual(len(rows), len(expected))
+        for row, expected_row in zip(rows, expected.to_dict("records")):
+            self.assertEqual(row, expected_row)
+
+    def test_parallel_addresses(self):
+        # Parsing addresses across a pool gives the same census codes.
+        config.set_option("ADDRESS_CACHE_SIZE", 0)
+        chunksize = research._parse_chunksize
+        research._parse_chunksize = 7
+        try:
+            outputs = []
+            for nthreads in (1, 2):
+                research.Addresses(config.DATASETS, nthreads)
+                with open(research._censuscode_paths(config.DATASETS[0], "home")[0]) as f:
+                    outputs.append(f.read())
+        finally:
+            research._parse_chunksize = chunksize
+            config.set_option("ADDRESS_CACHE_SIZE", 10000000)
+        self.assertGreater(outputs[0].count("\n"), 40)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_stages(self):
+        research.Research(seed=1)
+        path = config.get_path("tax", "research")
+        mtime = os.stat(path).st_mtime_ns
+
+        # Rerunning skips every stage, even if an input was touched.
+        os.utime(config.get_path("tax", "data"))
+        with self.assertLogs(level="INFO") as logs:
+            research.Research(seed=1)
+        self.assertEqual(len(self.skipped(logs)), 3 + 1 + 3)
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+        # A changed option reruns the SIRAD ID.
+        with self.assertLogs(level="INFO") as logs:
+            research.Research(seed=2, stage="siradid")
+        self.assertEqual(self.skipped(logs), [])
+
+        # A forced stage for one data set.
+        with self.assertLogs(level="INFO") as logs:
+            research.Research(seed=2, only=["tax"], stage="attach", force=True)
+        self.assertEqual([line.rpartition(" ")[2] for line in logs.output if "Scheduler: Starting" in line],
+                         ["Attach:tax"])
+        self.assertNotEqual(os.stat(path).st_mtime_ns, mtime)
+
+        with self.assertRaises(ValueError):
+            research.Research(only=["missing"])
+        with self.assertRaises(ValueError):
+            research.Research(stage="missing")
+
+    def test_sort(self):
+        research.Research(seed=1)
+        expected = dict((name, self.processed_reader(config.get_path(name, "research"))) for name in self.layouts)
+        research.Research(seed=1, sort=True, stage="attach")
+        for name in self.layouts:
+            path = config.get_path(name, "research")
+            rows = self.processed_reader(path)
+            self.assertEqual(sorted(rows, key=lambda row: int(row["record_id"])),
+                             sorted(expected[name], key=lambda row: int(row["record_id"])))
+            self.assertEqual(rows, sorted(rows, key=lambda row: (int(row["sirad_id"]), int(row["record_id"]))))
+            # Rows for a set of SIRAD IDs are read by seeking.
+            sirad_ids = [int(rows[i]["sirad_id"]) for i in (0, len(rows) // 2, len(rows) - 1)]
+            df = sortindex.read(path, sirad_ids + [10 ** 9], dtype=str, keep_default_na=False)
+            self.assertEqual(df.to_dict("records"), [row for row in rows if int(row["sirad_id"]) in sirad_ids])
+
+        # The external sort merges runs spilled to disk.
+        research.Research(seed=1, sort=True, only=["tax"], stage="attach", force=True)
+        with open(config.get_path("tax", "research")) as f:
+            single = f.read()
+        runsize = sortindex._runsize
+        sortindex._runsize = 10
+        try:
+            research.Research(seed=1, sort=True, only=["tax"], stage="attach", force=True)
+        finally:
+            sortindex._runsize = runsize
+        with open(config.get_path("tax", "research")) as f:
+            self.assertEqual(f.read(), single)
+
+        # Unsorted files have no index.
+        research.Research(seed=1, stage="attach")
+        self.assertFalse(os.path.exists(sortindex.path(config.get_path("tax", "research"))))
+        self.assertEqual(self.processed_reader(config.get_path("tax", "research")), expected["tax"])
+
+    def assertLinked(self):
+        # Every research file's SIRAD IDs match the SIRAD ID table.
+        with open(config.get_path("sirad_id", "pii")) as f:
+            table = dict(((row["dsn"], row["pii_id"]), row["sirad_id"]) for row in csv.DictReader(f))
+        for dataset in config.DATASETS:
+            with open(config.get_path(dataset.name, "link")) as f:
+                link = dict((row["record_id"], row["pii_id"]) for row in csv.DictReader(f, delimiter="|"))
+            for row in self.processed_reader(config.get_path(dataset.name, "research")):
+                self.assertEqual(row["sirad_id"], table[(dataset.name, link[row["record_id"]])], dataset.name)
+
+    def test_only(self):
+        research.Research()
+        self.assertLinked()
+
+        # With unchanged PII, the SIRAD ID is not rebuilt for another subset.
+        with self.assertLogs(level="INFO") as logs:
+            research.Research(only=["benefits"])
+        self.assertIn("siradid", " ".join(self.skipped(logs)))
+        self.assertLinked()
+
+        # A PII change rebuilds the SIRAD ID, and reattaches every data set.
+        with open(config.get_path("credit_score", "pii")) as f:
+            rows = list(csv.DictReader(f, delimiter="|"))
+        rows[0]["last_name"] += "X"
+        with open(config.get_path("credit_score", "pii"), "w") as f:
+            writer = csv.DictWriter(f, rows[0].keys(), delimiter="|", lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
+        with self.assertLogs(level="INFO") as logs:
+            research.Research(only=["benefits"])
+        started = [line.rpartition(" ")[2] for line in logs.output if "Scheduler: Starting" in line]
+        self.assertEqual(sorted(s for s in started if s.startswith("Attach:")),
+                         ["Attach:benefits", "Attach:credit_score", "Attach:tax"])
+        self.assertLinked()
+
+    def skipped(self, logs):
+        return [line for line in logs.output if "Skipping, inputs are unchanged" in line]
+
+    def test_shards(self):
+        research.Research(seed=1)
+        names = [d.name for d in config.DATASETS]
+        expected = {}
+        for name in names:
+            with open(config.get_path(name, "research")) as f:
+                expected[name] = f.read()
+        # Peak memory varies between runs.
+        stats_path = config.get_path("sirad_id_stats", "research")
+        expected_stats = pd.read_csv(stats_path, index_col=0).drop(columns="peak_mb")
+        shutil.rmtree(os.path.dirname(config.get_path("tax", "research")))
+
+        # Each shard attaches its own data sets, with the same SIRAD IDs.
+        try:
+            for i in (1, 2):
+                config.set_shard(i, 2)
+                research.Research(seed=1)
+        finally:
+            config.SHARD = None
+        logs = [f for f in os.listdir(os.path.dirname(config.get_path("tax", "research"))) if f.startswith("censuscode")]
+        self.assertEqual(len(logs), 1)
+        self.assertRegex(logs[0], r"^censuscode\.shard-[12]-of-2\.log$")
+        for name in names:
+            with open(config.get_path(name, "research")) as f:
+                self.assertEqual(f.read(), expected[name])
+        pd.testing.assert_frame_equal(pd.read_csv(stats_path, index_col=0).drop(columns="peak_mb"), expected_stats)
+
+        config.set_shard(1, 2)
+        try:
+            with self.assertRaises(ValueError):
+                research.Research()
+        finally:
+            config.SHARD = None
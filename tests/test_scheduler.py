@@ -0,0 +1,79 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from sirad import config, profiling, scheduler
+from sirad.exceptions import TaskFailedException
+
+
+def add(*values):
+    return sum(values)
+
+
+def fail():
+    raise RuntimeError("failed")
+
+
+class TestScheduler(unittest.TestCase):
+
+    def tasks(self):
+        return [scheduler.Task("a", add, (1, 2)),
+                scheduler.Task("b", add, (scheduler.Result("a"), 3)),
+                scheduler.Task("c", add, (scheduler.Result("a"), scheduler.Result("b")), cost=10),
+                scheduler.Task("d", add, (4,), deps=["c"])]
+
+    def test_serial(self):
+        results = scheduler.run(self.tasks())
+        self.assertEqual(results, {"a": 3, "b": 6, "c": 9, "d": 4})
+
+    def test_parallel(self):
+        results = scheduler.run(self.tasks(), nthreads=3)
+        self.assertEqual(results, {"a": 3, "b": 6, "c": 9, "d": 4})
+
+    def test_failure(self):
+        tasks = self.tasks() + [scheduler.Task("e", fail), scheduler.Task("f", add, (scheduler.Result("e"),))]
+        for nthreads in (1, 2):
+            with self.assertLogs(level="ERROR") as logs:
+                with self.assertRaisesRegex(TaskFailedException, "failed tasks: e, f$"):
+                    scheduler.run(tasks, nthreads)
+            self.assertTrue(any("RuntimeError: failed" in line for line in logs.output))
+
+    def test_cycle(self):
+        tasks = [scheduler.Task("a", add, deps=["b"]), scheduler.Task("b", add, deps=["a"])]
+        with self.assertRaises(ValueError):
+            scheduler.run(tasks)
+
+    def test_profile(self):
+        # Each task is profiled in the worker that runs it.
+        directory = tempfile.mkdtemp()
+        try:
+            profiling.start(directory)
+            scheduler.run(self.tasks(), nthreads=2)
+            self.assertEqual(sorted(os.listdir(directory)), ["a.pstats", "b.pstats", "c.pstats", "d.pstats"])
+            with self.assertLogs(level="INFO"):
+                summary = profiling.summarize(top=5)
+            with open(summary) as f:
+                text = f.read()
+            self.assertIn("across 4 tasks", text)
+            self.assertIn("(add)", text)
+        finally:
+            config.set_option("PROFILE_DIR", None)
+            shutil.rmtree(directory)
+
+    def test_slots(self):
+        # Free worker slots are shared among the tasks with a pool started
+        # together, up to their requests.
+        tasks = [scheduler.Task("a", scheduler.slots, slots=4), scheduler.Task("b", scheduler.slots, slots=4),
+                 scheduler.Task("c", scheduler.slots, deps=["a", "b"], slots=3),
+                 scheduler.Task("d", scheduler.slots, deps=["c"])]
+        self.assertEqual(scheduler.run(tasks, nthreads=4), {"a": 2, "b": 2, "c": 3, "d": 1})
+        self.assertEqual(scheduler.run(tasks, nthreads=1), {"a": 1, "b": 1, "c": 1, "d": 1})
+
+        # Tasks with a pool are given their slots before the cheaper tasks
+        # that are ready with them, which start in the slots left over.
+        tasks = [scheduler.Task("Attach:" + str(i), scheduler.slots, cost=100) for i in range(6)]
+        tasks.append(scheduler.Task("Addresses", scheduler.slots, cost=1, slots=3))
+        results = scheduler.run(tasks, nthreads=4)
+        self.assertEqual(results["Addresses"], 3)
+        self.assertEqual(set(results[task.name] for task in tasks[:-1]), {1})
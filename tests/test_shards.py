@@ -0,0 +1,73 @@
+import unittest
+import os
+import shutil
+
+from types import SimpleNamespace
+
+from sirad import config
+from sirad import shards
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.datasets = [SimpleNamespace(name=name, source=os.path.join(project_dir, "data", "raw", name + ".txt"))
+                         for name in ("benefits", "credit_scores", "missing", "tax", "tax_fixed")]
+
+    def test_parse(self):
+        self.assertEqual(shards.parse("2/4"), (2, 4))
+        for spec in ("0/4", "5/4", "2", "a/b", "1/0"):
+            with self.assertRaises(ValueError):
+                shards.parse(spec)
+
+    def test_assign(self):
+        assigned = shards.assign(self.datasets, 2)
+        self.assertEqual([[d.name for d in shard] for shard in assigned],
+                         [["benefits", "tax_fixed"], ["tax", "credit_scores", "missing"]])
+        # Every data set is in exactly one shard, in its original order.
+        selected = [d.name for i in (1, 2, 3) for d in shards.select(self.datasets, i, 3)]
+        self.assertEqual(sorted(selected), sorted(d.name for d in self.datasets))
+        self.assertEqual([d.name for d in shards.select(self.datasets, 1, 2)], ["benefits", "tax_fixed"])
+
+    def test_suffix(self):
+        self.assertEqual(shards.suffix("data/process_log.csv", 2, 4), "data/process_log.shard-2-of-4.csv")
+
+
+class TestProcessLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        self.path = os.path.join(self.output_dir, "process_log.csv")
+        config.load_config()
+        config.set_option("PROCESS_LOG", self.path)
+
+    def tearDown(self):
+        config.SHARD = None
+        config.FINISHED = []
+        config.set_option("PROCESS_LOG", None)
+        shutil.rmtree(self.output_dir)
+
+    def test_merge(self):
+        # Each shard appends to its own log, and sees the data sets
+        # finished by every shard.
+        for i, name in ((1, "tax"), (2, "benefits")):
+            config.set_shard(i, 2)
+            config.load_process_log()
+            # Loading the logs does not create them.
+            self.assertFalse(os.path.exists(shards.suffix(self.path, i, 2)))
+            config.log_process(name, 10, 0.1)
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         [os.path.basename(shards.suffix(self.path, i, 2)) for i in (1, 2)])
+        config.load_process_log()
+        self.assertIn("tax", config.FINISHED)
+
+        config.SHARD = None
+        config.set_option("PROCESS_LOG", self.path)
+        config.load_process_log()
+        self.assertTrue({"tax", "benefits"} <= config.FINISHED)
+        config.merge_process_logs()
+        self.assertEqual(os.listdir(self.output_dir), ["process_log.csv"])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "DATASET,NROWS,ELAPSED\ntax,10,0.100\nbenefits,10,0.100\n")
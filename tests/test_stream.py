@@ -0,0 +1,112 @@
+import unittest
+import csv
+import os
+import random
+import shutil
+
+import yaml
+
+from sirad import config
+from sirad import manifest
+from sirad import progress
+from sirad import stream
+from sirad.dataset import Dataset
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+def get_file_path(dir, name):
+    return os.path.join(project_dir, "data", dir, name)
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(project_dir, "processed")
+        config.set_option("DATA_DIR", os.path.join(self.output_dir, "data"))
+        config.set_option("PII_DIR", os.path.join(self.output_dir, "pii"))
+        config.set_option("LINK_DIR", os.path.join(self.output_dir, "link"))
+        config.set_option("DATA_SALT", "testcode")
+        config.set_option("PII_SALT", "testcode")
+        config.set_option("RAW_DIR", os.path.join(project_dir, "data", "raw"))
+        config.set_option("PROJECT", "Test")
+        with open(get_file_path("layouts", "tax.yaml")) as f:
+            self.dataset = Dataset("tax", yaml.safe_load(f))
+
+    def tearDown(self):
+        config.set_option("PROGRESS_FILE", None)
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def read(self, path):
+        with open(path) as f:
+            return list(csv.reader(f, dialect="sirad"))
+
+    def test_batches(self):
+        batches = list(stream.batches(self.dataset, size=20))
+        self.assertEqual([len(b) for b in batches], [20, 20, 9])
+        self.assertEqual(batches[1].record_id[0], 21)
+        columns = batches[2].pii_columns()
+        self.assertEqual(sorted(columns), sorted(self.dataset.pii_header[1:]))
+        self.assertEqual(columns["ssn"], [prow[self.dataset.pii_header.index("ssn") - 1] for prow in batches[2].pii])
+
+    def test_sinks(self):
+        random.seed(0)
+        files = stream.Split(self.dataset, stream.FileSink())
+        random.seed(0)
+        memory = stream.Split(self.dataset, stream.MemorySink(), size=7)
+        self.assertEqual(files.nrows, 49)
+        # Files and memory hold the same rows, as strings in the files.
+        for rows, path in ((memory.data, files.data_path), (memory.pii, files.pii_path), (memory.link, files.link_path)):
+            self.assertEqual([list(map(str, row)) for row in rows], self.read(path)[1:])
+
+        batches = []
+        shuffled = []
+        stream.Split(self.dataset, stream.CallbackSink(batches.append, lambda pii, link: shuffled.append(link)), size=25)
+        self.assertEqual([len(b) for b in batches], [25, 24])
+        self.assertEqual(sorted(r for r, _ in shuffled[0]), list(range(1, 50)))
+
+    def split_opened(self, sink, error):
+        """
+        Split into a sink that is expected to fail with error, returning the
+        manifest outputs that it opened.
+        """
+        opened = []
+        open_ = manifest._Recorded._open
+
+        def _open(f, path, atomic):
+            digest = open_(f, path, atomic)
+            opened.append(f)
+            return digest
+
+        manifest._Recorded._open = _open
+        try:
+            with self.assertRaises(error):
+                stream.Split(self.dataset, sink, size=20)
+        finally:
+            manifest._Recorded._open = open_
+        return opened
+
+    def test_open_failure(self):
+        # The data file is closed, without a manifest entry, if the PII file
+        # cannot be opened.
+        opened = self.split_opened(stream.FileSink(pii_path=os.path.join(self.output_dir, "missing", "tax.txt")),
+                                   FileNotFoundError)
+        self.assertEqual([f.closed for f in opened], [True])
+        self.assertEqual(manifest.read(os.path.dirname(config.get_path("tax", "data"))), {})
+
+    def test_split_failure(self):
+        # A split that fails partway through closes the files, without
+        # manifest entries, and finishes its progress as failed.
+        class FailingSink(stream.FileSink):
+            def write_data(self, rows):
+                super(FailingSink, self).write_data(rows)
+                if self.nrows > 20:
+                    raise RuntimeError()
+
+        os.makedirs(self.output_dir)
+        config.set_option("PROGRESS_FILE", os.path.join(self.output_dir, "progress.json"))
+        opened = self.split_opened(FailingSink(), RuntimeError)
+        self.assertEqual([f.closed for f in opened], [True, True, True])
+        for name in ("data", "pii", "link"):
+            self.assertEqual(manifest.read(os.path.dirname(config.get_path("tax", name))), {})
+        self.assertEqual(progress.read_status()["tasks"]["tax"]["state"], "failed")
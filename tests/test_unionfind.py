@@ -0,0 +1,28 @@
+import unittest
+
+import numpy as np
+
+from sirad import unionfind
+
+
+class TestUnionFind(unittest.TestCase):
+
+    def test_components(self):
+        root = unionfind.components(7, [5, 3, 1], [6, 5, 0])
+        self.assertEqual(list(root), [0, 0, 2, 3, 4, 3, 3])
+
+    def test_random(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        u = rng.integers(0, n, 1500)
+        v = rng.integers(0, n, 1500)
+        # Compare with a sequential union-find.
+        parent = list(range(n))
+        def find(x):
+            while parent[x] != x:
+                x = parent[x]
+            return x
+        for a, b in zip(u, v):
+            ra, rb = find(a), find(b)
+            parent[max(ra, rb)] = min(ra, rb)
+        self.assertEqual(list(unionfind.components(n, u, v)), [find(x) for x in range(n)])